@@ -6,7 +6,7 @@ import numpy as np
 from collections import defaultdict
 from collections import OrderedDict
 
-from openalex import all_journal_metadata_flat
+from openalex import get_all_journal_metadata_flat
 
 class ApcJournal(object):
     years = list(range(0, 5))
@@ -43,7 +43,7 @@ class ApcJournal(object):
 
     @cached_property
     def journal_metadata(self):
-        return all_journal_metadata_flat.get(self.issn_l, {})
+        return get_all_journal_metadata_flat().get(self.issn_l, {})
 
     @cached_property
     def issns(self):
@@ -19,7 +19,11 @@ import boto3
 warnings.filterwarnings("ignore", category=UserWarning, module='psycopg2')
 import psycopg2
 import psycopg2.extras # needed though you wouldn't guess it
-from psycopg2.pool import ThreadedConnectionPool
+from db_pool import InstrumentedConnectionPool
+from db_pool import db_caller_name
+from db_pool import pool_setting
+from db_pool import DEFAULT_POOL_MINCONN, DEFAULT_POOL_MAXCONN, DEFAULT_POOL_WAIT_SECONDS
+from lazy_data import register_dataset
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
@@ -37,6 +41,9 @@ JISC_PACKAGE_ID = "package-3WkCDEZTqo6S"
 JISC_INSTITUTION_ID = "institution-Afxc4mAYXoJH"
 USE_PAPER_GROWTH = False
 DATABASE_URL = os.getenv("DATABASE_URL_REDSHIFT_TEST") if os.getenv("TESTING_DB") else os.getenv("DATABASE_URL_REDSHIFT")
+DB_POOL_MINCONN = pool_setting("DB_POOL_MINCONN", DEFAULT_POOL_MINCONN)
+DB_POOL_MAXCONN = pool_setting("DB_POOL_MAXCONN", DEFAULT_POOL_MAXCONN)
+DB_POOL_WAIT_SECONDS = pool_setting("DB_POOL_WAIT_SECONDS", DEFAULT_POOL_WAIT_SECONDS)
 
 # set up logging
 # see http://wiki.pylonshq.com/display/pylonscookbook/Alternative+logging+configuration
@@ -146,7 +153,7 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = { "pool_pre_ping": True,
 #
 # db = NullPoolSQLAlchemy(app, session_options={"autoflush": False})
 
-app.config["SQLALCHEMY_POOL_SIZE"] = 200
+app.config["SQLALCHEMY_POOL_SIZE"] = DB_POOL_MAXCONN
 db = SQLAlchemy(app, session_options={"autoflush": False, "autocommit": False})
 
 # do compression.  has to be above flask debug toolbar so it can override this.
@@ -169,7 +176,8 @@ Compress(app)
 app.config["COMPRESS_DEBUG"] = compress_json
 
 redshift_url = urllib.parse.urlparse(DATABASE_URL)
-app.config['postgreSQL_pool'] = ThreadedConnectionPool(2, 200,
+app.config['postgreSQL_pool'] = InstrumentedConnectionPool(DB_POOL_MINCONN, DB_POOL_MAXCONN,
+                                  wait_seconds=DB_POOL_WAIT_SECONDS,
                                   database=redshift_url.path[1:],
                                   user=redshift_url.username,
                                   password=redshift_url.password,
@@ -183,11 +191,13 @@ app.config['postgreSQL_pool'] = ThreadedConnectionPool(2, 200,
 app.config['PROFILE_REQUESTS'] = (os.getenv("PROFILE_REQUESTS", False) == "True")
 
 logger.info("Database URL host: {}".format(redshift_url.hostname))
+logger.info("Database pool: {}-{} connections, {} second wait".format(DB_POOL_MINCONN, DB_POOL_MAXCONN, DB_POOL_WAIT_SECONDS))
 
 @contextmanager
 def get_db_connection():
+    # raises DbPoolTimeout if no connection frees up in time
+    connection = app.config['postgreSQL_pool'].getconn()
     try:
-        connection = app.config['postgreSQL_pool'].getconn()
         connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
         connection.autocommit=True
         # connection.readonly = True
@@ -200,7 +210,9 @@ def get_db_connection():
 
 @contextmanager
 def get_db_cursor(commit=False, use_realdictcursor=False, use_defaultcursor=False):
+    caller = db_caller_name()
     with get_db_connection() as connection:
+        start = time()
         if use_realdictcursor:
             # takes more memory, so default is no
             cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
@@ -220,7 +232,7 @@ def get_db_cursor(commit=False, use_realdictcursor=False, use_defaultcursor=Fals
                 pass
         finally:
             cursor.close()
-            pass
+            app.config['postgreSQL_pool'].stats.record_query(caller, time() - start)
 
 s3_client = boto3.client("s3")
 print("made s3_client")
@@ -315,24 +327,8 @@ def fetch_common_package_data():
     from common_data import gather_common_data
     return gather_common_data()
 
-common_data_dict = None
-
-def warm_common_data(lst):
-    lst.append(fetch_common_package_data())
-
-# NOTE: we have to do this when app loads for now - return to this later 
-## if there's a different take on dealing with common data
-# if os.getenv('PRELOAD_LARGE_TABLES', False) == 'True':
-if not common_data_dict:
-    import threading
-    import time
-    an_lst = []
-    t = threading.Thread(target=warm_common_data, args=[an_lst])
-    t.daemon = True
-    t.start()
-    while t.is_alive():
-        time.sleep(0.1)
-    common_data_dict = an_lst[0]
-    print("warm_common_data done!")
-else:
-    print("not warming common data cache")
+common_data = register_dataset("common_data", fetch_common_package_data)
+
+def get_common_data_dict():
+    # loaded on first use, or at boot if preloaded (see lazy_data.py)
+    return common_data.get()
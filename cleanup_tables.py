@@ -16,7 +16,12 @@ if __name__ == "__main__":
         jump_perpetual_access_input
         jump_raw_file_upload_object
         jump_scenario_computed
+        jump_scenario_computed_version
+        jump_scenario_computed_member_hash
+        jump_scenario_computed_aggregate
         jump_scenario_details_paid
+        jump_scenario_details_paid_archive
+        jump_scenario_details_latest
         jump_user_institution_permission
         jump_user_institution_permission
         jump_oa_all_vars
@@ -4,21 +4,37 @@ from cached_property import cached_property
 from collections import defaultdict
 from collections import OrderedDict
 import datetime
+import hashlib
+import os
 from multiprocessing.pool import ThreadPool
 import threading
 import weakref
 from time import time
+import shortuuid
 import simplejson as json
 from simplejson import dumps
 from psycopg2 import sql
-from psycopg2.extras import execute_values
 from kids.cache import cache
 
 from app import app
 from app import get_db_cursor
 from app import reset_cache
+from consortium_aggregates import ConsortiumAggregates
+from consortium_aggregates import StoredConsortiumTotals
+from consortium_aggregates import MEMBER_COLUMNS
+from consortium_aggregates import aggregate_insert_statement
+from consortium_aggregates import members_hash
 from consortium_journal import ConsortiumJournal
+from consortium_progress import PROGRESS_DONE
+from consortium_progress import RecomputeProgress
+from consortium_progress import get_progress
+from consortium_progress import is_finished
 from package import Package
+from package_cache import apply_remote_invalidations
+from redshift_copy import CopyStagingFile
+from redshift_copy import merge_into_table
+from response_cache import bump_content_versions
+from response_cache import scenario_key
 from util import elapsed
 from util import chunks
 from util import uniquify_list
@@ -55,20 +71,220 @@ def get_consortium_ids():
         return cursor.fetchall()
 
 
+SCENARIO_COMPUTED_COLUMNS = ["member_package_id","scenario_id","updated","issn_l","usage","cpu","package_id",
+    "consortium_name","institution_name","institution_short_name","institution_id","subject",
+    "era_subjects","is_society_journal","subscription_cost","ill_cost","use_instant_for_debugging",
+    "use_social_networks","use_oa","use_backfile","use_subscription","use_other_delayed","use_ill",
+    "perpetual_access_years","baseline_access","use_social_networks_percent","use_green_percent",
+    "use_hybrid_percent","use_bronze_percent","use_peer_reviewed_percent","bronze_oa_embargo_months",
+    "is_hybrid_2019","downloads","citations","authorships",]
+SCENARIO_COMPUTED_COLUMN_STRING = ", ".join(SCENARIO_COMPUTED_COLUMNS)
+
+
+# jump_scenario_computed only changes when recompute_journal_dicts swaps in a finished
+# run, and each swap writes a new compute_version in the same transaction.  readers can
+# keep using what they've already read for as long as the version hasn't moved.
+#
+# create table jump_scenario_computed_version (scenario_id text, compute_version text, num_rows int, updated timestamp);
+
+CONSORTIUM_COMPUTED_CACHE_SIZE = int(os.getenv("CONSORTIUM_COMPUTED_CACHE_SIZE", 10))
+_computed_data_cache = OrderedDict()
+_computed_data_cache_lock = threading.Lock()
+
+# the stored aggregates (see consortium_get_stored_totals) are also fixed for a
+# compute_version, so they're kept the same way, per set of included members
+_stored_totals_cache = OrderedDict()
+_stored_totals_cache_lock = threading.Lock()
+
+
+# recompute_journal_dicts only recomputes members whose inputs changed since their rows
+# were written.  bump this when the computation itself changes, to recompute everyone
+#
+# create table jump_scenario_computed_member_hash (scenario_id text, member_package_id text, input_hash text, updated timestamp);
+COMPUTE_INPUTS_VERSION = 1
+
+
+def citation_tables_version():
+    # jump_citing and jump_authorship are shared by everyone and only reloaded in bulk, so
+    # their size stands in for their contents.  the year matters because only earlier
+    # years are counted
+    command = """select (select count(*) from jump_citing) as num_citing,
+        (select count(*) from jump_authorship) as num_authorship"""
+    with get_db_cursor() as cursor:
+        cursor.execute(command)
+        row = cursor.fetchone()
+    return [row["num_citing"], row["num_authorship"], datetime.datetime.utcnow().year]
+
+
+def member_db_inputs(member_package_id, institution_id):
+    # inputs read straight from the db rather than through package_cache: the grid ids
+    # that pick the member's citations and authorships (add_ror changes them), its core
+    # journals (baseline_access) and its apc authorships
+    with get_db_cursor() as cursor:
+        cursor.execute("select grid_id from jump_grid_id where institution_id=%s order by grid_id", (institution_id,))
+        grid_ids = [row["grid_id"] for row in cursor.fetchall()]
+        cursor.execute("select issn_l, baseline_access from jump_core_journals where package_id=%s order by issn_l", (member_package_id,))
+        core_rows = [[row["issn_l"], row["baseline_access"]] for row in cursor.fetchall()]
+        cursor.execute("select * from jump_apc_authorships where package_id=%s", (member_package_id,))
+        apc_rows = sorted([json.dumps(dict(row), sort_keys=True, default=myconverter) for row in cursor.fetchall()])
+    return {"grid_ids": grid_ids, "core_journals": core_rows, "apc_authorships": apc_rows}
+
+
+def member_input_hash(member_package_id, scenario_saved_dict, citation_version=None):
+    # everything a member's rows are computed from: the consortium's saved scenario, the
+    # member's counter, prices, perpetual access and title filters, its package settings,
+    # citations, authorships, core journals and apc authorships, and the journal metadata.
+    # cost_bigdeal depends on which members are included, and only goes into
+    # scenario-wide totals, not the rows, so it's left out
+    import scenario  # registers the package_cache loaders
+    from openalex import journal_metadata_data
+    from package_cache import DATA_TYPES
+    from package_cache import get_package_issn_values
+
+    saved_dict = json.loads(json.dumps(scenario_saved_dict or {}, default=myconverter))
+    saved_dict.get("configs", {}).pop("cost_bigdeal", None)
+
+    my_package = Package.query.get(member_package_id)
+    journal_metadata_data.get()
+    inputs = {
+        "compute_inputs_version": COMPUTE_INPUTS_VERSION,
+        "saved": saved_dict,
+        "package": [my_package.currency, my_package.institution_id, my_package.institution.display_name,
+                    my_package.institution.old_username] if my_package else None,
+        "journal_metadata_version": journal_metadata_data.version,
+        "citation_version": citation_version if citation_version is not None else citation_tables_version(),
+    }
+    if my_package:
+        inputs.update(member_db_inputs(member_package_id, my_package.institution_id))
+    for data_type in DATA_TYPES:
+        inputs[data_type] = get_package_issn_values(member_package_id, data_type)
+
+    inputs_json = json.dumps(inputs, sort_keys=True, default=myconverter)
+    return hashlib.sha1(inputs_json.encode("utf-8")).hexdigest()
+
+
+def consortium_get_member_hashes(scenario_id):
+    command = """select member_package_id, input_hash from jump_scenario_computed_member_hash
+        where scenario_id=%s"""
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (scenario_id,))
+        rows = cursor.fetchall()
+    return dict([(row["member_package_id"], row["input_hash"]) for row in rows])
+
+
+def consortium_get_computed_version(scenario_id):
+    command = "select compute_version from jump_scenario_computed_version where scenario_id=%s order by updated desc limit 1"
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (scenario_id,))
+        rows = cursor.fetchall()
+    if rows:
+        return rows[0]["compute_version"]
+    return None
+
+
+class ConsortiumComputedData(object):
+    # one compute_version of a scenario's rows, as read from the db
+    def __init__(self, version, rows):
+        self.version = version
+        self.rows = rows
+        self.lock = threading.Lock()
+        self._aggregates = None
+
+    def row_dicts(self):
+        # callers add keys to the row dicts, so everyone gets their own
+        return cursor_rows_to_dicts(SCENARIO_COMPUTED_COLUMN_STRING, self.rows)
+
+    @property
+    def aggregates(self):
+        with self.lock:
+            if self._aggregates is None:
+                self._aggregates = ConsortiumAggregates(SCENARIO_COMPUTED_COLUMNS, self.rows)
+        return self._aggregates
+
+
+def consortium_get_computed(scenario_id):
+    # rows from the last finished recompute, kept per process until the version changes
+    version = consortium_get_computed_version(scenario_id)
+    with _computed_data_cache_lock:
+        cached = _computed_data_cache.get(scenario_id, None)
+        if cached and version and cached.version == version:
+            _computed_data_cache.move_to_end(scenario_id)
+            return cached
+
+    computed = ConsortiumComputedData(version, _read_computed_rows(scenario_id))
+
+    # don't cache if a swap happened while we were reading
+    if version and version == consortium_get_computed_version(scenario_id):
+        with _computed_data_cache_lock:
+            _computed_data_cache[scenario_id] = computed
+            _computed_data_cache.move_to_end(scenario_id)
+            while len(_computed_data_cache) > CONSORTIUM_COMPUTED_CACHE_SIZE:
+                _computed_data_cache.popitem(last=False)
+    return computed
+
+
 def consortium_get_computed_data(scenario_id):
-    start_time = time()
-    command = """select 
-                    member_package_id, scenario_id, updated, issn_l, usage, cpu, package_id, consortium_name, institution_name, institution_short_name, institution_id, subject, era_subjects, is_society_journal, subscription_cost, ill_cost, use_instant_for_debugging, use_social_networks, use_oa, use_backfile, use_subscription, use_other_delayed, use_ill, perpetual_access_years, baseline_access, use_social_networks_percent, use_green_percent, use_hybrid_percent, use_bronze_percent, use_peer_reviewed_percent, bronze_oa_embargo_months, is_hybrid_2019, downloads, citations, authorships
-                    from jump_scenario_computed where scenario_id=%s"""
+    return consortium_get_computed(scenario_id).row_dicts()
+
+
+def _read_computed_rows(scenario_id):
+    command = """select {} from jump_scenario_computed where scenario_id=%s""".format(SCENARIO_COMPUTED_COLUMN_STRING)
     with get_db_cursor(use_defaultcursor=True) as cursor:
         cursor.execute(command, (scenario_id,))
         rows = cursor.fetchall()
+    return rows
+
+
+def consortium_get_stored_totals(scenario_id, compute_version, member_package_ids):
+    # the warehouse's sums for exactly this version and these members, or None.
+    # kept per process, so it's read once per version and set of members
+    if not compute_version:
+        return None
+    cache_key = (scenario_id, compute_version, members_hash(member_package_ids))
+    with _stored_totals_cache_lock:
+        cached = _stored_totals_cache.get(cache_key, None)
+        if cached is not None:
+            _stored_totals_cache.move_to_end(cache_key)
+            return cached
+
+    command = """select * from jump_scenario_computed_aggregate
+        where scenario_id=%s and compute_version=%s and members_hash=%s"""
+    with get_db_cursor(use_realdictcursor=True) as cursor:
+        cursor.execute(command, cache_key)
+        rows = cursor.fetchall()
+    if not rows:
+        # not cached: the aggregate may be written for these members later
+        return None
+
+    # the member columns only come from the full table, so they're read once per version
+    # and shared by every set of members
+    members = None
+    with _stored_totals_cache_lock:
+        for (key, totals) in _stored_totals_cache.items():
+            if key[0:2] == cache_key[0:2]:
+                members = totals.members
+                break
+    if members is None:
+        command = """select distinct member_package_id, {} from jump_scenario_computed where scenario_id=%s""".format(
+            ", ".join(MEMBER_COLUMNS))
+        with get_db_cursor(use_realdictcursor=True) as cursor:
+            cursor.execute(command, (scenario_id,))
+            member_rows = cursor.fetchall()
+        members = dict([(row["member_package_id"], row) for row in member_rows])
+
+    totals = StoredConsortiumTotals(rows, members)
+    with _stored_totals_cache_lock:
+        _stored_totals_cache[cache_key] = totals
+        _stored_totals_cache.move_to_end(cache_key)
+        while len(_stored_totals_cache) > CONSORTIUM_COMPUTED_CACHE_SIZE:
+            _stored_totals_cache.popitem(last=False)
+    return totals
 
-    column_string = """member_package_id, scenario_id, updated, issn_l, usage, cpu, package_id, consortium_name, institution_name, institution_short_name, institution_id, subject, era_subjects, is_society_journal, subscription_cost, ill_cost, use_instant_for_debugging, use_social_networks, use_oa, use_backfile, use_subscription, use_other_delayed, use_ill, perpetual_access_years, baseline_access, use_social_networks_percent, use_green_percent, use_hybrid_percent, use_bronze_percent, use_peer_reviewed_percent, bronze_oa_embargo_months, is_hybrid_2019, downloads, citations, authorships"""
-    start_time = time()
-    response = cursor_rows_to_dicts(column_string, rows)
 
-    return response
+def consortium_refresh_aggregate(scenario_id, compute_version, member_package_ids):
+    (command, values) = aggregate_insert_statement(scenario_id, compute_version, member_package_ids)
+    with get_db_cursor() as cursor:
+        cursor.execute("begin;\n{};\ncommit;".format(command), values)
 
 
 def consortium_get_issns(scenario_id):
@@ -119,6 +335,54 @@ def jsonify_fast_no_sort_simple(*args, **kwargs):
               sort_keys=sort_keys)
 
 
+class ConsortiumMembers(object):
+    # who is in a consortium scenario, as sets and dicts so the per row loops in
+    # Consortium do lookups instead of list scans
+    def __init__(self, scenario_id, included_member_package_ids):
+        self.scenario_id = scenario_id
+        self.included_list = included_member_package_ids
+        self.included = frozenset(included_member_package_ids)
+
+    def is_included(self, member_package_id):
+        return member_package_id in self.included
+
+    @cached_property
+    def feedback_by_package_id(self):
+        command = "select * from jump_consortium_feedback_requests where consortium_scenario_id=%s"
+        with get_db_cursor() as cursor:
+            cursor.execute(command, (self.scenario_id,))
+            rows = cursor.fetchall()
+        # same as the old nested loop: if a member has more than one, the last one wins
+        return dict([(row["member_package_id"], row) for row in rows])
+
+    @cached_property
+    def feedback_scenarios(self):
+        # {member_scenario_id: (updated, scenario_data)} for every feedback request, in one query
+        from saved_scenario import get_latest_scenarios_raw
+        member_scenario_ids = [row["member_scenario_id"] for row in self.feedback_by_package_id.values()]
+        return get_latest_scenarios_raw(member_scenario_ids, exclude_added_via_pushpull=True)
+
+    def __repr__(self):
+        return "<{} ({}) {} included>".format(self.__class__.__name__, self.scenario_id, len(self.included))
+
+
+def add_member_status(rows, members):
+    # to_dict_institutions rows: whether each member is included, and its feedback
+    # request dates and member added subscriptions
+    for row in rows:
+        if members.is_included(row["package_id"]):
+            row["included"] = True
+        row_for_feedback = members.feedback_by_package_id.get(row["package_id"], None)
+        if row_for_feedback:
+            row["sent_date"] = row_for_feedback["sent_date"]
+            row["return_date"] = row_for_feedback["return_date"]
+            (updated, scenario_data) = members.feedback_scenarios.get(row_for_feedback["member_scenario_id"], (None, None))
+            row["changed_date"] = updated
+            row["member_added_subrs"] = []
+            if scenario_data:
+                row["member_added_subrs"] = scenario_data.get("member_added_subrs", [])
+
+
 class Consortium(object):
     def __init__(self, scenario_id, package_id=None):
         self.scenario_id = None
@@ -154,10 +418,22 @@ class Consortium(object):
             return member_institutions_status
         return self.all_member_package_ids
 
+    @cached_property
+    def members(self):
+        return ConsortiumMembers(self.scenario_id, self.member_institution_included_list)
+
+    @cached_property
+    def subscribed_issn_ls(self):
+        return frozenset(self.scenario_saved_dict.get("subrs", []))
+
+    @cached_property
+    def custom_subscribed_issn_ls(self):
+        return frozenset(self.scenario_saved_dict.get("customSubrs", []))
+
     @cached_property
     def big_deal_cost_for_included_members(self):
         rows = big_deal_costs_for_members()
-        big_deal_cost_for_included_members = [row["big_deal_cost"] for row in rows if row["package_id"] in self.member_institution_included_list]
+        big_deal_cost_for_included_members = [row["big_deal_cost"] for row in rows if self.members.is_included(row["package_id"])]
         my_sum = sum(big_deal_cost_for_included_members)
         return my_sum
 
@@ -191,16 +467,23 @@ class Consortium(object):
 
     @cached_property
     def update_percent_complete(self):
+        # jump_scenario_computed keeps the previous run's rows until the new run is
+        # swapped in, so progress comes from the row the running recompute updates
         if self.is_locked_pending_update:
-            command = "select count(distinct member_package_id) as num_members_done from jump_scenario_computed where scenario_id=%s"
-            with get_db_cursor() as cursor:
-                cursor.execute(command, (self.scenario_id,))
-                rows = cursor.fetchall()
-            if rows:
-                num_members_done = rows[0]["num_members_done"]
-                return 100 * float(num_members_done)/len(self.all_member_package_ids)
+            progress = get_progress(self.scenario_id)
+            if progress and not is_finished(progress):
+                return progress["percent_complete"]
+            return 0.0
         return None
 
+    @cached_property
+    def computed_version(self):
+        return consortium_get_computed_version(self.scenario_id)
+
+    def refresh_computed_aggregate(self):
+        # after the included members change
+        consortium_refresh_aggregate(self.scenario_id, self.computed_version, self.member_institution_included_list)
+
     @cached_property
     def journals_sorted_cpu(self):
         my_journals = []
@@ -226,21 +509,21 @@ class Consortium(object):
 
         response = []
         if (len(member_ids) > 0) and (member_ids[0]):
-            members_to_export = member_ids
+            members_to_export = set(member_ids)
         else:
-            members_to_export = self.member_institution_included_list
+            members_to_export = self.members.included
 
         for row in rows:
             issn_l = row["issn_l"]
-            journal_metadata = self.my_package.get_journal_metadata(issn_l)
             if row["member_package_id"] in members_to_export:
+                journal_metadata = self.my_package.get_journal_metadata(issn_l)
                 row["title"] = journal_metadata.title
                 row["issns"] = journal_metadata.display_issns
 
                 row["package_id"] = row["member_package_id"]
                 row["institution_code"] = row["package_id"].replace("package-solojiscels", "")
 
-                row["subscribed_by_consortium"] = (issn_l in self.scenario_saved_dict.get("subrs", [])) or (issn_l in self.scenario_saved_dict.get("customSubrs", []))
+                row["subscribed_by_consortium"] = (issn_l in self.subscribed_issn_ls) or (issn_l in self.custom_subscribed_issn_ls)
                 row["subscribed_by_member_institution"] = (row["member_package_id"], issn_l) in self.all_member_added_subscriptions
                 row["core_plus_for_member_institution"] = row["subscribed_by_consortium"] or row["subscribed_by_member_institution"]
 
@@ -285,21 +568,38 @@ class Consortium(object):
 
     def copy_computed_journal_dicts(self, new_scenario_id):
         values_column_names = """member_package_id, scenario_id, updated, issn_l, usage, cpu, package_id, consortium_name, institution_name, institution_short_name, institution_id, subject, era_subjects, is_society_journal, subscription_cost, ill_cost, use_instant_for_debugging, use_social_networks, use_oa, use_backfile, use_subscription, use_other_delayed, use_ill, perpetual_access_years, baseline_access, use_social_networks_percent, use_green_percent, use_hybrid_percent, use_bronze_percent, use_peer_reviewed_percent, bronze_oa_embargo_months, is_hybrid_2019, downloads, citations, authorships"""
-        values_column_names_with_sub = values_column_names.replace("scenario_id", "'{}'".format(new_scenario_id))
+        values_column_names_with_sub = values_column_names.replace("scenario_id", "%(new_scenario_id)s")
 
-        q = """
+        # one transaction that replaces whatever is there, so running it again (a requeued
+        # copy job, say) doesn't copy the rows twice
+        q = """begin;
+                delete from jump_scenario_computed where scenario_id = %(new_scenario_id)s;
                 insert into jump_scenario_computed 
                 ({values_column_names}) 
                 (
                     select {values_column_names_with_sub}
                     from jump_scenario_computed
-                    where scenario_id = '{old_scenario_id}'
-                )
-            """.format(old_scenario_id=self.scenario_id,
-                       values_column_names=values_column_names,
+                    where scenario_id = %(old_scenario_id)s
+                );
+                delete from jump_scenario_computed_version where scenario_id = %(new_scenario_id)s;
+                insert into jump_scenario_computed_version (scenario_id, compute_version, num_rows, updated)
+                    values (%(new_scenario_id)s, %(compute_version)s, null, sysdate);
+                commit;
+            """.format(values_column_names=values_column_names,
                        values_column_names_with_sub=values_column_names_with_sub)
+        copied = {"done": False}
         with get_db_cursor() as cursor:
-            cursor.execute(q)
+            try:
+                cursor.execute(q, {"new_scenario_id": new_scenario_id, "old_scenario_id": self.scenario_id,
+                                   "compute_version": shortuuid.uuid()[0:12]})
+            except Exception:
+                cursor.execute("rollback")
+                raise
+            copied["done"] = True
+        # get_db_cursor prints and swallows errors, so make sure they're noticed
+        if not copied["done"]:
+            raise Exception("copying computed rows from {} to {} failed, see the error above".format(self.scenario_id, new_scenario_id))
+        bump_content_versions([scenario_key(new_scenario_id)])
 
     @cached_property
     def all_member_package_ids(self):
@@ -328,15 +628,59 @@ class Consortium(object):
                 sql.SQL(', ').join(sql.Placeholder() * len(cols)))
             print(cursor.mogrify(qry, values))
             cursor.execute(qry, values)
+        RecomputeProgress(self.scenario_id, num_member_institutions).queued()
+        # the dashboard shows it as locked now
+        bump_content_versions([scenario_key(self.scenario_id)])
 
 
-    def recompute_journal_dicts(self):
+    def member_input_hashes(self, member_package_ids):
+        response = {}
+        citation_version = citation_tables_version()
+        for member_package_id in member_package_ids:
+            try:
+                response[member_package_id] = member_input_hash(member_package_id, self.scenario_saved_dict, citation_version)
+            except Exception as e:
+                # no hash means it's always recomputed
+                print("Error: exception {} hashing inputs for {}".format(e, member_package_id))
+                response[member_package_id] = None
+        return response
 
-        # delete everything with this scenario_id first
-        q = "delete from jump_scenario_computed where scenario_id=%s"
-        with get_db_cursor() as cursor:
-            print(cursor.mogrify(q, (self.scenario_id,)))
-            cursor.execute(q, (self.scenario_id,))
+    def recompute_journal_dicts(self, member_package_ids=None, issn_ls=None, only_changed_members=True, progress=None):
+        # member_package_ids and issn_ls narrow the recompute to just those rows,
+        # for uploads that only changed a few journals for one member.
+        # otherwise members whose inputs hash the same as last time keep their rows.
+        # progress, if given, is called with (num_members_done, num_members) as members finish
+        input_hashes = {}
+        num_members_skipped = 0
+        removed_member_package_ids = set()
+        is_full_recompute = member_package_ids is None and issn_ls is None
+        if member_package_ids is None:
+            member_package_ids = self.all_member_package_ids
+            if issn_ls is None:
+                # an upload queues the recompute just after invalidating the package cache
+                apply_remote_invalidations()
+                input_hashes = self.member_input_hashes(member_package_ids)
+                if only_changed_members:
+                    old_hashes = consortium_get_member_hashes(self.scenario_id)
+                    removed_member_package_ids = set(old_hashes.keys()) - set(member_package_ids)
+                    changed_member_package_ids = [member_package_id for member_package_id in member_package_ids
+                        if not input_hashes[member_package_id] or old_hashes.get(member_package_id, None) != input_hashes[member_package_id]]
+                    num_members_skipped = len(member_package_ids) - len(changed_member_package_ids)
+                    print("recomputing {} of {} members for {}".format(
+                        len(changed_member_package_ids), len(member_package_ids), self.scenario_id))
+                    member_package_ids = changed_member_package_ids
+
+        if issn_ls is not None:
+            issn_ls = set(issn_ls)
+        if (not member_package_ids and not removed_member_package_ids) or (issn_ls is not None and not issn_ls):
+            # nothing to recompute, but the queued progress row still needs its run to end
+            num_members = num_members_skipped + len(member_package_ids)
+            print("nothing to recompute for {}".format(self.scenario_id))
+            RecomputeProgress(self.scenario_id, num_members, num_members).start(status=PROGRESS_DONE)
+            if progress:
+                progress(num_members, num_members)
+            self.reset_computed_caches()
+            return
 
         from scenario import Scenario
 
@@ -347,59 +691,101 @@ class Consortium(object):
         print("starting threads")
 
         def get_insert_rows_for_member(member_package_id):
-            command_list = []
+            command_list = None
             print("in get_insert_rows_for_member with", member_package_id, self.scenario_id)
             try:
                 with app.app_context():
                     print("len(app.my_memorycache_dict)", len(app.my_memorycache_dict))
 
                     my_live_scenario = Scenario(member_package_id, self.scenario_saved_dict, my_jwt=None)
-                    command_list = [my_journal.to_values_journals_for_consortium() for my_journal in my_live_scenario.journals]
-
-                    # save all of these in the db
-                    print("now writing to db", member_package_id, self.scenario_id)
-
-                    start_time = time()
-
-                    cols = ["member_package_id","scenario_id","updated","issn_l","usage","cpu","package_id",
-                        "consortium_name","institution_name","institution_short_name","institution_id","subject",
-                        "era_subjects","is_society_journal","subscription_cost","ill_cost","use_instant_for_debugging",
-                        "use_social_networks","use_oa","use_backfile","use_subscription","use_other_delayed","use_ill",
-                        "perpetual_access_years","baseline_access","use_social_networks_percent","use_green_percent",
-                        "use_hybrid_percent","use_bronze_percent","use_peer_reviewed_percent","bronze_oa_embargo_months",
-                        "is_hybrid_2019","downloads","citations","authorships",]
+                    command_list = [my_journal.to_values_journals_for_consortium() for my_journal in my_live_scenario.journals
+                                    if issn_ls is None or my_journal.issn_l in issn_ls]
 
                     # use [:] to replace in place to keep same object id() (identity) & reduce memory
                     for lst in command_list:
                         lst[:] = [self.package_id if x=='package_id' else x for x in lst]
                         lst[:] = [self.scenario_id if x=='scenario_id' else x for x in lst]
                         lst[:] = [self.consortium_name if x=='consortium_name' else x for x in lst]
-                    
-                    # convert list to tuples, as required by psycopg2
-                    command_list = [tuple(w) for w in command_list]
-
-                    with get_db_cursor() as cursor:
-                        qry = sql.SQL("INSERT INTO jump_scenario_computed ({}) VALUES %s").format(
-                            sql.SQL(', ').join(map(sql.Identifier, cols)))
-                        execute_values(cursor, qry, command_list, page_size=1000)
 
-                    print((elapsed(start_time)))
-                    print("done writing to db", member_package_id, self.scenario_id)
+                    print("done computing", member_package_id, self.scenario_id)
 
             except Exception as e:
+                # same as before: the member's rows are left out rather than stopping everyone else's
                 print("In get_insert_rows_for_member with Error: ", e)
-                raise
-            return command_list
-
-        results = my_thread_pool.imap_unordered(get_insert_rows_for_member, self.all_member_package_ids)
+                command_list = None
+            return (member_package_id, command_list)
+
+        # every member's rows go into one staging file, then one COPY and one swap
+        # replace this scenario's old rows.  until then readers see the old rows
+        staging_file = CopyStagingFile("jump_scenario_computed_{}".format(self.scenario_id), SCENARIO_COMPUTED_COLUMNS)
+        num_members = num_members_skipped + len(member_package_ids)
+        recompute_progress = RecomputeProgress(self.scenario_id, num_members, num_members_skipped)
+        recompute_progress.start()
+        computed_member_package_ids = []
+        results = my_thread_pool.imap_unordered(get_insert_rows_for_member, member_package_ids)
+        for num_members_done, (member_package_id, command_list) in enumerate(results, num_members_skipped + 1):
+            if command_list is not None:
+                staging_file.writerows(command_list)
+                computed_member_package_ids.append(member_package_id)
+            recompute_progress.member_done(num_members_done, staging_file.num_rows)
+            if progress:
+                progress(num_members_done, num_members)
         my_thread_pool.close()
         my_thread_pool.join()
         my_thread_pool.terminate()
         print("done with threads")
 
-        # clear cache
+        # only members that computed lose their old rows.  a member that failed keeps
+        # what it had, and losing its hash below means it's tried again next time.
+        # ("",) stands in for an empty list, which isn't valid sql.  no package_id is ""
+        if is_full_recompute:
+            # members that have left the consortium lose their rows too
+            where = "scenario_id=%s and (member_package_id in %s or member_package_id not in %s)"
+            values = (self.scenario_id, tuple(computed_member_package_ids) or ("",), tuple(self.all_member_package_ids) or ("",),)
+        elif issn_ls is None:
+            where = "scenario_id=%s and member_package_id in %s"
+            values = (self.scenario_id, tuple(computed_member_package_ids) or ("",),)
+        else:
+            where = "scenario_id=%s and member_package_id in %s and issn_l in %s"
+            values = (self.scenario_id, tuple(computed_member_package_ids) or ("",), tuple(issn_ls),)
+
+        print("now writing to db", self.scenario_id)
+        start_time = time()
+        compute_version = shortuuid.uuid()[0:12]
+        new_version_statements = [
+            ("delete from jump_scenario_computed_version where scenario_id=%s", (self.scenario_id,)),
+            ("""insert into jump_scenario_computed_version (scenario_id, compute_version, num_rows, updated)
+                values (%s, %s, %s, sysdate)""", (self.scenario_id, compute_version, staging_file.num_rows)),
+        ]
+        if input_hashes:
+            # failed members lose their hash, so they're tried again next time
+            new_version_statements.append(
+                ("""delete from jump_scenario_computed_member_hash where scenario_id=%s
+                    and (member_package_id in %s or member_package_id not in %s)""",
+                 (self.scenario_id, tuple(member_package_ids) or ("",), tuple(self.all_member_package_ids) or ("",))))
+            hash_values = [(self.scenario_id, member_package_id, input_hashes[member_package_id])
+                           for member_package_id in computed_member_package_ids if input_hashes.get(member_package_id, None)]
+            if hash_values:
+                new_version_statements.append((
+                    """insert into jump_scenario_computed_member_hash (scenario_id, member_package_id, input_hash, updated)
+                    values {}""".format(", ".join(["(%s, %s, %s, sysdate)"] * len(hash_values))),
+                    [value for row in hash_values for value in row]))
+        new_version_statements.append(aggregate_insert_statement(self.scenario_id, compute_version, self.member_institution_included_list))
+        recompute_progress.writing()
+        try:
+            merge_into_table("jump_scenario_computed", staging_file, where, values, finish_statements=new_version_statements)
+        except Exception as e:
+            recompute_progress.failed(str(e))
+            raise
+        recompute_progress.done()
+        print("done writing {} rows to db for {}, took {}s".format(staging_file.num_rows, self.scenario_id, elapsed(start_time)))
+
+        self.reset_computed_caches()
+
+    def reset_computed_caches(self):
         print("clearing cache")
         reset_cache("consortium", "consortium_get_computed_data", self.scenario_id)
+        bump_content_versions([scenario_key(self.scenario_id)])
         print("cache clear set")
 
     def to_dict_journal_zoom(self, issn_l):
@@ -424,7 +810,7 @@ class Consortium(object):
         response = []
         if self.scenario_id is not None:
             for row in rows:
-                if row["package_id"] in self.member_institution_included_list:
+                if self.members.is_included(row["package_id"]):
                     response.append(row)
 
         return response
@@ -433,26 +819,20 @@ class Consortium(object):
     def journals(self):
         start_time = time()
 
-        issn_ls = consortium_get_issns(self.scenario_id)
-        start_time = time()
-        journals_dicts_by_issn_l = defaultdict(list)
-
-        rows = self.journal_member_data
-
-        for d in rows:
-            if d["member_package_id"] in self.member_institution_included_list:
-                journals_dicts_by_issn_l[d["issn_l"]].append(d)
+        # every journal's sums over the included members: stored by the warehouse if they're
+        # there for this version and these members, otherwise in one pass here.  see consortium_aggregates.py
+        totals = consortium_get_stored_totals(self.scenario_id, self.computed_version, self.member_institution_included_list)
+        if totals is None:
+            totals = consortium_get_computed(self.scenario_id).aggregates.totals(self.member_institution_included_list)
 
-        start_time = time()
         journal_list = []
-        for issn_l in issn_ls:
-            if len(journals_dicts_by_issn_l[issn_l]) > 0:
-                journal_list.append(ConsortiumJournal(issn_l, self.member_institution_included_list, journals_dicts_by_issn_l[issn_l], self.is_jisc, self.my_package))
+        for journal_index in totals.journal_indexes():
+            journal_list.append(ConsortiumJournal(totals.issn_l(journal_index), self.member_institution_included_list, totals, journal_index, self.is_jisc, self.my_package))
 
         for my_journal in journal_list:
-            if my_journal.issn_l in self.scenario_saved_dict.get("subrs", []):
+            if my_journal.issn_l in self.subscribed_issn_ls:
                 my_journal.set_subscribe_bulk()
-            if my_journal.issn_l in self.scenario_saved_dict.get("customSubrs", []):
+            if my_journal.issn_l in self.custom_subscribed_issn_ls:
                 my_journal.set_subscribe_custom()
 
         try:
@@ -469,15 +849,15 @@ class Consortium(object):
 
     @cached_property
     def all_member_added_subscriptions(self):
+        # set of (package_id, issn_l)
         institution_dicts = self.to_dict_institutions()
-        response = []
+        response = set()
         for my_dict in institution_dicts:
             for my_issn in my_dict.get("member_added_subrs", []):
-                response.append((my_dict["package_id"], my_issn))
+                response.add((my_dict["package_id"], my_issn))
         return response
 
     def to_dict_institutions(self):
-        from saved_scenario import get_latest_scenario_raw
         start_time = time()
 
         command = """with tags as (select institution_id, listagg(tag_string, ', ') as tag_listagg from jump_tag_institution group by institution_id)
@@ -501,24 +881,8 @@ class Consortium(object):
             cursor.execute(command, (self.scenario_id,))
             rows = cursor.fetchall()
 
-        command = "select * from jump_consortium_feedback_requests where consortium_scenario_id=%s"
-        with get_db_cursor() as cursor:
-            cursor.execute(command, (self.scenario_id,))
-            rows_for_feedback = cursor.fetchall()
-
         if self.scenario_id is not None:
-            for row in rows:
-                if row["package_id"] in self.member_institution_included_list:
-                    row["included"] = True
-                for row_for_feedback in rows_for_feedback:
-                    if row_for_feedback["member_package_id"] == row["package_id"]:
-                        row["sent_date"] = row_for_feedback["sent_date"]
-                        row["return_date"] = row_for_feedback["return_date"]
-                        (updated, scenario_data) = get_latest_scenario_raw(row_for_feedback["member_scenario_id"], exclude_added_via_pushpull=True)
-                        row["changed_date"] = updated
-                        row["member_added_subrs"] = []
-                        if scenario_data:
-                            row["member_added_subrs"] = scenario_data.get("member_added_subrs", [])
+            add_member_status(rows, self.members)
 
         return rows
 
@@ -0,0 +1,394 @@
+# coding: utf-8
+
+import hashlib
+import threading
+
+import numpy as np
+from cached_property import cached_property
+
+# A consortium dashboard shows, for each journal, sums over the included members' rows in
+# jump_scenario_computed.  This used to be a dict per row and a python loop per metric per
+# journal.  Here the rows are kept as columns (numpy arrays) and each metric is summed for
+# every journal at once with np.bincount.  ConsortiumJournal then reads its journal's
+# entries out of a ConsortiumTotals.
+
+# summed as is
+SUM_COLUMNS = ["usage", "downloads", "citations", "authorships", "ill_cost", "use_oa",
+               "use_subscription", "use_backfile", "use_ill", "use_other_delayed"]
+
+# summed as value * usage, for the usage weighted percents
+USAGE_WEIGHTED_COLUMNS = ["use_social_networks_percent", "use_green_percent", "use_hybrid_percent",
+                          "use_bronze_percent", "use_peer_reviewed_percent"]
+
+
+def float_column(values):
+    # None counts as 0, same as the old sum_attribute
+    response = np.array(values, dtype=float)
+    response[np.isnan(response)] = 0
+    return response
+
+
+def object_column(values):
+    response = np.empty(len(values), dtype=object)
+    response[:] = values
+    return response
+
+
+class ConsortiumAggregates(object):
+    # all of a scenario's computed rows, as columns.  read only once built, so one copy
+    # can be shared by every request for the same compute_version
+
+    def __init__(self, column_names, rows):
+        self.column_names = column_names
+        self.num_rows = len(rows)
+        if rows:
+            columns = list(zip(*rows))
+        else:
+            columns = [()] * len(column_names)
+        columns = dict(zip(column_names, columns))
+        self.objects = dict([(name, object_column(column)) for (name, column) in columns.items()])
+
+        self.issn_ls, self.issn_index = np.unique(self.objects["issn_l"].astype(str), return_inverse=True)
+        self.member_package_ids, self.member_index = np.unique(self.objects["member_package_id"].astype(str), return_inverse=True)
+        self.lock = threading.Lock()
+        self.last_totals = None
+        self.member_code_lookup = dict([(member_package_id, code) for (code, member_package_id) in enumerate(self.member_package_ids.tolist())])
+
+        usage = float_column(columns["usage"])
+        self.values = {}
+        for name in SUM_COLUMNS:
+            self.values[name] = float_column(columns[name])
+        for name in USAGE_WEIGHTED_COLUMNS:
+            self.values[name] = float_column(columns[name]) * usage
+
+    @cached_property
+    def member_rows(self):
+        # each member's rows, by member code
+        ordered_rows = np.argsort(self.member_index, kind="stable")
+        counts = np.bincount(self.member_index, minlength=len(self.member_package_ids))
+        return np.split(ordered_rows, np.cumsum(counts)[:-1])
+
+    def member_codes(self, member_package_ids):
+        # positions in self.member_package_ids, skipping members without rows
+        return set([self.member_code_lookup[member_package_id] for member_package_id in set(member_package_ids)
+                    if member_package_id in self.member_code_lookup])
+
+    def totals(self, member_package_ids):
+        # toggling a few members on the dashboard only adds or subtracts those members'
+        # rows from the last totals, instead of summing everyone again
+        member_codes = self.member_codes(member_package_ids)
+        with self.lock:
+            last_totals = self.last_totals
+        if last_totals is not None and last_totals.member_codes == member_codes:
+            return last_totals
+        if last_totals is not None and len(last_totals.member_codes ^ member_codes) < len(member_codes):
+            my_totals = last_totals.with_members(member_codes)
+        else:
+            my_totals = ConsortiumTotals(self, member_codes)
+        with self.lock:
+            self.last_totals = my_totals
+        return my_totals
+
+    def __repr__(self):
+        return "<{} {} rows, {} journals, {} members>".format(
+            self.__class__.__name__, self.num_rows, len(self.issn_ls), len(self.member_package_ids))
+
+
+class ConsortiumTotals(object):
+    # per journal sums over the rows of some of the members of a ConsortiumAggregates.
+    # read only once built: with_members makes a new one
+    #
+    # nonzero_counts are how many included rows have a non-zero value, per column.  adding
+    # and subtracting floats can leave a residue like 2.8e-17 where the true sum is 0, and
+    # consortium_journal relies on a 0 usage being exactly 0, so sums with no non-zero
+    # rows left are set back to 0.  the counts are ints, so they're exact.
+
+    def __init__(self, aggregates, member_codes, sums=None, num_rows=None, nonzero_counts=None):
+        self.aggregates = aggregates
+        self.member_codes = frozenset(member_codes)
+        if sums is not None:
+            self.sums = sums
+            self.num_rows = num_rows
+            self.nonzero_counts = nonzero_counts
+            return
+
+        num_journals = len(aggregates.issn_ls)
+        rows = self.rows
+        issn_index = aggregates.issn_index[rows]
+        self.num_rows = np.bincount(issn_index, minlength=num_journals)
+        self.sums = {}
+        self.nonzero_counts = {}
+        for name, values in aggregates.values.items():
+            self.sums[name] = np.bincount(issn_index, weights=values[rows], minlength=num_journals)
+            self.nonzero_counts[name] = np.bincount(issn_index[values[rows] != 0], minlength=num_journals)
+
+    def with_members(self, member_codes):
+        member_codes = frozenset(member_codes)
+        sums = dict([(name, values.copy()) for (name, values) in self.sums.items()])
+        nonzero_counts = dict([(name, counts.copy()) for (name, counts) in self.nonzero_counts.items()])
+        num_rows = self.num_rows.copy()
+        for (codes, sign) in [(member_codes - self.member_codes, 1), (self.member_codes - member_codes, -1)]:
+            for member_code in codes:
+                rows = self.aggregates.member_rows[member_code]
+                issn_index = self.aggregates.issn_index[rows]
+                np.add.at(num_rows, issn_index, sign)
+                for name in sums:
+                    values = self.aggregates.values[name][rows]
+                    np.add.at(sums[name], issn_index, sign * values)
+                    np.add.at(nonzero_counts[name], issn_index[values != 0], sign)
+        for name in sums:
+            sums[name][nonzero_counts[name] == 0] = 0.0
+        return ConsortiumTotals(self.aggregates, member_codes, sums=sums, num_rows=num_rows, nonzero_counts=nonzero_counts)
+
+    @cached_property
+    def rows(self):
+        included = np.isin(self.aggregates.member_index, list(self.member_codes))
+        return np.nonzero(included)[0]
+
+    @cached_property
+    def journal_rows(self):
+        # each journal's rows, in table order
+        issn_index = self.aggregates.issn_index[self.rows]
+        ordered_rows = self.rows[np.argsort(issn_index, kind="stable")]
+        return np.split(ordered_rows, np.cumsum(self.num_rows)[:-1])
+
+    def journal_indexes(self):
+        # journals with at least one included row
+        return np.nonzero(self.num_rows)[0].tolist()
+
+    def issn_l(self, journal_index):
+        return str(self.aggregates.issn_ls[journal_index])
+
+    def sum(self, name, journal_index):
+        return float(self.sums[name][journal_index])
+
+    def list_attribute(self, name, journal_index):
+        if name not in self.aggregates.objects:
+            return [None] * len(self.journal_rows[journal_index])
+        return self.aggregates.objects[name][self.journal_rows[journal_index]].tolist()
+
+    def first_value(self, name, journal_index):
+        # first truthy value in the journal's rows
+        for value in self.list_attribute(name, journal_index):
+            if value:
+                return value
+        return None
+
+    def row_dict(self, journal_index, position=0):
+        row = self.journal_rows[journal_index][position]
+        return dict([(name, column[row]) for (name, column) in self.aggregates.objects.items()])
+
+# The same sums, done by the warehouse and stored per scenario in
+# jump_scenario_computed_aggregate for one compute_version and one set of included
+# members, so the dashboard reads a row per journal instead of a row per member per journal.
+#
+# create table jump_scenario_computed_aggregate (scenario_id text, compute_version text, members_hash text,
+#     issn_l text, member_package_ids text, num_members int,
+#     usage float, downloads float, citations float, authorships float, ill_cost float, use_oa float,
+#     use_subscription float, use_backfile float, use_ill float, use_other_delayed float,
+#     use_social_networks_percent float, use_green_percent float, use_hybrid_percent float,
+#     use_bronze_percent float, use_peer_reviewed_percent float,
+#     subject text, era_subjects text, is_society_journal boolean, subscription_cost float,
+#     bronze_oa_embargo_months int, is_hybrid_2019 boolean, perpetual_access_years text, baseline_access text,
+#     updated timestamp);
+
+# the same for every member's row of a journal (or close enough: the old code took them
+# from whichever row came first)
+AGGREGATE_JOURNAL_COLUMNS = [("subject", "max"), ("era_subjects", "max"), ("is_society_journal", "bool_or"),
+                             ("subscription_cost", "max"), ("bronze_oa_embargo_months", "max"),
+                             ("is_hybrid_2019", "bool_or"), ("perpetual_access_years", "max"),
+                             ("baseline_access", "max")]
+
+# per member, looked up by member_package_id
+MEMBER_COLUMNS = ["institution_id", "institution_name", "institution_short_name", "package_id"]
+
+
+def members_hash(member_package_ids):
+    members_string = ",".join(sorted(set(member_package_ids)))
+    return hashlib.sha1(members_string.encode("utf-8")).hexdigest()[0:16]
+
+
+def aggregate_insert_statement(scenario_id, compute_version, member_package_ids):
+    # (command, values) that rebuilds the scenario's aggregate rows from jump_scenario_computed
+    selects = ["sum(coalesce({name}, 0)) as {name}".format(name=name) for name in SUM_COLUMNS]
+    selects += ["sum(coalesce({name}, 0) * coalesce(usage, 0)) as {name}".format(name=name) for name in USAGE_WEIGHTED_COLUMNS]
+    selects += ["{function}({name}) as {name}".format(function=function, name=name) for (name, function) in AGGREGATE_JOURNAL_COLUMNS]
+    names = SUM_COLUMNS + USAGE_WEIGHTED_COLUMNS + [name for (name, function) in AGGREGATE_JOURNAL_COLUMNS]
+
+    command = """delete from jump_scenario_computed_aggregate where scenario_id=%s;
+        insert into jump_scenario_computed_aggregate
+            (scenario_id, compute_version, members_hash, issn_l, member_package_ids, num_members, {names}, updated)
+            (select %s, %s, %s, issn_l,
+                listagg(member_package_id, ',') within group (order by member_package_id),
+                count(*),
+                {selects},
+                sysdate
+            from jump_scenario_computed
+            where scenario_id=%s and member_package_id in %s
+            group by issn_l)""".format(names=", ".join(names), selects=",\n                ".join(selects))
+    values = (scenario_id, scenario_id, compute_version, members_hash(member_package_ids),
+              scenario_id, tuple(member_package_ids) or ("",))
+    return (command, values)
+
+
+class StoredConsortiumTotals(object):
+    # ConsortiumTotals read back from jump_scenario_computed_aggregate
+
+    def __init__(self, rows, members):
+        # rows are dicts from the aggregate table, members is {member_package_id: dict of MEMBER_COLUMNS}
+        self.rows = sorted(rows, key=lambda row: row["issn_l"])
+        self.members = members
+        self.journal_member_package_ids = [(row["member_package_ids"] or "").split(",") for row in self.rows]
+
+    def journal_indexes(self):
+        return list(range(len(self.rows)))
+
+    def issn_l(self, journal_index):
+        return self.rows[journal_index]["issn_l"]
+
+    def sum(self, name, journal_index):
+        return float(self.rows[journal_index][name] or 0)
+
+    def list_attribute(self, name, journal_index):
+        member_package_ids = self.journal_member_package_ids[journal_index]
+        if name == "member_package_id":
+            return list(member_package_ids)
+        return [self.members.get(member_package_id, {}).get(name, None) for member_package_id in member_package_ids]
+
+    def first_value(self, name, journal_index):
+        return self.rows[journal_index].get(name, None)
+
+    def row_dict(self, journal_index, position=0):
+        response = dict(self.rows[journal_index])
+        member_package_id = self.journal_member_package_ids[journal_index][position]
+        response.update(self.members.get(member_package_id, {}))
+        response["member_package_id"] = member_package_id
+        return response
+
+
+def benchmark(num_members=150, num_journals=4000):
+    # synthetic consortium, no db needed
+    import random
+    from time import time
+
+    columns = ["member_package_id", "issn_l", "institution_name", "perpetual_access_years"] + SUM_COLUMNS + USAGE_WEIGHTED_COLUMNS
+    member_package_ids = ["package-member{}".format(i) for i in range(num_members)]
+    issn_ls = ["{:04d}-{:04d}".format(i // 10000, i % 10000) for i in range(num_journals)]
+    rows = []
+    for member_package_id in member_package_ids:
+        for issn_l in issn_ls:
+            rows.append(tuple([member_package_id, issn_l, member_package_id, None] +
+                              [random.random() * 100 for name in SUM_COLUMNS + USAGE_WEIGHTED_COLUMNS]))
+    included = member_package_ids[:-10]
+    response = []
+
+    start_time = time()
+    included_list_hits = len([row for row in rows if row[0] in included])
+    response.append(("filter rows by included list", time() - start_time))
+    start_time = time()
+    included_set = set(included)
+    included_set_hits = len([row for row in rows if row[0] in included_set])
+    response.append(("filter rows by included set", time() - start_time))
+    assert included_list_hits == included_set_hits
+
+    start_time = time()
+    aggregates = ConsortiumAggregates(columns, rows)
+    response.append(("build ConsortiumAggregates", time() - start_time))
+    start_time = time()
+    totals = aggregates.totals(included)
+    response.append(("totals, all included members", time() - start_time))
+    start_time = time()
+    [totals.list_attribute("institution_name", journal_index) for journal_index in totals.journal_indexes()]
+    response.append(("member lists for every journal", time() - start_time))
+    start_time = time()
+    aggregates.totals(included[1:])
+    response.append(("totals, one member toggled", time() - start_time))
+    return response
+
+
+def benchmark_members(num_members=150):
+    # to_dict_institutions' member loop, the old way (a list of included members, a scan
+    # of every feedback request per member) against ConsortiumMembers and
+    # add_member_status.  synthetic feedback requests, no db needed.  the old way also
+    # made a query per feedback request, see benchmark_feedback_reads for that part
+    import copy
+    import datetime
+    from time import time
+    from consortium import ConsortiumMembers
+    from consortium import add_member_status
+
+    member_package_ids = ["package-member{}".format(i) for i in range(num_members)]
+    included = member_package_ids[:-10]
+    now = datetime.datetime.utcnow()
+    institution_rows = [{"package_id": member_package_id, "included": False} for member_package_id in member_package_ids]
+    feedback_rows = [{"member_package_id": member_package_id,
+                      "member_scenario_id": member_package_id.replace("package-", "scenario-feedback"),
+                      "sent_date": now, "return_date": None} for member_package_id in member_package_ids]
+    feedback_scenarios = dict([(row["member_scenario_id"], (now, {"member_added_subrs": ["0000-{:04d}".format(i) for i in range(20)]}))
+                               for row in feedback_rows])
+    response = []
+
+    start_time = time()
+    old_rows = copy.deepcopy(institution_rows)
+    for row in old_rows:
+        if row["package_id"] in included:
+            row["included"] = True
+        for row_for_feedback in feedback_rows:
+            if row_for_feedback["member_package_id"] == row["package_id"]:
+                row["sent_date"] = row_for_feedback["sent_date"]
+                row["return_date"] = row_for_feedback["return_date"]
+                (updated, scenario_data) = feedback_scenarios[row_for_feedback["member_scenario_id"]]
+                row["changed_date"] = updated
+                row["member_added_subrs"] = scenario_data.get("member_added_subrs", [])
+    response.append(("member loop, nested scans", time() - start_time))
+
+    start_time = time()
+    new_rows = copy.deepcopy(institution_rows)
+    members = ConsortiumMembers("scenario-benchmark", included)
+    # what the two queries would have returned
+    members.__dict__["feedback_by_package_id"] = dict([(row["member_package_id"], row) for row in feedback_rows])
+    members.__dict__["feedback_scenarios"] = feedback_scenarios
+    add_member_status(new_rows, members)
+    response.append(("member loop, ConsortiumMembers", time() - start_time))
+    assert old_rows == new_rows
+    return response
+
+
+def benchmark_feedback_reads(scenario_id):
+    # a real consortium scenario's feedback scenarios, read one query each (the old
+    # to_dict_institutions) and in one query (ConsortiumMembers.feedback_scenarios)
+    from time import time
+    from consortium import ConsortiumMembers
+    from saved_scenario import get_latest_scenario_raw
+    from saved_scenario import get_latest_scenarios_raw
+
+    members = ConsortiumMembers(scenario_id, [])
+    member_scenario_ids = [row["member_scenario_id"] for row in members.feedback_by_package_id.values()]
+    response = []
+
+    # the batched read goes first, so it's the one that parses the json cold
+    start_time = time()
+    get_latest_scenarios_raw(member_scenario_ids, exclude_added_via_pushpull=True)
+    response.append(("{} feedback scenarios, one query".format(len(member_scenario_ids)), time() - start_time))
+    start_time = time()
+    for member_scenario_id in member_scenario_ids:
+        get_latest_scenario_raw(member_scenario_id, exclude_added_via_pushpull=True)
+    response.append(("{} feedback scenarios, query each".format(len(member_scenario_ids)), time() - start_time))
+    return response
+
+
+# python consortium_aggregates.py --members 150 --journals 4000
+# python consortium_aggregates.py --scenario_id scenario-XXXX also times the feedback scenario reads (needs the db)
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=150)
+    parser.add_argument("--journals", type=int, default=4000)
+    parser.add_argument("--scenario_id", type=str, default=None, help="consortium scenario to time feedback reads for")
+    parsed_args = parser.parse_args()
+
+    results = benchmark(parsed_args.members, parsed_args.journals) + benchmark_members(parsed_args.members)
+    if parsed_args.scenario_id:
+        results += benchmark_feedback_reads(parsed_args.scenario_id)
+    for (label, seconds) in results:
+        print("{: <40} {: >8.3f}s".format(label, seconds))
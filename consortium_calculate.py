@@ -8,6 +8,7 @@ from time import sleep
 import argparse
 
 from app import get_db_cursor
+from lazy_data import preload_datasets
 from consortium import Consortium
 from emailer import create_email, send
 from util import elapsed
@@ -74,6 +75,7 @@ if __name__ == "__main__":
     parsed_args = parser.parse_args()
     parsed_vars = vars(parsed_args)
 
+    preload_datasets()
     consortium_calculate()
 
 
@@ -33,13 +33,15 @@ from journal import Journal
 class ConsortiumJournal(Journal):
     years = list(range(0, 5))
 
-    def __init__(self, issn_l, included_package_ids, all_member_data, is_jisc, package):
+    def __init__(self, issn_l, included_package_ids, totals, journal_index, is_jisc, package):
+        # a view of one journal's row in a ConsortiumTotals (see consortium_aggregates.py)
         start_time = time()
         self.issn_l = issn_l
         self.is_jisc = is_jisc
         self.included_package_ids = included_package_ids
-        self.member_data = all_member_data
-        self.meta_data = self.member_data[0]
+        self.totals = totals
+        self.journal_index = journal_index
+        self.meta_data = totals.row_dict(journal_index)
         self.subscribed_bulk = False
         self.subscribed_custom = False
         self.use_default_download_curve = False
@@ -56,51 +58,33 @@ class ConsortiumJournal(Journal):
         now = datetime.utcnow()
         return list(range(now.year - 5, now.year))
 
-    def sum_attribute(self, attribute_name, nesting_key=None):
-        response = 0
-        for my_member_dict in self.member_data:
-            if nesting_key:
-                response += my_member_dict[nesting_key].get(attribute_name, 0) or 0
-            else:
-                response += my_member_dict.get(attribute_name, 0) or 0
-        return float(response)
-
-    def sum_attribute_multiplied_by_usage(self, attribute_name, nesting_key=None):
-        response = 0
-        for my_member_dict in self.member_data:
-            if nesting_key:
-                response += (my_member_dict[nesting_key].get(attribute_name, 0) or 0) * float(my_member_dict["usage"])
-            else:
-                response += (my_member_dict.get(attribute_name, 0) or 0) * float(my_member_dict["usage"])
-        return float(response)
+    def sum_attribute(self, attribute_name):
+        return self.totals.sum(attribute_name, self.journal_index)
+
+    def sum_attribute_multiplied_by_usage(self, attribute_name):
+        # the totals already hold sum(value * usage) for these
+        return self.totals.sum(attribute_name, self.journal_index)
 
     def list_attribute(self, attribute_name):
-        return [my_member_dict.get(attribute_name, None) for my_member_dict in self.member_data]
+        return self.totals.list_attribute(attribute_name, self.journal_index)
 
     @cached_property
     def has_perpetual_access(self):
-        response = False
-        for my_member_dict in self.member_data:
-            if my_member_dict.get("has_perpetual_access"):
-                response = True
-        return response
+        return bool(self.totals.first_value("has_perpetual_access", self.journal_index))
 
     @cached_property
     def perpetual_access_years(self):
-        for my_member_dict in self.member_data:
-            if my_member_dict.get("perpetual_access_years"):
-                if isinstance(my_member_dict.get("perpetual_access_years"), str) :
-                    return [int(z) for z in my_member_dict.get("perpetual_access_years").split("-") if len(z)]
-                else:
-                    return my_member_dict.get("perpetual_access_years")
+        response = self.totals.first_value("perpetual_access_years", self.journal_index)
+        if response:
+            if isinstance(response, str) :
+                return [int(z) for z in response.split("-") if len(z)]
+            else:
+                return response
         return []
 
     @cached_property
     def baseline_access(self):
-        for my_member_dict in self.member_data:
-            if my_member_dict.get("baseline_access"):
-                return my_member_dict.get("baseline_access")
-        return None
+        return self.totals.first_value("baseline_access", self.journal_index)
 
     @cached_property
     def institution_id(self):
@@ -0,0 +1,159 @@
+# coding: utf-8
+
+import os
+from collections import OrderedDict
+from time import time
+from time import sleep
+
+import shortuuid
+import simplejson as json
+
+from app import get_db_cursor
+from util import myconverter
+
+# Progress of consortium recomputes.  recompute_journal_dicts updates one small row per
+# scenario as each member finishes, and GET /scenario/<id>/progress/stream sends the
+# changes to the browser as server-sent events.  so watching a recompute reads that row
+# every couple of seconds, rather than the browser rebuilding the whole dashboard.
+# queue_for_recompute writes a "queued" row, so there's something to watch before the
+# consortium_calculate worker picks the recompute up.
+#
+# create table jump_consortium_progress (scenario_id text, run_id text, status text,
+#     num_members int, num_members_done int, num_rows_written int, eta_seconds int,
+#     error varchar(65535), started timestamp, updated timestamp);
+
+PROGRESS_QUEUED = "queued"
+PROGRESS_RUNNING = "running"
+PROGRESS_WRITING = "writing"  # every member is done, the rows are being swapped in
+PROGRESS_DONE = "done"
+PROGRESS_FAILED = "failed"
+
+PROGRESS_STREAM_POLL_SECONDS = float(os.getenv("PROGRESS_STREAM_POLL_SECONDS", 2))
+# an open stream holds a web worker, so streams end after this long and the browser's
+# EventSource reconnects (after PROGRESS_STREAM_RETRY_MS)
+PROGRESS_STREAM_MAX_SECONDS = int(os.getenv("PROGRESS_STREAM_MAX_SECONDS", 25))
+PROGRESS_STREAM_RETRY_MS = 2000
+
+
+class RecomputeProgress(object):
+    # members skipped because their inputs didn't change count as done from the start
+
+    def __init__(self, scenario_id, num_members, num_members_skipped=0):
+        self.scenario_id = scenario_id
+        self.run_id = shortuuid.uuid()[0:12]
+        self.num_members = num_members
+        self.num_members_skipped = num_members_skipped
+        self.num_members_done = num_members_skipped
+        self.num_rows_written = 0
+        self.start_time = time()
+
+    @property
+    def eta_seconds(self):
+        num_computed = self.num_members_done - self.num_members_skipped
+        if num_computed <= 0:
+            return None
+        seconds_per_member = (time() - self.start_time) / num_computed
+        return int(seconds_per_member * (self.num_members - self.num_members_done))
+
+    def start(self, status=PROGRESS_RUNNING):
+        # a new run_id each time, so a run can't update the row of the one after it
+        command = """insert into jump_consortium_progress
+            (scenario_id, run_id, status, num_members, num_members_done, num_rows_written, eta_seconds, error, started, updated)
+            values (%s, %s, %s, %s, %s, 0, null, null, sysdate, sysdate)"""
+        with get_db_cursor() as cursor:
+            cursor.execute("delete from jump_consortium_progress where scenario_id=%s", (self.scenario_id,))
+            cursor.execute(command, (self.scenario_id, self.run_id, status, self.num_members, self.num_members_done))
+
+    def queued(self):
+        self.start(status=PROGRESS_QUEUED)
+
+    def member_done(self, num_members_done, num_rows_written):
+        self.num_members_done = num_members_done
+        self.num_rows_written = num_rows_written
+        self._update(PROGRESS_RUNNING)
+
+    def writing(self):
+        self._update(PROGRESS_WRITING)
+
+    def done(self):
+        self._update(PROGRESS_DONE)
+
+    def failed(self, error):
+        self._update(PROGRESS_FAILED, error=error)
+
+    def _update(self, status, error=None):
+        eta_seconds = self.eta_seconds if status == PROGRESS_RUNNING else None
+        command = """update jump_consortium_progress set status=%s, num_members_done=%s, num_rows_written=%s,
+            eta_seconds=%s, error=%s, updated=sysdate
+            where scenario_id=%s and run_id=%s"""
+        with get_db_cursor() as cursor:
+            cursor.execute(command, (status, self.num_members_done, self.num_rows_written, eta_seconds,
+                                     error, self.scenario_id, self.run_id))
+
+
+def get_progress(scenario_id):
+    command = """select run_id, status, num_members, num_members_done, num_rows_written, eta_seconds, error, started, updated
+        from jump_consortium_progress where scenario_id=%s"""
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (scenario_id,))
+        rows = cursor.fetchall()
+    if not rows:
+        return None
+
+    row = rows[0]
+    response = OrderedDict()
+    response["scenario_id"] = scenario_id
+    for key in ["run_id", "status", "num_members", "num_members_done", "num_rows_written", "eta_seconds", "error", "started", "updated"]:
+        response[key] = row[key]
+    response["percent_complete"] = None
+    if row["num_members"]:
+        response["percent_complete"] = round(100.0 * (row["num_members_done"] or 0) / row["num_members"], 1)
+    return response
+
+
+def is_finished(progress):
+    return not progress or progress["status"] in (PROGRESS_DONE, PROGRESS_FAILED)
+
+
+def get_pending_recompute_created(scenario_id):
+    # when the recompute waiting in jump_scenario_computed_update_queue was queued, or None
+    command = """select max(created) as created from jump_scenario_computed_update_queue
+        where completed is null and scenario_id=%s"""
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (scenario_id,))
+        rows = cursor.fetchall()
+    return rows[0]["created"] if rows else None
+
+
+def is_run_finished(scenario_id, progress):
+    # while a recompute is queued, no row or a run that finished before it was queued
+    # (one queued before there were queued rows, say) means it hasn't started yet
+    if not is_finished(progress):
+        return False
+    pending_created = get_pending_recompute_created(scenario_id)
+    if pending_created is None:
+        return True
+    return progress is not None and progress["updated"] >= pending_created
+
+
+def sse_event(data, event="progress"):
+    return "event: {}\ndata: {}\n\n".format(event, json.dumps(data, default=myconverter))
+
+
+def progress_event_stream(scenario_id):
+    # sends the progress whenever it changes.  when the run is finished (or there isn't
+    # one) it sends an "end" event, and the browser should close its EventSource
+    yield "retry: {}\n\n".format(PROGRESS_STREAM_RETRY_MS)
+    start_time = time()
+    last_progress = None
+    while True:
+        progress = get_progress(scenario_id)
+        if progress != last_progress:
+            yield sse_event(progress)
+            last_progress = progress
+        if is_run_finished(scenario_id, progress):
+            yield sse_event(progress, event="end")
+            return
+        if time() - start_time > PROGRESS_STREAM_MAX_SECONDS:
+            return
+        sleep(PROGRESS_STREAM_POLL_SECONDS)
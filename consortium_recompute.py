@@ -7,21 +7,24 @@ from consortium import Consortium
 # heroku run --size=performance-l python consortium_recompute.py --package_id=package-3WkCDEZTqo6S -r heroku
 # heroku run --size=performance-l python consortium_recompute.py --scenario_id=tGUVWRiN -r heroku
 # python consortium_recompute.py --package_id=package-X9cgZdJWfmGy
+# --full recomputes every member, not just the ones whose inputs changed
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run stuff :)")
     parser.add_argument("--package_id", type=str, default=None, help="package id of consortium to recompute")
     parser.add_argument("--scenario_id", type=str, default=None, help="scenario id of consortium to recompute")
+    parser.add_argument("--full", action="store_true", default=False, help="recompute every member, even unchanged ones")
 
     parsed_args = parser.parse_args()
     parsed_vars = vars(parsed_args)
 
     consortium_package_id = parsed_vars["package_id"]
     consortium_scenario_id = parsed_vars["scenario_id"]
+    only_changed_members = not parsed_vars["full"]
 
     if consortium_scenario_id:
         new_consortia = Consortium(consortium_scenario_id)
-        new_consortia.recompute_journal_dicts()
+        new_consortia.recompute_journal_dicts(only_changed_members=only_changed_members)
         print("recomputing {}".format(new_consortia))
 
     elif consortium_package_id:
@@ -32,5 +35,5 @@ if __name__ == "__main__":
             if consortium_package_id == d["package_id"]:
                 print("starting to recompute row {}".format(d))
                 new_consortia = Consortium(d["scenario_id"])
-                new_consortia.recompute_journal_dicts()
+                new_consortia.recompute_journal_dicts(only_changed_members=only_changed_members)
                 print("recomputing {}".format(new_consortia))
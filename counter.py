@@ -7,6 +7,7 @@ from app import db
 from app import logger
 from app import get_db_cursor
 from package_input import PackageInput
+from package_cache import COUNTER
 from psycopg2.extensions import AsIs
 
 class Counter(db.Model):
@@ -66,6 +67,9 @@ class CounterInput(db.Model, PackageInput):
             return self.stored_file_type_label
         return "counter"
 
+    def cache_data_type(self):
+        return COUNTER
+
     def import_view_name(self):
         return "jump_counter_view"
 
@@ -0,0 +1,171 @@
+# coding: utf-8
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+from time import time
+
+from psycopg2.pool import ThreadedConnectionPool
+
+# pool sizes can be set per heroku process type, eg DB_POOL_MAXCONN_PARSE_UPLOADS=20,
+# falling back to DB_POOL_MAXCONN and then to what we've always used
+DEFAULT_POOL_MINCONN = 2
+DEFAULT_POOL_MAXCONN = 200
+
+# how long get_db_cursor waits for a free connection before giving up
+DEFAULT_POOL_WAIT_SECONDS = 30
+
+# upper bounds of the checkout wait time histogram, in seconds
+WAIT_BUCKETS = [0.001, 0.01, 0.1, 0.5, 1, 5, 30]
+
+# how often the stats get printed to the log
+LOG_STATS_SECONDS = 300
+
+
+class DbPoolTimeout(Exception):
+    pass
+
+
+def dyno_process_type():
+    # heroku sets DYNO to eg "web.1" or "parse_uploads.2"
+    dyno = os.getenv("DYNO", "")
+    return dyno.split(".")[0] if dyno else None
+
+
+def pool_setting(name, default):
+    process_type = dyno_process_type()
+    value = None
+    if process_type:
+        value = os.getenv("{}_{}".format(name, process_type.upper()))
+    if value is None:
+        value = os.getenv(name)
+    return type(default)(value) if value is not None else default
+
+
+def db_caller_name():
+    # the first frame outside the db helpers and contextlib is who asked for the cursor
+    frame = sys._getframe(1)
+    while frame is not None:
+        file_name = os.path.basename(frame.f_code.co_filename)
+        if file_name not in ("contextlib.py", "db_pool.py") and frame.f_code.co_name not in ("get_db_cursor", "get_db_connection"):
+            return "{}:{}".format(file_name.replace(".py", ""), frame.f_code.co_name)
+        frame = frame.f_back
+    return "unknown"
+
+
+class DbPoolStats(object):
+    def __init__(self, maxconn):
+        self.lock = threading.Lock()
+        self.maxconn = maxconn
+        self.started = time()
+        self.last_logged = time()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.wait_histogram = [0] * (len(WAIT_BUCKETS) + 1)
+        self.queries = {}
+
+    def record_checkout(self, wait_seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+            bucket = len(WAIT_BUCKETS)
+            for i, upper_bound in enumerate(WAIT_BUCKETS):
+                if wait_seconds <= upper_bound:
+                    bucket = i
+                    break
+            self.wait_histogram[bucket] += 1
+
+    def record_checkin(self):
+        with self.lock:
+            self.in_use -= 1
+
+    def record_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def record_query(self, caller, seconds):
+        with self.lock:
+            my_query = self.queries.setdefault(caller, {"count": 0, "seconds_total": 0.0, "seconds_max": 0.0})
+            my_query["count"] += 1
+            my_query["seconds_total"] += seconds
+            my_query["seconds_max"] = max(my_query["seconds_max"], seconds)
+        self.maybe_log()
+
+    def to_dict(self):
+        with self.lock:
+            response = OrderedDict()
+            response["process_type"] = dyno_process_type()
+            response["maxconn"] = self.maxconn
+            response["uptime_seconds"] = round(time() - self.started)
+            response["checkouts"] = self.checkouts
+            response["timeouts"] = self.timeouts
+            response["in_use"] = self.in_use
+            response["max_in_use"] = self.max_in_use
+            response["wait_seconds_mean"] = round(self.wait_seconds_total / self.checkouts, 4) if self.checkouts else None
+            response["wait_seconds_max"] = round(self.wait_seconds_max, 4)
+            response["wait_histogram"] = OrderedDict()
+            for upper_bound, count in zip(WAIT_BUCKETS + ["inf"], self.wait_histogram):
+                response["wait_histogram"]["le_{}".format(upper_bound)] = count
+            response["queries"] = OrderedDict()
+            for caller, my_query in sorted(list(self.queries.items()), key=lambda x: x[1]["seconds_total"], reverse=True):
+                response["queries"][caller] = {
+                    "count": my_query["count"],
+                    "seconds_total": round(my_query["seconds_total"], 3),
+                    "seconds_mean": round(my_query["seconds_total"] / my_query["count"], 4),
+                    "seconds_max": round(my_query["seconds_max"], 3),
+                }
+        return response
+
+    def maybe_log(self):
+        now = time()
+        with self.lock:
+            if now - self.last_logged < LOG_STATS_SECONDS:
+                return
+            self.last_logged = now
+        my_dict = self.to_dict()
+        slowest = list(my_dict["queries"].items())[:5]
+        print("db pool stats: checkouts={} timeouts={} in_use={} max_in_use={}/{} wait_mean={} wait_max={} wait_histogram={} slowest_callers={}".format(
+            my_dict["checkouts"], my_dict["timeouts"], my_dict["in_use"], my_dict["max_in_use"], my_dict["maxconn"],
+            my_dict["wait_seconds_mean"], my_dict["wait_seconds_max"], dict(my_dict["wait_histogram"]),
+            [(caller, my_query["seconds_total"]) for caller, my_query in slowest]))
+
+
+class InstrumentedConnectionPool(ThreadedConnectionPool):
+    # ThreadedConnectionPool raises PoolError straight away when it is exhausted.
+    # This waits up to wait_seconds for a connection to be put back instead, and counts
+    # what happens so pool sizes can be checked against real use.
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self.wait_seconds = kwargs.pop("wait_seconds", DEFAULT_POOL_WAIT_SECONDS)
+        ThreadedConnectionPool.__init__(self, minconn, maxconn, *args, **kwargs)
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.stats = DbPoolStats(maxconn)
+
+    def getconn(self, key=None):
+        start = time()
+        if not self.slots.acquire(timeout=self.wait_seconds):
+            self.stats.record_timeout()
+            raise DbPoolTimeout("Timed out after {} seconds waiting for a db connection, all {} are in use".format(
+                self.wait_seconds, self.maxconn))
+        try:
+            connection = ThreadedConnectionPool.getconn(self, key)
+        except Exception:
+            self.slots.release()
+            raise
+        self.stats.record_checkout(time() - start)
+        return connection
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            ThreadedConnectionPool.putconn(self, conn, key, close)
+        finally:
+            self.slots.release()
+            self.stats.record_checkin()
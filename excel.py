@@ -1,3 +1,4 @@
+import os
 import tempfile
 import zipfile
 
@@ -30,62 +31,135 @@ def convert_spreadsheet_to_csv(spreadsheet, parsed=True):
         logger.info('{} could not be opened as a spreadsheet: {}, {}'.format(spreadsheet, type(e), str(e)))
         return None
 
-    return _convert_parsed(workbook) if parsed else _convert_blind(workbook)
+    # rows are written to disk as the sheets are read, so memory use stays flat
+    # no matter how big the workbook is. on a formula we stop reading and
+    # throw away whatever was written so far.
+    csv_file_names = []
+    try:
+        if parsed:
+            _convert_parsed(workbook, csv_file_names)
+        else:
+            _convert_blind(workbook, csv_file_names)
+    except Exception:
+        for csv_file_name in csv_file_names:
+            os.remove(csv_file_name)
+        raise
+    finally:
+        workbook.close()
 
+    return csv_file_names
 
-def _convert_parsed(workbook):
-    csv_file_name = tempfile.mkstemp()[1]
 
-    rows = []
-    column_names = None
+def _new_csv_file(csv_file_names):
+    handle, csv_file_name = tempfile.mkstemp()
+    csv_file_names.append(csv_file_name)
+    return os.fdopen(handle, 'w', encoding='utf-8', newline='')
 
-    for sheet_name in list(workbook.sheetnames):
-        sheet = workbook[sheet_name]
 
-        sheet_column_names = {}
-        for i, column in enumerate(list(sheet.iter_rows(min_row=1, max_row=1))[0]):
-            sheet_column_names[i] = column.value.lower().strip()
+def _check_for_formulas(row_cells):
+    for cell in row_cells:
+        if cell.data_type == 'f':
+            raise RuntimeError('Uploaded files can not contain formulas. Found a formula in cell {}.'.format(
+                getattr(cell, 'coordinate', '?')))
 
-        if column_names is None:
-            column_names = list(sheet_column_names.values())
-        elif set(sheet_column_names.values()).difference(set(column_names)):
-            raise ValueError('all worksheets must contain the same columns')
 
-        cell_types = []
-        for row_cells in sheet.iter_rows(min_row=2):
-            row = {}
-            for column in range(0, len(sheet_column_names)):
-                row[sheet_column_names[column]] = row_cells[column].value or None
-                cell_types.append(row_cells[column].data_type)
-            rows.append(row)
+def _convert_parsed(workbook, csv_file_names):
+    column_names = None
 
-        formula_cells = cell_types.count('f')
-        if formula_cells > 0:
-            raise RuntimeError('Uploaded files can not contain formulas. Found {} cells with formulas.'.format(formula_cells))
+    with _new_csv_file(csv_file_names) as csv_file:
+        writer = None
 
-    with open(csv_file_name, 'w') as csv_file:
-        writer = csv.DictWriter(csv_file, column_names)
+        for sheet_name in list(workbook.sheetnames):
+            sheet = workbook[sheet_name]
+            sheet_rows = sheet.iter_rows()
 
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(row)
+            header_cells = next(sheet_rows, None)
+            if header_cells is None:
+                continue
 
-    return [csv_file_name]
+            sheet_column_names = [cell.value.lower().strip() for cell in header_cells]
 
+            if column_names is None:
+                column_names = sheet_column_names
+                writer = csv.DictWriter(csv_file, column_names)
+                writer.writeheader()
+            elif set(sheet_column_names).difference(set(column_names)):
+                raise ValueError('all worksheets must contain the same columns')
+
+            for row_cells in sheet_rows:
+                _check_for_formulas(row_cells)
+                row = {}
+                for column, column_name in enumerate(sheet_column_names):
+                    row[column_name] = row_cells[column].value or None
+                writer.writerow(row)
 
-def _convert_blind(workbook):
-    csv_file_names = []
 
+def _convert_blind(workbook, csv_file_names):
     for sheet_name in list(workbook.sheetnames):
         sheet = workbook[sheet_name]
-        csv_file_name = tempfile.mkstemp()[1]
-        with open(csv_file_name, 'w', encoding='utf-8') as csv_file:
+        with _new_csv_file(csv_file_names) as csv_file:
             writer = csv.writer(csv_file, delimiter=',')
             for row in sheet.iter_rows(min_row=1):
-                if 'f' in [w.data_type for w in row]:
-                    raise RuntimeError('Uploaded files can not contain formulas')
+                _check_for_formulas(row)
                 writer.writerow([cell.value for cell in row])
 
-        csv_file_names.append(csv_file_name)
 
-    return csv_file_names
+def benchmark(num_rows=200000, num_columns=10):
+    # a synthetic counter-sized workbook, converted the old way (every row held in a list,
+    # then written) and by convert_spreadsheet_to_csv.  (label, seconds, peak MB) each
+    import tracemalloc
+    from time import time
+
+    handle, spreadsheet = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    column_names = ['issn'] + ['column {}'.format(i) for i in range(1, num_columns)]
+    sheet.append(column_names)
+    for i in range(num_rows):
+        sheet.append(['{:04d}-{:04d}'.format(i // 10000, i % 10000)] + [i * column for column in range(1, num_columns)])
+    workbook.save(spreadsheet)
+    response = []
+
+    def measure(label, convert):
+        tracemalloc.start()
+        start_time = time()
+        csv_file_names = convert()
+        seconds = time() - start_time
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        for csv_file_name in csv_file_names:
+            os.remove(csv_file_name)
+        response.append((label, seconds, peak / 1024.0 / 1024))
+
+    def convert_in_memory():
+        my_workbook = openpyxl.load_workbook(open(spreadsheet, "rb"), read_only=True)
+        rows = []
+        for row_cells in my_workbook.active.iter_rows(min_row=2):
+            rows.append(dict(zip(column_names, [cell.value or None for cell in row_cells])))
+        my_workbook.close()
+        csv_file_names = []
+        with _new_csv_file(csv_file_names) as csv_file:
+            writer = csv.DictWriter(csv_file, column_names)
+            writer.writeheader()
+            writer.writerows(rows)
+        return csv_file_names
+
+    try:
+        measure('rows held in memory, then written', convert_in_memory)
+        measure('convert_spreadsheet_to_csv, parsed', lambda: convert_spreadsheet_to_csv(spreadsheet, parsed=True))
+        measure('convert_spreadsheet_to_csv, blind', lambda: convert_spreadsheet_to_csv(spreadsheet, parsed=False))
+    finally:
+        os.remove(spreadsheet)
+    return response
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--columns", type=int, default=10)
+    parsed_args = parser.parse_args()
+
+    for (label, seconds, peak_mb) in benchmark(parsed_args.rows, parsed_args.columns):
+        print("{: <40} {: >8.3f}s {: >8.1f}MB peak".format(label, seconds, peak_mb))
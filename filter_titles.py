@@ -8,6 +8,7 @@ from app import db
 from app import get_db_cursor
 from package import Package
 from package_input import PackageInput
+from package_cache import FILTER
 
 
 class FilterTitles(db.Model):
@@ -95,8 +96,11 @@ class FilterTitlesInput(db.Model, PackageInput):
 	def file_type_label(self):
 		return "filter"
 
+	def cache_data_type(self):
+		return FILTER
+
 	def update_subscriptions(self, package_id):
-		from saved_scenario import save_raw_scenario_to_db
+		from saved_scenario import save_raw_scenarios_to_db, load_latest_scenarios
 
 		pkg = Package.query.get(package_id)
 		scenarios = pkg.saved_scenarios
@@ -104,15 +108,18 @@ class FilterTitlesInput(db.Model, PackageInput):
 			print(f"({self}) no scenarios found, not modifying subscriptions")
 			return None
 
-		for scenario in scenarios:
+		with get_db_cursor() as cursor:
+			qry = "select issn_l from jump_journal_filter where package_id = %s"
+			cursor.execute(qry, (package_id,))
+			rows = cursor.fetchall()
+		filter_issns = set([w[0] for w in rows])
+
+		to_save = {}
+		for scenario in load_latest_scenarios(scenarios):
 			saved = scenario.to_dict_saved_from_db()
 			if saved['subrs']:
 				print(f"({self}) modifying subscriptions")
-				with get_db_cursor() as cursor:
-					qry = "select issn_l from jump_journal_filter where package_id = %s"
-					cursor.execute(qry, (package_id,))
-					rows = cursor.fetchall()
-				filter_issns = [w[0] for w in rows]
 				saved["subrs"] = list(filter(lambda x: x in filter_issns, saved["subrs"]))
-
-				save_raw_scenario_to_db(scenario.scenario_id, saved, None)
+				to_save[scenario.scenario_id] = saved
+		if to_save:
+			save_raw_scenarios_to_db(to_save, None)
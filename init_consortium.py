@@ -207,6 +207,7 @@ def consortium_package_create(consortium_institution_id, consortium_package_disp
 # python consortium_calculate.py
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run stuff :)")
+    parser.add_argument("--full", action="store_true", default=False, help="recompute every member, even unchanged ones")
 
     parsed_args = parser.parse_args()
     parsed_vars = vars(parsed_args)
@@ -268,7 +269,7 @@ if __name__ == "__main__":
     # now kick off the computing
     print("recomputing")
     new_consortia = Consortium(consortium_scenario_id)
-    new_consortia.recompute_journal_dicts()
+    new_consortia.recompute_journal_dicts(only_changed_members=not parsed_vars["full"])
 
     print("done")
 
@@ -174,13 +174,13 @@ def assoc_feeder_pkgs(publisher, consortium_package_id, feed_ids):
 		execute_values(cursor, qry, values)
 
 # Recompute consortia
-def recompute_consortium(consortium_package_id):
+def recompute_consortium(consortium_package_id, full=False):
 	consortium_ids = get_consortium_ids()
 	for d in consortium_ids:
 		if consortium_package_id == d["package_id"]:
 			print("starting to recompute row {}".format(d))
 			new_consortia = Consortium(d["scenario_id"])
-			new_consortia.recompute_journal_dicts()
+			new_consortia.recompute_journal_dicts(only_changed_members=not full)
 			print("recomputing {}".format(new_consortia))
 
 def heroku_restart():
@@ -197,8 +197,9 @@ def include_all_members(consortium_package_id, feed_ids):
 @click.option('--publisher', help='A publisher', required=True)
 @click.option('--pkgid', help='Package IDs to feed into the consortial dashboard; flag can be supplied multiple times', multiple=True)
 @click.option('--pkgidprefix', default="package-", help='Package IDs; flag can be supplied multiple times', required=True)
+@click.option('--full', is_flag=True, default=False, help='Recompute every member, even ones whose inputs are unchanged')
 # heroku local:run python init_consortium_internal.py --publisher=elsevier
-def create_consortium(publisher, pkgid, pkgidprefix):
+def create_consortium(publisher, pkgid, pkgidprefix, full):
 	"""Create a consortium for internal testing purposes"""
 	publisher = publisher.lower()
 
@@ -227,7 +228,7 @@ def create_consortium(publisher, pkgid, pkgidprefix):
 	assoc_feeder_pkgs(publisher, consortium_package_id, feedids)
 
 	click.echo("Recomputing the consortium")
-	recompute_consortium(consortium_package_id)
+	recompute_consortium(consortium_package_id, full)
 
 	click.echo("Restarting Heroku application")
 	heroku_restart()
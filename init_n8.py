@@ -21,6 +21,7 @@ from package import Package
 from saved_scenario import SavedScenario
 from saved_scenario import save_raw_scenario_to_db
 from saved_scenario import get_latest_scenario_raw
+from saved_scenario import get_latest_scenarios_raw
 from n8_uni_result import N8UniResult
 from util import safe_commit
 from util import get_sql_answer
@@ -245,14 +246,15 @@ def copy_subscriptions(jusp_id, subscriptions, package_type, coreplus):
 def set_non_own_subscriptions(main_jusp_id, group_jusp_ids, package_type, coreplus):
     n8_id_prefix = "n8els_coreplus" if coreplus else "n8els"
     main_scenario_id = "scenario-{}_{}_ownpta".format(n8_id_prefix, main_jusp_id)
-    (updated, main_scenario_dict) = get_latest_scenario_raw(main_scenario_id)
+    group_scenario_ids = ["scenario-{}_{}_ownpta".format(n8_id_prefix, jusp_id) for jusp_id in group_jusp_ids]
+    latest_scenarios = get_latest_scenarios_raw([main_scenario_id] + group_scenario_ids)
+    (updated, main_scenario_dict) = latest_scenarios[main_scenario_id]
     main_subscriptions = main_scenario_dict["subrs"]
 
     all_subscriptions = []
 
-    for jusp_id in group_jusp_ids:
-        scenario_id = "scenario-{}_{}_ownpta".format(n8_id_prefix, jusp_id)
-        (updated, my_source_scenario_dict) = get_latest_scenario_raw(scenario_id)
+    for jusp_id, scenario_id in zip(group_jusp_ids, group_scenario_ids):
+        (updated, my_source_scenario_dict) = latest_scenarios[scenario_id]
         print(("subscriptions: ", jusp_id, len(my_source_scenario_dict["subrs"])))
         all_subscriptions += my_source_scenario_dict["subrs"]
         print(("len all_subscriptions: ", len(list(set(all_subscriptions)))))
@@ -11,6 +11,7 @@ from grid_id import GridId
 from ror_id import RorId
 from permission import UserInstitutionPermission
 from user import User
+from util import authenticated_user_id
 
 
 class Institution(db.Model):
@@ -26,13 +27,42 @@ class Institution(db.Model):
     grid_ids = relationship(GridId, lazy='subquery')
     ror_ids = relationship(RorId, lazy='subquery')
 
-    def user_permissions(self, is_consortium=None):
-        user_ids = db.session.query(UserInstitutionPermission.user_id).filter(
-            UserInstitutionPermission.institution_id == self.id).distinct()
-        users = User.query.filter(User.id.in_(user_ids)).all()
+    @cached_property
+    def permission_dicts(self):
+        # same dicts as User.to_dict_permissions()[self.id] for each user here, in one query
+        command = """
+            select u.id, u.email, u.username, u.display_name, p.name as permission_name
+                from jump_user_institution_permission uip
+                join jump_user u on u.id=uip.user_id
+                join jump_permission p on p.id=uip.permission_id
+                where uip.institution_id=%s
+                order by u.id, p.id
+            """
+        with get_db_cursor() as cursor:
+            cursor.execute(command, (self.id,))
+            rows = cursor.fetchall()
+
+        my_user_id = authenticated_user_id()
+        dicts = OrderedDict()
+        for row in rows:
+            if row["id"] not in dicts:
+                dicts[row["id"]] = {
+                    'institution_id': self.id,
+                    'user_id': row["id"],
+                    'user_email': row["email"],
+                    'username': row["username"],
+                    'permissions': [],
+                    'institution_name': self.display_name,
+                    'is_consortium': self.is_consortium,
+                    'user_name': row["display_name"],
+                    'is_authenticated_user': my_user_id == row["id"],
+                    'is_demo_institution': self.is_demo_institution,
+                }
+            dicts[row["id"]]['permissions'].append(row["permission_name"])
+        return list(dicts.values())
 
-        # permission_dicts = [u.to_dict_permissions()[self.id] for u in users if (u.email and (not u.email.startswith("team+")))]
-        permission_dicts = [u.to_dict_permissions()[self.id] for u in users]
+    def user_permissions(self, is_consortium=None):
+        permission_dicts = self.permission_dicts
 
         if is_consortium is not None:
             permission_dicts = [d for d in permission_dicts if d["is_consortium"]==is_consortium]
@@ -87,6 +117,9 @@ class Institution(db.Model):
         return False
 
     def to_dict(self):
+        from package import load_package_flags
+        load_package_flags(self.packages)
+
         return OrderedDict([
             ("id", self.id),
             ("grid_ids", [g.grid_id for g in self.grid_ids]),
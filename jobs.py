@@ -0,0 +1,324 @@
+# coding: utf-8
+
+import argparse
+import os
+import random
+import threading
+import simplejson as json
+import traceback
+from collections import OrderedDict
+from time import time
+from time import sleep
+
+import shortuuid
+
+from app import app
+from app import db
+from app import get_db_cursor
+from app import s3_client
+from lazy_data import preload_datasets
+from redshift_copy import STAGING_BUCKET
+from util import elapsed
+from util import myconverter
+
+# Background jobs, for work that takes too long for a web request (heroku gives up after
+# 30 seconds).  The request calls submit_job and returns the job straight away, the jobs
+# process in the Procfile runs it, and GET /job/<job_id> shows its status and progress.
+# Small results are kept as json on the job row, files (exports) go to s3 and come back
+# from GET /job/<job_id>/result.
+#
+# Job types are functions registered with @job_type("name").  They're called with the Job
+# (for set_progress and save_result_file) and the args they were submitted with, and
+# whatever they return is the result.
+#
+# A running job updates its heartbeat every JOB_HEARTBEAT_SECONDS.  Dynos get restarted
+# (daily, and on every deploy), so run_jobs puts running jobs whose heartbeat has stopped
+# back in the queue, and fails them once they've been tried JOB_MAX_ATTEMPTS times.  It
+# also deletes finished jobs, and their result files, after JOB_RETENTION_DAYS.
+#
+# create table jump_job (
+#     job_id text, job_type text, args_json varchar(65535), created_by text,
+#     status text, progress_done integer, progress_total integer, progress_message text,
+#     result_json varchar(65535), result_s3_object text, result_content_type text, error varchar(65535),
+#     attempts integer, heartbeat timestamp,
+#     created timestamp, started timestamp, completed timestamp
+# );
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+JOB_RESULTS_PREFIX = "job-results"
+
+JOB_HEARTBEAT_SECONDS = 30
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", 300))
+JOB_MAX_ATTEMPTS = 3
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", 14))
+JOB_MAINTENANCE_SECONDS = 600
+
+_job_types = OrderedDict()
+
+
+def job_type(name):
+    def register(function):
+        _job_types[name] = function
+        return function
+    return register
+
+
+class Job(object):
+    def __init__(self, row):
+        self.job_id = row["job_id"]
+        self.job_type = row["job_type"]
+        self.args = json.loads(row["args_json"]) if row["args_json"] else {}
+        self.created_by = row["created_by"]
+        self.status = row["status"]
+        self.progress_done = row["progress_done"]
+        self.progress_total = row["progress_total"]
+        self.progress_message = row["progress_message"]
+        self.result = json.loads(row["result_json"]) if row["result_json"] else None
+        self.result_s3_object = row["result_s3_object"]
+        self.result_content_type = row["result_content_type"]
+        self.error = row["error"]
+        self.attempts = row["attempts"]
+        self.created = row["created"]
+        self.started = row["started"]
+        self.completed = row["completed"]
+
+    @property
+    def is_finished(self):
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    @property
+    def percent_complete(self):
+        if self.status == JOB_DONE:
+            return 100.0
+        if not self.progress_total:
+            return None
+        return round(100.0 * (self.progress_done or 0) / self.progress_total, 1)
+
+    def set_progress(self, done, total=None, message=None):
+        self.progress_done = done
+        if total is not None:
+            self.progress_total = total
+        if message is not None:
+            self.progress_message = message
+        command = """update jump_job set progress_done=%s, progress_total=%s, progress_message=%s
+            where job_id=%s"""
+        with get_db_cursor() as cursor:
+            cursor.execute(command, (self.progress_done, self.progress_total, self.progress_message, self.job_id))
+
+    def save_result_file(self, contents, content_type):
+        object_name = "{}/{}".format(JOB_RESULTS_PREFIX, self.job_id)
+        s3_client.put_object(Bucket=STAGING_BUCKET, Key=object_name, Body=contents.encode("utf-8"))
+        self.result_s3_object = object_name
+        self.result_content_type = content_type
+        command = "update jump_job set result_s3_object=%s, result_content_type=%s where job_id=%s"
+        with get_db_cursor() as cursor:
+            cursor.execute(command, (object_name, content_type, self.job_id))
+
+    def get_result_file(self):
+        if not self.result_s3_object:
+            return None
+        s3_object = s3_client.get_object(Bucket=STAGING_BUCKET, Key=self.result_s3_object)
+        return s3_object["Body"].read()
+
+    def to_dict(self):
+        response = OrderedDict()
+        response["id"] = self.job_id
+        response["type"] = self.job_type
+        response["status"] = self.status
+        response["progress_done"] = self.progress_done
+        response["progress_total"] = self.progress_total
+        response["progress_message"] = self.progress_message
+        response["percent_complete"] = self.percent_complete
+        response["result"] = self.result
+        response["has_result_file"] = self.result_s3_object is not None
+        response["error"] = self.error
+        response["created"] = self.created
+        response["started"] = self.started
+        response["completed"] = self.completed
+        return response
+
+    def __repr__(self):
+        return "<{} ({}) {} {}>".format(self.__class__.__name__, self.job_id, self.job_type, self.status)
+
+
+def submit_job(job_type_name, args=None, created_by=None):
+    if job_type_name not in _job_types:
+        raise ValueError("unknown job type {}".format(job_type_name))
+    job_id = "job-{}".format(shortuuid.uuid()[0:12])
+    command = """insert into jump_job (job_id, job_type, args_json, created_by, status, progress_done, attempts, created)
+        values (%s, %s, %s, %s, %s, 0, 0, sysdate)"""
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (job_id, job_type_name, json.dumps(args or {}, default=myconverter), created_by, JOB_QUEUED))
+    return get_job(job_id)
+
+
+def get_job(job_id):
+    with get_db_cursor() as cursor:
+        cursor.execute("select * from jump_job where job_id=%s", (job_id,))
+        rows = cursor.fetchall()
+    if not rows:
+        return None
+    return Job(rows[0])
+
+
+def claim_job(job_id):
+    # only one jobs dyno gets to run each job
+    claimed = {"rowcount": 0}
+    command = """update jump_job set status=%s, started=sysdate, heartbeat=sysdate, attempts=coalesce(attempts, 0) + 1
+        where job_id=%s and status=%s"""
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (JOB_RUNNING, job_id, JOB_QUEUED))
+        claimed["rowcount"] = cursor.rowcount
+    return claimed["rowcount"] == 1
+
+
+def finish_job(job, result=None, error=None):
+    status = JOB_FAILED if error else JOB_DONE
+    result_json = json.dumps(result, default=myconverter) if result is not None else None
+    command = """update jump_job set status=%s, result_json=%s, error=%s, completed=sysdate,
+        progress_done=case when %s then progress_total else progress_done end
+        where job_id=%s"""
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (status, result_json, error, status == JOB_DONE, job.job_id))
+
+
+def beat_heartbeat(job_id, stopped):
+    while not stopped.wait(JOB_HEARTBEAT_SECONDS):
+        with get_db_cursor() as cursor:
+            cursor.execute("update jump_job set heartbeat=sysdate where job_id=%s and status=%s", (job_id, JOB_RUNNING))
+
+
+def run_job(job):
+    start_time = time()
+    print("starting job {}".format(job))
+    stopped = threading.Event()
+    heartbeat_thread = threading.Thread(target=beat_heartbeat, args=(job.job_id, stopped))
+    heartbeat_thread.daemon = True
+    heartbeat_thread.start()
+    try:
+        with app.app_context():
+            result = _job_types[job.job_type](job, **job.args)
+        finish_job(job, result=result)
+        print("done job {} in {}s".format(job, elapsed(start_time)))
+    except Exception as e:
+        print("Error: exception {} in job {}".format(e, job))
+        finish_job(job, error=traceback.format_exc()[-60000:])
+    finally:
+        stopped.set()
+        try:
+            db.session.remove()
+        except:
+            pass
+
+
+def requeue_stale_jobs():
+    # running jobs whose dyno went away.  every job type replaces what it writes (the copy job
+    # deletes the new scenario's rows first), so running one again from the start is fine
+    stale = "status=%s and coalesce(heartbeat, started) < dateadd(second, -%s, sysdate)"
+    with get_db_cursor() as cursor:
+        cursor.execute("""update jump_job set status=%s, completed=sysdate,
+            error='stopped running ' || coalesce(attempts, 0)::varchar || ' times, giving up'
+            where {} and coalesce(attempts, 0) >= %s""".format(stale),
+            (JOB_FAILED, JOB_RUNNING, JOB_STALE_SECONDS, JOB_MAX_ATTEMPTS))
+        cursor.execute("""update jump_job set status=%s, progress_message='restarting'
+            where {} and coalesce(attempts, 0) < %s""".format(stale),
+            (JOB_QUEUED, JOB_RUNNING, JOB_STALE_SECONDS, JOB_MAX_ATTEMPTS))
+        return cursor.rowcount
+
+
+def prune_jobs(days=JOB_RETENTION_DAYS):
+    old = "status in %s and completed < dateadd(day, -%s, sysdate)"
+    with get_db_cursor() as cursor:
+        cursor.execute("select result_s3_object from jump_job where result_s3_object is not null and {}".format(old),
+                       ((JOB_DONE, JOB_FAILED), days))
+        s3_objects = [row["result_s3_object"] for row in cursor.fetchall()]
+
+    for s3_object in s3_objects:
+        try:
+            s3_client.delete_object(Bucket=STAGING_BUCKET, Key=s3_object)
+        except Exception as e:
+            print("Error: exception {} deleting job result {}".format(e, s3_object))
+
+    with get_db_cursor() as cursor:
+        cursor.execute("delete from jump_job where {}".format(old), ((JOB_DONE, JOB_FAILED), days))
+        return cursor.rowcount
+
+
+def run_jobs():
+    last_maintenance = 0
+    while True:
+        if time() - last_maintenance > JOB_MAINTENANCE_SECONDS:
+            num_requeued = requeue_stale_jobs()
+            num_pruned = prune_jobs()
+            print("requeued {} stale jobs, pruned {} old jobs".format(num_requeued, num_pruned))
+            last_maintenance = time()
+
+        command = "select job_id from jump_job where status=%s order by created"
+        with get_db_cursor() as cursor:
+            cursor.execute(command, (JOB_QUEUED,))
+            rows = cursor.fetchall()
+
+        for row in rows:
+            if not claim_job(row["job_id"]):
+                continue
+            job = get_job(row["job_id"])
+            if job.job_type not in _job_types:
+                finish_job(job, error="unknown job type {}".format(job.job_type))
+                continue
+            run_job(job)
+
+        sleep(2 * random.random())
+
+
+@job_type("copy_consortium_scenario")
+def copy_consortium_scenario_job(job, from_scenario_id, new_scenario_id):
+    from consortium import Consortium
+
+    job.set_progress(0, 1, "copying computed journals")
+    Consortium(from_scenario_id).copy_computed_journal_dicts(new_scenario_id)
+    return {"scenario_id": new_scenario_id}
+
+
+@job_type("consortium_recompute")
+def consortium_recompute_job(job, scenario_id):
+    from consortium import Consortium
+
+    def progress(num_members_done, num_members):
+        job.set_progress(num_members_done, num_members, "computing members")
+
+    Consortium(scenario_id).recompute_journal_dicts(progress=progress)
+    return {"scenario_id": scenario_id}
+
+
+@job_type("scenario_export")
+def scenario_export_job(job, scenario_id, gather_export_concepts=False):
+    from scenario_export import export_get
+    from scenario_export import scenario_export_table_dicts
+
+    job.set_progress(0, 2, "computing journals")
+    table_dicts = scenario_export_table_dicts(scenario_id, gather_export_concepts=gather_export_concepts)
+    job.set_progress(1, 2, "writing csv")
+    job.save_result_file("".join(export_get(table_dicts)), "text/csv")
+    return {"scenario_id": scenario_id, "num_journals": len(table_dicts)}
+
+
+# python jobs.py
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run stuff :)")
+    parser.add_argument("--job", help="run this one job now, whatever its status", type=str, default=None)
+    parser.add_argument("--prune", help="delete finished jobs older than this many days, then exit", type=int, default=None)
+    parsed_args = parser.parse_args()
+
+    if parsed_args.prune is not None:
+        print("pruned {} jobs".format(prune_jobs(parsed_args.prune)))
+        exit()
+
+    preload_datasets()
+    if parsed_args.job:
+        run_job(get_job(parsed_args.job))
+    else:
+        run_jobs()
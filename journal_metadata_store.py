@@ -0,0 +1,369 @@
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+import simplejson as json
+import numpy as np
+
+from jisc_utils import jisc_default_prices
+
+# All journal metadata in a handful of numpy arrays instead of one SQLAlchemy object per
+# journal: strings are utf-8 blobs with offsets, flags are int8 (-1 for null), prices are
+# float64 (nan for null), and issn lookups are binary searches over sorted issn arrays.
+# The arrays are saved to local disk once per metadata version and memory mapped, so all
+# the gunicorn workers on a dyno share one copy.
+
+STORE_DIR = os.getenv("JOURNAL_METADATA_STORE_DIR", os.path.join(tempfile.gettempdir(), "unsub-journal-metadata"))
+
+FLAG_COLUMNS = ["is_current_subscription_journal", "is_gold_journal_in_most_recent_year", "is_currently_publishing"]
+PRICE_COLUMNS = ["subscription_price_usd", "subscription_price_gbp", "apc_price_usd", "apc_price_gbp"]
+ARRAY_COLUMNS = ["issn_l", "title_blob", "title_offsets", "publisher_codes",
+                 "issns", "issns_offsets", "issn_index_keys", "issn_index_rows"] + FLAG_COLUMNS + PRICE_COLUMNS
+
+
+def _flag(value):
+    if value is None:
+        return -1
+    return 1 if value else 0
+
+
+def _price(value):
+    return np.nan if value is None else float(value)
+
+
+def _strings_to_blob(strings):
+    encoded = [(s or "").encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded]) if encoded else []
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8) if encoded else np.zeros(0, dtype=np.uint8)
+    return blob, offsets
+
+
+def _issn_array(issns):
+    width = max([len(issn) for issn in issns] + [1])
+    return np.array([issn.encode("ascii", "replace") for issn in issns], dtype="S{}".format(width))
+
+
+class JournalMetadataStore(object):
+    def __init__(self, arrays, publishers, version=None):
+        self.arrays = arrays
+        self.publishers = publishers
+        self.version = version
+        for name in ARRAY_COLUMNS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_rows(cls, rows, version=None):
+        # rows are dicts with the openalex_computed columns; issns_string is a json list
+        rows = sorted([row for row in rows if row["issn_l"]], key=lambda row: row["issn_l"])
+        # one row per issn_l, like the dict this replaces (the last one wins)
+        rows = list(dict([(row["issn_l"], row) for row in rows]).values())
+
+        publishers = []
+        publisher_code_lookup = {}
+        publisher_codes = []
+        for row in rows:
+            publisher = row["publisher"]
+            if publisher not in publisher_code_lookup:
+                publisher_code_lookup[publisher] = len(publishers)
+                publishers.append(publisher)
+            publisher_codes.append(publisher_code_lookup[publisher])
+
+        issns_per_row = [json.loads(row["issns_string"]) if row["issns_string"] else [] for row in rows]
+        issns_flat = [issn for issns in issns_per_row for issn in issns]
+        issns_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        issns_offsets[1:] = np.cumsum([len(issns) for issns in issns_per_row]) if rows else []
+
+        # issn -> row, the last journal listing an issn wins, like the dict this replaces
+        issn_rows = {}
+        for row_index, issns in enumerate(issns_per_row):
+            for issn in issns:
+                issn_rows[issn] = row_index
+        issn_index_keys = sorted(issn_rows.keys())
+
+        title_blob, title_offsets = _strings_to_blob([row["title"] for row in rows])
+
+        arrays = {
+            "issn_l": _issn_array([row["issn_l"] for row in rows]),
+            "title_blob": title_blob,
+            "title_offsets": title_offsets,
+            "publisher_codes": np.array(publisher_codes, dtype=np.int32),
+            "issns": _issn_array(issns_flat),
+            "issns_offsets": issns_offsets,
+            "issn_index_keys": _issn_array(issn_index_keys),
+            "issn_index_rows": np.array([issn_rows[issn] for issn in issn_index_keys], dtype=np.int32),
+        }
+        for column in FLAG_COLUMNS:
+            arrays[column] = np.array([_flag(row[column]) for row in rows], dtype=np.int8)
+        for column in PRICE_COLUMNS:
+            arrays[column] = np.array([_price(row[column]) for row in rows], dtype=np.float64)
+
+        return cls(arrays, publishers, version=version)
+
+    def save(self, directory):
+        os.makedirs(directory)
+        for name in ARRAY_COLUMNS:
+            np.save(os.path.join(directory, "{}.npy".format(name)), self.arrays[name])
+        with open(os.path.join(directory, "publishers.json"), "w") as f:
+            json.dump({"publishers": self.publishers, "version": self.version}, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        arrays = {}
+        for name in ARRAY_COLUMNS:
+            arrays[name] = np.load(os.path.join(directory, "{}.npy".format(name)), mmap_mode="r" if mmap else None)
+        with open(os.path.join(directory, "publishers.json")) as f:
+            meta = json.load(f)
+        return cls(arrays, meta["publishers"], version=meta["version"])
+
+    def __len__(self):
+        return len(self.issn_l)
+
+    @staticmethod
+    def _find(sorted_keys, key):
+        if not key:
+            return None
+        try:
+            key_bytes = key.encode("ascii")
+        except (UnicodeEncodeError, AttributeError):
+            return None
+        if len(key_bytes) > sorted_keys.dtype.itemsize:
+            return None
+        position = int(np.searchsorted(sorted_keys, key_bytes))
+        if position < len(sorted_keys) and sorted_keys[position] == key_bytes:
+            return position
+        return None
+
+    def row_for_issn_l(self, issn_l):
+        return self._find(self.issn_l, issn_l)
+
+    def row_for_issn(self, issn):
+        position = self._find(self.issn_index_keys, issn)
+        if position is None:
+            return None
+        return int(self.issn_index_rows[position])
+
+    def get_by_issn_l(self, issn_l):
+        row = self.row_for_issn_l(issn_l)
+        return None if row is None else JournalMetadataRow(self, row)
+
+    def get_by_issn(self, issn):
+        row = self.row_for_issn(issn)
+        return None if row is None else JournalMetadataRow(self, row)
+
+    def issn_l_at(self, row):
+        return self.issn_l[row].decode("ascii")
+
+    def title_at(self, row):
+        return bytes(self.title_blob[self.title_offsets[row]:self.title_offsets[row + 1]]).decode("utf-8")
+
+    def issns_at(self, row):
+        return [issn.decode("ascii") for issn in self.issns[self.issns_offsets[row]:self.issns_offsets[row + 1]]]
+
+    def flag_at(self, column, row):
+        value = self.arrays[column][row]
+        return None if value < 0 else bool(value)
+
+    def price_at(self, column, row):
+        value = self.arrays[column][row]
+        return None if np.isnan(value) else float(value)
+
+    def by_issn_l(self):
+        return JournalMetadataLookup(self, by_issn=False)
+
+    def by_issn(self):
+        return JournalMetadataLookup(self, by_issn=True)
+
+
+class JournalMetadataLookup(object):
+    # read-only dict-like view, standing in for the old all_journal_metadata(_flat) dicts
+
+    def __init__(self, store, by_issn):
+        self.store = store
+        self.by_issn = by_issn
+
+    def get(self, key, default=None):
+        response = self.store.get_by_issn(key) if self.by_issn else self.store.get_by_issn_l(key)
+        return default if response is None else response
+
+    def __getitem__(self, key):
+        response = self.get(key)
+        if response is None:
+            raise KeyError(key)
+        return response
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.store.issn_index_keys) if self.by_issn else len(self.store)
+
+    def keys(self):
+        keys = self.store.issn_index_keys if self.by_issn else self.store.issn_l
+        return [key.decode("ascii") for key in keys]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def values(self):
+        return [value for key, value in self.items()]
+
+    def items(self):
+        if self.by_issn:
+            return [(key.decode("ascii"), JournalMetadataRow(self.store, int(row)))
+                    for key, row in zip(self.store.issn_index_keys, self.store.issn_index_rows)]
+        return [(self.store.issn_l_at(row), JournalMetadataRow(self.store, row)) for row in range(len(self.store))]
+
+
+class JournalMetadataRow(object):
+    # same attributes as openalex.JournalMetadata, read from the store
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    @property
+    def issn_l(self):
+        return self._store.issn_l_at(self._row)
+
+    @property
+    def issns(self):
+        return self._store.issns_at(self._row)
+
+    @property
+    def issns_string(self):
+        return json.dumps(self.issns)
+
+    @property
+    def display_issns(self):
+        return ",".join(self.issns)
+
+    @property
+    def display_issn_l(self):
+        return "issn:{}".format(self.issn_l)
+
+    @property
+    def title(self):
+        return self._store.title_at(self._row)
+
+    @property
+    def publisher(self):
+        return self._store.publishers[self._store.publisher_codes[self._row]]
+
+    @property
+    def is_current_subscription_journal(self):
+        return self._store.flag_at("is_current_subscription_journal", self._row)
+
+    @property
+    def is_gold_journal_in_most_recent_year(self):
+        return self._store.flag_at("is_gold_journal_in_most_recent_year", self._row)
+
+    @property
+    def is_currently_publishing(self):
+        return self._store.flag_at("is_currently_publishing", self._row)
+
+    @property
+    def is_hybrid(self):
+        return not self.is_gold_journal_in_most_recent_year
+
+    @property
+    def subscription_price_usd(self):
+        return self._store.price_at("subscription_price_usd", self._row)
+
+    @property
+    def subscription_price_gbp(self):
+        return self._store.price_at("subscription_price_gbp", self._row)
+
+    @property
+    def apc_price_usd(self):
+        return self._store.price_at("apc_price_usd", self._row)
+
+    @property
+    def apc_price_gbp(self):
+        return self._store.price_at("apc_price_gbp", self._row)
+
+    @property
+    def publisher_code(self):
+        if self.publisher == "Elsevier":
+            return "Elsevier"
+        elif self.publisher == "Springer Nature":
+            return "SpringerNature"
+        elif self.publisher == "Wiley":
+            return "Wiley"
+        elif self.publisher == "SAGE":
+            return "Sage"
+        elif self.publisher == "Taylor & Francis":
+            return "TaylorFrancis"
+        return self.publisher
+
+    def get_subscription_price(self, currency="USD", use_high_price_if_unknown=False):
+        response = None
+        if currency == "USD":
+            if self.subscription_price_usd:
+                response = float(self.subscription_price_usd)
+        elif currency == "GBP":
+            if self.subscription_price_gbp:
+                response = float(self.subscription_price_gbp)
+
+        if not response:
+            if use_high_price_if_unknown and currency == "GBP":
+                response = jisc_default_prices(self.publisher_code)
+
+        return response
+
+    def get_apc_price(self, currency="USD"):
+        response = None
+        if currency == "USD":
+            if self.apc_price_usd:
+                response = float(self.apc_price_usd)
+        elif currency == "GBP":
+            if self.apc_price_gbp:
+                response = float(self.apc_price_gbp)
+        return response
+
+    def __eq__(self, other):
+        return isinstance(other, JournalMetadataRow) and other._store is self._store and other._row == self._row
+
+    def __hash__(self):
+        return hash((id(self._store), self._row))
+
+    def __repr__(self):
+        return "<{} ({}) '{}' {}>".format(self.__class__.__name__, self.issn_l, self.title, self.publisher)
+
+
+def store_directory(version):
+    version_slug = "".join([c if c.isalnum() else "-" for c in str(version)])
+    return os.path.join(STORE_DIR, version_slug)
+
+
+def load_or_build_store(version, get_rows):
+    # the first process on a dyno to need this version builds it, the rest map the saved files
+    if version is None:
+        # no stable version to save it under
+        return JournalMetadataStore.from_rows(get_rows())
+
+    directory = store_directory(version)
+    if not os.path.exists(directory):
+        store = JournalMetadataStore.from_rows(get_rows(), version=version)
+        temp_directory = "{}.tmp-{}".format(directory, os.getpid())
+        try:
+            store.save(temp_directory)
+            os.rename(temp_directory, directory)
+        except OSError as e:
+            # another worker got there first, or the disk isn't writable
+            print("not saving journal metadata store {}: {}".format(directory, e))
+            shutil.rmtree(temp_directory, ignore_errors=True)
+            if not os.path.exists(directory):
+                return store
+        _remove_old_versions(directory)
+    return JournalMetadataStore.load(directory)
+
+
+def _remove_old_versions(current_directory):
+    # processes still using an old version keep their mapped files until they let go of them
+    for name in os.listdir(STORE_DIR):
+        path = os.path.join(STORE_DIR, name)
+        if path != current_directory and ".tmp-" not in name:
+            shutil.rmtree(path, ignore_errors=True)
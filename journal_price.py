@@ -5,6 +5,7 @@ from collections import OrderedDict
 
 from app import db
 from package_input import PackageInput
+from package_cache import PRICE
 
 
 class JournalPrice(db.Model):
@@ -19,8 +20,8 @@ class JournalPrice(db.Model):
 
     @cached_property
     def journal_metadata(self):
-        from openalex import MissingJournalMetadata, all_journal_metadata
-        meta = all_journal_metadata.get(self.issn_l)
+        from openalex import MissingJournalMetadata, get_all_journal_metadata
+        meta = get_all_journal_metadata().get(self.issn_l)
         if not meta:
             meta = MissingJournalMetadata(issn_l=self.issn_l)
         return meta
@@ -95,8 +96,11 @@ class JournalPriceInput(db.Model, PackageInput):
     def file_type_label(self):
         return "price"
 
-    def clear_caches(self, my_package):
-        super(JournalPriceInput, self).clear_caches(my_package)
+    def cache_data_type(self):
+        return PRICE
+
+    def clear_caches(self, my_package, issn_ls=None):
+        super(JournalPriceInput, self).clear_caches(my_package, issn_ls)
 
     def validate_publisher(self):
         return True
@@ -16,6 +16,7 @@ from util import elapsed
 from util import chunks
 from util import sql_bool
 from util import sql_escape_string
+from lazy_data import register_dataset
 
 
 class JiscDefaultPrices(Enum):
@@ -303,15 +304,13 @@ class MissingJournalMetadata(object):
 
 
 def get_journal_metadata(issn):
-    global all_journal_metadata_flat
-    my_journal_metadata = all_journal_metadata_flat.get(issn, None)
+    my_journal_metadata = journal_metadata_data.get()["all_journal_metadata_flat"].get(issn, None)
     if not my_journal_metadata:
         my_journal_metadata = MissingJournalMetadata(issn_l=issn)
     return my_journal_metadata
 
 def get_journal_metadata_issnl_only(issn_l):
-    global all_journal_metadata
-    my_journal_metadata = all_journal_metadata.get(issn_l, None)
+    my_journal_metadata = journal_metadata_data.get()["all_journal_metadata"].get(issn_l, None)
     if not my_journal_metadata:
         my_journal_metadata = MissingJournalMetadata(issn_l=issn_l)
     return my_journal_metadata
@@ -324,10 +323,8 @@ def get_journal_metadata_for_publisher(publisher):
     }
     publisher_normalized = lookup_journaldb_publisher.get(publisher, publisher)
 
-    global all_journal_metadata
-
     response = {}
-    for issn_l, journal_metadata in all_journal_metadata.items():
+    for issn_l, journal_metadata in journal_metadata_data.get()["all_journal_metadata"].items():
         if journal_metadata.publisher == publisher_normalized:
             response[issn_l] = journal_metadata
     return response
@@ -341,18 +338,35 @@ def get_journal_metadata_for_publisher_currently_subscription(publisher):
     return response
 
 
-print("loading all journal metadata...", end=' ')
-start_time = time()
-all_journal_metadata_list = JournalMetadata.query.all()
-[db.session.expunge(my_journal_metadata) for my_journal_metadata in all_journal_metadata_list]
-all_journal_metadata = dict(list(zip([journal_object.issn_l for journal_object in all_journal_metadata_list], all_journal_metadata_list)))
-all_journal_metadata_flat = {}
-for issn_l, journal_metadata in all_journal_metadata.items():
-    for issn in journal_metadata.issns:
-        all_journal_metadata_flat[issn] = journal_metadata
-
+def journal_metadata_version():
+    with get_db_cursor() as cursor:
+        cursor.execute("select max(created) as created, count(*) as num_journals from journalsdb_computed")
+        rows = cursor.fetchall()
+    if not rows[0]["num_journals"]:
+        # being recomputed
+        return None
+    return "{}-{}".format(rows[0]["created"], rows[0]["num_journals"])
 
-print("loaded all journal metadata in {} seconds.".format(elapsed(start_time)))
+def _load_journal_metadata(version):
+    print("loading all journal metadata...", end=' ')
+    start_time = time()
+    all_journal_metadata_list = JournalMetadata.query.all()
+    [db.session.expunge(my_journal_metadata) for my_journal_metadata in all_journal_metadata_list]
+    all_journal_metadata = dict(list(zip([journal_object.issn_l for journal_object in all_journal_metadata_list], all_journal_metadata_list)))
+    all_journal_metadata_flat = {}
+    for issn_l, journal_metadata in all_journal_metadata.items():
+        for issn in journal_metadata.issns:
+            all_journal_metadata_flat[issn] = journal_metadata
+    print("loaded all journal metadata in {} seconds.".format(elapsed(start_time)))
+    return {"all_journal_metadata": all_journal_metadata, "all_journal_metadata_flat": all_journal_metadata_flat}
+
+journal_metadata_data = register_dataset("journalsdb_journal_metadata", _load_journal_metadata, version=journal_metadata_version)
+
+def __getattr__(name):
+    # so journalsdb.all_journal_metadata etc still work, loading on first use
+    if name in ("all_journal_metadata", "all_journal_metadata_flat"):
+        return journal_metadata_data.get()[name]
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
 
 # python journalsdb.py --recompute
 # heroku run --size=performance-l python journalsdb.py --recompute -r heroku
@@ -0,0 +1,209 @@
+# coding: utf-8
+
+import argparse
+import importlib
+import os
+import threading
+from collections import OrderedDict
+from time import time
+from time import sleep
+
+from db_pool import dyno_process_type
+
+# Big global datasets (journal metadata, common package data, the ROR index) used to be
+# loaded when their module was imported, so every process paid for all of them at boot.
+# Now each is registered here and loaded the first time it's used.
+#
+# Which ones get loaded at boot is set by PRELOAD_DATASETS_<PROCESS TYPE> or
+# PRELOAD_DATASETS: "all", "none", or a comma separated list of names.  By default web
+# dynos preload everything, so the first requests aren't slow, and nothing else does.
+#
+# Datasets registered with a version function are also checked every
+# DATASET_VERSION_CHECK_SECONDS once loaded.  When the version changes (eg after
+# openalex.py --recompute) the new data is built in a background thread and swapped in,
+# so requests keep using the old copy until the new one is ready, and nothing restarts.
+
+DATASET_VERSION_CHECK_SECONDS = int(os.getenv("DATASET_VERSION_CHECK_SECONDS", 300))
+
+_datasets = OrderedDict()
+_registry_lock = threading.Lock()
+_version_check_state = {"thread": None}
+
+
+class LazyDataset(object):
+    # with a version function, the loader is called with the version it should load
+
+    def __init__(self, name, loader, version=None):
+        self.name = name
+        self.loader = loader
+        self.version_function = version
+        self.lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.value = None
+        self.version = None
+        self.pending_version = None
+        self.is_loaded = False
+        self.load_seconds = None
+        self.loaded_at = None
+
+    def get(self):
+        if not self.is_loaded:
+            with self.lock:
+                if not self.is_loaded:
+                    self._load()
+                    start_version_checks()
+        return self.value
+
+    def _build(self, version):
+        if self.version_function:
+            return self.loader(version)
+        return self.loader()
+
+    def _load(self):
+        start_time = time()
+        version = self.version_function() if self.version_function else None
+        self.value = self._build(version)
+        self.version = version
+        self.load_seconds = time() - start_time
+        self.loaded_at = time()
+        self.is_loaded = True
+
+    def reload_if_changed(self):
+        # builds the new value without holding self.lock, so get() keeps returning the old one
+        if not self.version_function or not self.is_loaded:
+            return False
+        with self.reload_lock:
+            version = self.version_function()
+            if version is None or version == self.version:
+                return False
+            if version != self.pending_version:
+                # the tables may still be being written, so only reload once the
+                # new version has stayed the same for a whole check interval
+                self.pending_version = version
+                return False
+            print("reloading {}, version {} -> {}".format(self.name, self.version, version))
+            start_time = time()
+            value = self._build(version)
+            with self.lock:
+                self.value = value
+                self.version = version
+                self.load_seconds = time() - start_time
+                self.loaded_at = time()
+            print("reloaded {} in {} seconds".format(self.name, round(self.load_seconds, 2)))
+            return True
+
+    def reset(self):
+        with self.lock:
+            self.value = None
+            self.version = None
+            self.is_loaded = False
+
+    def __repr__(self):
+        return "<{} ({}) loaded={}>".format(self.__class__.__name__, self.name, self.is_loaded)
+
+
+def register_dataset(name, loader, version=None):
+    with _registry_lock:
+        if name not in _datasets:
+            _datasets[name] = LazyDataset(name, loader, version=version)
+        return _datasets[name]
+
+
+def reload_changed_datasets():
+    for dataset in list(_datasets.values()):
+        try:
+            dataset.reload_if_changed()
+        except Exception as e:
+            print("Error: exception {} reloading dataset {}".format(e, dataset.name))
+
+
+def _check_versions_forever():
+    while True:
+        sleep(DATASET_VERSION_CHECK_SECONDS)
+        reload_changed_datasets()
+
+
+def start_version_checks():
+    with _registry_lock:
+        if _version_check_state["thread"] is not None or DATASET_VERSION_CHECK_SECONDS <= 0:
+            return
+        thread = threading.Thread(target=_check_versions_forever)
+        thread.daemon = True
+        _version_check_state["thread"] = thread
+    thread.start()
+
+
+def get_dataset(name):
+    return _datasets[name].get()
+
+
+def preload_setting():
+    process_type = dyno_process_type()
+    value = None
+    if process_type:
+        value = os.getenv("PRELOAD_DATASETS_{}".format(process_type.upper()))
+    if value is None:
+        value = os.getenv("PRELOAD_DATASETS")
+    if value is None:
+        value = "all" if process_type == "web" else "none"
+    return value.strip().lower()
+
+
+def preload_datasets(names=None):
+    if names is None:
+        setting = preload_setting()
+        if setting == "none":
+            return
+        names = list(_datasets.keys()) if setting == "all" else [name.strip() for name in setting.split(",") if name.strip()]
+
+    for name in names:
+        if name not in _datasets:
+            print("Error: unknown dataset {} in preload_datasets".format(name))
+            continue
+        _datasets[name].get()
+        print("preloaded {} in {} seconds".format(name, round(_datasets[name].load_seconds, 2)))
+
+
+def datasets_report():
+    response = []
+    for name, dataset in _datasets.items():
+        response.append(OrderedDict([
+            ("name", name),
+            ("is_loaded", dataset.is_loaded),
+            ("load_seconds", round(dataset.load_seconds, 2) if dataset.load_seconds is not None else None),
+            ("version", dataset.version),
+        ]))
+    return response
+
+
+def import_profile(module_names):
+    # seconds to import each module (including anything it imports first), and
+    # which datasets got loaded along the way.  run in a fresh process
+    response = []
+    for module_name in module_names:
+        loaded_before = set([name for name, dataset in _datasets.items() if dataset.is_loaded])
+        start_time = time()
+        importlib.import_module(module_name)
+        response.append(OrderedDict([
+            ("module", module_name),
+            ("import_seconds", round(time() - start_time, 2)),
+            ("datasets_loaded", [name for name, dataset in _datasets.items() if dataset.is_loaded and name not in loaded_before]),
+        ]))
+    return response
+
+
+# python lazy_data.py --profile app openalex package views
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", nargs="+", help="modules to import, in order", default=["app", "views"])
+    parser.add_argument("--preload", help="also time loading every dataset", action="store_true", default=False)
+    parsed_args = parser.parse_args()
+
+    for row in import_profile(parsed_args.profile):
+        print("import {module: <20} {import_seconds: >8}s  datasets loaded: {datasets_loaded}".format(**row))
+
+    if parsed_args.preload:
+        preload_datasets(list(_datasets.keys()))
+
+    for row in datasets_report():
+        print("dataset {name: <20} loaded={is_loaded} {load_seconds}s".format(**row))
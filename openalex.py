@@ -6,8 +6,6 @@ import simplejson as json
 from kids.cache import cache
 from cached_property import cached_property
 from time import time
-from psycopg2 import sql
-from psycopg2.extras import execute_values
 from enum import Enum
 
 from app import db
@@ -19,6 +17,9 @@ from util import sql_escape_string
 from journalsdb_pricing import jdb_pricing
 from jisc_utils import jisc_default_prices
 from openalex_date_last_doi import OpenalexDateLastDOI
+from lazy_data import register_dataset
+from redshift_copy import CopyStagingFile, replace_table_contents
+from journal_metadata_store import load_or_build_store, FLAG_COLUMNS, PRICE_COLUMNS
 
 
 class OpenalexDBRaw(db.Model):
@@ -111,6 +112,22 @@ class JournalMetadata(db.Model):
 			self.apc_price_usd,
 			self.apc_price_gbp,)
 
+	def get_copy_list(self):
+		# same columns as get_insert_list, unescaped, for redshift_copy
+		return (
+			self.created,
+			self.issn_l,
+			self.issns_string,
+			self.title,
+			self.publisher,
+			self.is_current_subscription_journal,
+			self.is_gold_journal_in_most_recent_year,
+			self.is_currently_publishing,
+			self.subscription_price_usd,
+			self.subscription_price_gbp,
+			self.apc_price_usd,
+			self.apc_price_gbp,)
+
 	@classmethod
 	def get_insert_column_names(cls):
 		return ["created",
@@ -272,58 +289,30 @@ def recompute_journal_metadata():
 	for x in last_dois:
 		last_dois_dict[x.issn_l] = x
 
-	print("making backups and getting tables ready to run")
-	with get_db_cursor() as cursor:
-		cursor.execute("drop table openalex_computed_bak_yesterday;")
-		cursor.execute("create table openalex_computed_bak_yesterday as (select * from openalex_computed);")
-		cursor.execute("drop table openalex_concepts_bak_yesterday;")
-		cursor.execute("create table openalex_concepts_bak_yesterday as (select * from openalex_concepts);")
-
-	# do it as its own to force commit
-	with get_db_cursor() as cursor:
-		cursor.execute("delete from openalex_computed")
-		cursor.execute("delete from openalex_concepts")
-	print("tables ready for insertion")
-
-	new_computed_journals = []
+	# rows go straight into the staging files as each journal is computed, then one
+	# COPY per table and a swap, so openalex_computed is never empty while this runs
+	start_time = time()
+	computed_file = CopyStagingFile("openalex_computed", JournalMetadata.get_insert_column_names())
+	concepts_file = CopyStagingFile("openalex_concepts", JournalConcepts.get_insert_column_names())
 	for journal_raw in journals_raw:
 		new_journal_metadata = JournalMetadata(journal_raw)
 		if new_journal_metadata.issns:
-			new_computed_journals.append(new_journal_metadata)
-
-	print("now commiting to openalex_computed")
-	start_time = time()
-	insert_values = [j.get_insert_list() for j in new_computed_journals]
-	cols = JournalMetadata.get_insert_column_names()
+			computed_file.writerow(new_journal_metadata.get_copy_list())
+		new_journal_concept = JournalConcepts(journal_raw)
+		if new_journal_concept.data:
+			concepts_file.writerows(new_journal_concept.data)
+	print("computed {} journals and {} concepts in {} seconds".format(
+		computed_file.num_rows, concepts_file.num_rows, elapsed(start_time)))
 
-	with get_db_cursor() as cursor:
-		qry = sql.SQL("INSERT INTO openalex_computed ({}) VALUES %s").format(
-			sql.SQL(', ').join(map(sql.Identifier, cols)))
-		execute_values(cursor, qry, insert_values, page_size=1000)
+	print("now loading openalex_computed")
+	replace_table_contents("openalex_computed", computed_file, backup_table="openalex_computed_bak_yesterday")
 
 	print("now refreshing openalex_computed_flat view")
 	with get_db_cursor() as cursor:
 		cursor.execute("refresh materialized view openalex_computed_flat;")
-		cursor.execute("analyze openalex_computed;")
 
-	new_computed_concepts = []
-	for journal_raw in journals_raw:
-		new_journal_concept = JournalConcepts(journal_raw)
-		new_computed_concepts.append(new_journal_concept)
-
-	concept_insert_values_tmp = [j.data for j in new_computed_concepts]
-	concept_insert_values = []
-	for index, x in enumerate(concept_insert_values_tmp):
-		if x:
-			concept_insert_values.extend(x)
-	
-	concept_cols = JournalConcepts.get_insert_column_names()
-
-	print("now commiting to openalex_concepts")
-	with get_db_cursor() as cursor:
-		qry = sql.SQL("INSERT INTO openalex_concepts ({}) VALUES %s").format(
-			sql.SQL(', ').join(map(sql.Identifier, concept_cols)))
-		execute_values(cursor, qry, concept_insert_values, page_size=1000)
+	print("now loading openalex_concepts")
+	replace_table_contents("openalex_concepts", concepts_file, backup_table="openalex_concepts_bak_yesterday")
 
 	# print("adding sort key (issn_l) to openalex_concepts")
 	# with get_db_cursor() as cursor:
@@ -333,24 +322,62 @@ def recompute_journal_metadata():
 
 
 
-print("loading all journal metadata...", end=' ')
-start_time = time()
-all_journal_metadata_list = JournalMetadata.query.all()
-[db.session.expunge(my_journal_metadata) for my_journal_metadata in all_journal_metadata_list]
-all_journal_metadata = dict(list(zip([journal_object.issn_l for journal_object in all_journal_metadata_list], all_journal_metadata_list)))
-all_journal_metadata_flat = {}
-for issn_l, journal_metadata in all_journal_metadata.items():
-    for issn in journal_metadata.issns:
-        all_journal_metadata_flat[issn] = journal_metadata
+def journal_metadata_version():
+	with get_db_cursor() as cursor:
+		cursor.execute("select max(created) as created, count(*) as num_journals from openalex_computed")
+		rows = cursor.fetchall()
+	if not rows[0]["num_journals"]:
+		# nothing computed yet
+		return None
+	return "{}-{}".format(rows[0]["created"], rows[0]["num_journals"])
+
+def _journal_metadata_rows():
+	command = "select {} from openalex_computed".format(", ".join(["issn_l", "issns_string", "title", "publisher"] + FLAG_COLUMNS + PRICE_COLUMNS))
+	with get_db_cursor() as cursor:
+		cursor.execute(command)
+		rows = cursor.fetchall()
+	return rows
+
+def _load_journal_metadata(version):
+	print("loading all journal metadata...", end=' ')
+	start_time = time()
+	store = load_or_build_store(version, _journal_metadata_rows)
+	print("loaded all journal metadata in {} seconds.".format(elapsed(start_time)))
+	return {"all_journal_metadata": store.by_issn_l(), "all_journal_metadata_flat": store.by_issn(), "store": store}
+
+def _load_oa_issns(version):
+	# load issns from openalex_computed_flat
+	with get_db_cursor() as cursor:
+		cursor.execute("select issn from openalex_computed_flat")
+		rows = cursor.fetchall()
+	return frozenset([w[0] for w in rows])
+
+# openalex_computed_flat is refreshed by recompute_journal_metadata too, so the same version works for both
+journal_metadata_data = register_dataset("journal_metadata", _load_journal_metadata, version=journal_metadata_version)
+oa_issns_data = register_dataset("oa_issns", _load_oa_issns, version=journal_metadata_version)
+
+def get_all_journal_metadata():
+	return journal_metadata_data.get()["all_journal_metadata"]
+
+def get_all_journal_metadata_flat():
+	return journal_metadata_data.get()["all_journal_metadata_flat"]
 
-# load issns from openalex_computed_flat
-with get_db_cursor() as cursor:
-	cursor.execute("select issn from openalex_computed_flat")
-	rows = cursor.fetchall()
+def get_oa_issns():
+	return oa_issns_data.get()
 
-oa_issns = [w[0] for w in rows]
+def get_journal_metadata(issn):
+	my_journal_metadata = get_all_journal_metadata_flat().get(issn, None)
+	if not my_journal_metadata:
+		my_journal_metadata = MissingJournalMetadata(issn_l=issn)
+	return my_journal_metadata
 
-print("loaded all journal metadata in {} seconds.".format(elapsed(start_time)))
+def __getattr__(name):
+	# so openalex.all_journal_metadata etc still work, loading on first use
+	if name in ("all_journal_metadata", "all_journal_metadata_flat"):
+		return journal_metadata_data.get()[name]
+	if name == "oa_issns":
+		return oa_issns_data.get()
+	raise AttributeError("module {} has no attribute {}".format(__name__, name))
 
 
 class MissingJournalMetadata(object):
@@ -358,7 +385,7 @@ class MissingJournalMetadata(object):
 		self.issn_l = issn_l
 		# only print below if issn actually not known to openalex
 		# in some cases we call this class with a subset of openalex ISSNs, leading to false positives
-		if issn_l not in oa_issns:
+		if issn_l not in get_oa_issns():
 			print("MissingJournalMetadata: missing {} from openalex: https://api.openalex.org/venues/issn:{}".format(issn_l, issn_l))
 		super(MissingJournalMetadata, self).__init__()
 
@@ -3,6 +3,7 @@
 from cached_property import cached_property
 import numpy as np
 from collections import OrderedDict
+from collections import defaultdict
 import datetime
 import shortuuid
 from time import time
@@ -18,13 +19,17 @@ from app import s3_client
 # from app import my_memcached # disable memcached
 from apc_journal import ApcJournal
 from saved_scenario import SavedScenario # used in relationship
+from saved_scenario import load_latest_scenarios
 from institution import Institution  # used in relationship
 from scenario import get_core_list_from_db, get_apc_data_from_db
 from util import get_sql_dict_rows
 from util import safe_commit
 from util import for_sorting
 from util import elapsed
-from openalex import JournalMetadata, MissingJournalMetadata, all_journal_metadata_flat
+from openalex import MissingJournalMetadata, get_all_journal_metadata, get_all_journal_metadata_flat
+from package_cache import package_issn_cache
+from package_cache import PRICE
+from pending_uploads import pending_uploads_index
 
 
 class Package(db.Model):
@@ -82,11 +87,13 @@ class Package(db.Model):
 
     @cached_property
     def journal_metadata(self):
-        meta_list = JournalMetadata.query.filter(
-            JournalMetadata.issn_l.in_(self.unique_issns),
-            JournalMetadata.is_current_subscription_journal).all()
-        [db.session.expunge(my_meta) for my_meta in meta_list]
-        return dict(list(zip([j.issn_l for j in meta_list], meta_list)))
+        all_journal_metadata = get_all_journal_metadata()
+        response = {}
+        for issn_l in self.unique_issns:
+            my_meta = all_journal_metadata.get(issn_l, None)
+            if my_meta and my_meta.is_current_subscription_journal:
+                response[issn_l] = my_meta
+        return response
 
     @cached_property
     def journal_metadata_flat(self):
@@ -315,7 +322,7 @@ class Package(db.Model):
 
     @property
     def feedback_scenario_dicts(self):
-        feedback_scenarios = [s for s in self.saved_scenarios if s.is_feedback_scenario]
+        feedback_scenarios = load_latest_scenarios([s for s in self.saved_scenarios if s.is_feedback_scenario])
         feedback_scenario_dicts = [s.to_dict_minimal() for s in feedback_scenarios]
         return feedback_scenario_dicts
 
@@ -411,14 +418,8 @@ class Package(db.Model):
 
     @cached_property
     def journals_filtering(self):
-        filtering = []
-        with get_db_cursor() as cursor:
-            qry = "select distinct(issn_l) from jump_journal_filter where package_id = %s"
-            cursor.execute(qry, (self.package_id,))
-            rows = cursor.fetchall()
-        if rows:
-            filtering = [w[0] for w in rows]
-        return filtering
+        from scenario import get_journal_filter_from_db
+        return list(get_journal_filter_from_db(self.package_id).keys())
 
     @cached_property
     def returned_big_deal_cost(self):
@@ -473,6 +474,7 @@ class Package(db.Model):
         if not hasattr(self, "apc_data"):
             self.apc_data = get_apc_data_from_db(self.package_id)
 
+        all_journal_metadata_flat = get_all_journal_metadata_flat()
         for issn_l in issn_ls:
             meta = all_journal_metadata_flat.get(issn_l, None)
             if meta:
@@ -638,28 +640,26 @@ class Package(db.Model):
                         my_dict["is_live"] = False
 
         # handle the ones that have been uploaded but not processed yet
-        upload_preprocess_bucket = "unsub-file-uploads-preprocess-testing" if os.getenv("TESTING_DB") else "unsub-file-uploads-preprocess"
-        preprocess_file_list = s3_client.list_objects(Bucket=upload_preprocess_bucket)
-        for preprocess_file in preprocess_file_list.get("Contents", []):
-            filename = preprocess_file["Key"]
-            filename_base = filename.split(".")[0]
-            try:
-                preprocess_package_id, preprocess_filetype = filename_base.split("_")
-            except ValueError:
-                # not a valid file, skip it
+        for preprocess_filetype, uploaded in pending_uploads_index.get(self.package_id).items():
+            my_dict = data_files_dict.get(preprocess_filetype, None)
+            if not my_dict:
+                continue
+            # the index can lag behind parse_uploads, so a file parsed since it was uploaded isn't pending.
+            # parse_uploads runs in another process, so this is where this process finds out
+            if my_dict["created_date"] and my_dict["created_date"] >= uploaded:
+                pending_uploads_index.remove(self.package_id, preprocess_filetype, uploaded)
                 continue
-            # size = preprocess_file["Size"]
-            # age_seconds = (datetime.datetime.utcnow() - preprocess_file["LastModified"].replace(tzinfo=None)).total_seconds()
-            if preprocess_package_id == self.package_id:
-                my_dict = data_files_dict[preprocess_filetype]
-                my_dict["is_uploaded"] = True
-                my_dict["is_parsed"] = False
-                my_dict["is_live"] = False
+            my_dict["is_uploaded"] = True
+            my_dict["is_parsed"] = False
+            my_dict["is_live"] = False
 
         return data_files_dict
 
+    @cached_property
+    def data_files_list(self):
+        return sorted(list(self.data_files_dict.values()), key=lambda x: 0 if x["rows_count"]==None else x["rows_count"], reverse=True)
+
     def to_package_dict(self):
-        data_files_list = sorted(list(self.data_files_dict.values()), key=lambda x: 0 if x["rows_count"]==None else x["rows_count"], reverse=True)
         response = OrderedDict([
             ("id", self.package_id),
             ("created", self.created),
@@ -675,13 +675,13 @@ class Package(db.Model):
             ("has_complete_counter_data", self.has_complete_counter_data),
             ("filter_data_set", self.filter_data_set),
             ("has_custom_prices", self.has_custom_prices),
-            ("data_files", data_files_list),
+            ("data_files", self.data_files_list),
             # @todo for testing, show all scenarios even with owned by consortium
             # ("is_owned_by_consortium", self.is_owned_by_consortium),
             ("is_owned_by_consortium", False),
             ("is_consortial_proposal_set", self.is_feedback_package),
             # ("scenarios", [s.to_dict_minimal() for s in self.saved_scenarios if not s.is_feedback_scenario]),
-            ("scenarios", [s.to_dict_minimal() for s in self.saved_scenarios]),
+            ("scenarios", [s.to_dict_minimal() for s in load_latest_scenarios(self.saved_scenarios)]),
             ("warnings", self.warnings),
         ])
         return response
@@ -726,6 +726,40 @@ class Package(db.Model):
         return "<{} ({}) {}>".format(self.__class__.__name__, self.package_id, self.package_name)
 
 
+def load_package_flags(packages):
+    # fills in the consortium ownership and feedback cached_propertys for many packages
+    # with two queries, instead of two queries per package
+    packages = [my_package for my_package in packages if my_package.package_id]
+    if not packages:
+        return
+
+    package_ids = tuple(set([my_package.package_id for my_package in packages]))
+    owner_command = """
+        select member_package_id, scenario_id as consortium_scenario_id
+            from jump_consortium_members cm
+            join jump_package_scenario ps on cm.consortium_package_id=ps.package_id
+            where member_package_id in %s
+        """
+    feedback_command = "select * from jump_consortium_feedback_requests where member_package_id in %s"
+    with get_db_cursor() as cursor:
+        cursor.execute(owner_command, (package_ids,))
+        owner_rows = cursor.fetchall()
+        cursor.execute(feedback_command, (package_ids,))
+        feedback_rows = cursor.fetchall()
+
+    owner_scenario_ids = defaultdict(list)
+    for row in owner_rows:
+        owner_scenario_ids[row["member_package_id"]].append(row["consortium_scenario_id"])
+    feedback_rows_by_package = defaultdict(list)
+    for row in feedback_rows:
+        feedback_rows_by_package[row["member_package_id"]].append(row)
+
+    for my_package in packages:
+        scenario_ids = owner_scenario_ids[my_package.package_id]
+        my_package.__dict__["consortia_scenario_ids_who_own_this_package"] = scenario_ids
+        my_package.__dict__["feedback_rows"] = feedback_rows_by_package[my_package.package_id] if scenario_ids else []
+
+
 def clone_demo_package(institution):
     demo_package = Package.query.filter(Package.package_id == DEMO_PACKAGE_ID).first()
     now = datetime.datetime.utcnow().isoformat(),
@@ -837,14 +871,22 @@ def check_if_to_delete(package_id, file):
 
 
 def get_custom_prices(package_id):
-    package_dict = {}
-
     if check_if_to_delete(package_id, "price"):
-        return package_dict
+        return {}
+
+    return get_custom_prices_from_db(package_id)
+
+
+@package_issn_cache(PRICE)
+def get_custom_prices_from_db(package_id, issn_ls=None):
+    package_dict = {}
 
     command = "select issn_l, price from jump_journal_prices where (package_id=%s)"
     with get_db_cursor() as cursor:
-        cursor.execute(command, (package_id,))
+        if issn_ls is not None:
+            cursor.execute(command + " and issn_l in %s", (package_id, tuple(issn_ls),))
+        else:
+            cursor.execute(command, (package_id,))
         rows = cursor.fetchall()
 
     for row in rows:
@@ -0,0 +1,222 @@
+# coding: utf-8
+
+import copy
+import datetime
+import functools
+import os
+import threading
+from collections import OrderedDict
+from time import sleep
+
+from app import get_db_cursor
+
+# Caches the per-journal package data that scenarios are built from (counter totals,
+# custom prices, perpetual access, title filters), keyed by (package_id, data_type)
+# and then by issn_l.  Uploads invalidate only the issn_ls they touched, and only
+# those journals are reloaded from the db.
+#
+# Each process keeps the PACKAGE_CACHE_SIZE (package_id, data_type)s it used last.
+#
+# Invalidations are shared between processes (parse_uploads -> web) through this table:
+# create table jump_cache_invalidation (package_id text, data_type text, issn_l text, updated timestamp) sortkey (updated);
+# issn_l is null when the whole package should be reloaded for that data_type.
+#
+# updated is sysdate when the insert started, and inserts commit in any order, so a row
+# can show up with an updated older than rows already seen.  each check re-reads the last
+# INVALIDATION_OVERLAP_SECONDS and skips rows it has already applied.  parse_uploads
+# deletes rows older than INVALIDATION_RETENTION_HOURS (prune_cache_invalidations).
+# a background thread, started by the first read, does the checks.
+
+COUNTER = "counter"
+PRICE = "price"
+PERPETUAL_ACCESS = "perpetual_access"
+FILTER = "filter"
+
+DATA_TYPES = [COUNTER, PRICE, PERPETUAL_ACCESS, FILTER]
+
+PACKAGE_CACHE_SIZE = int(os.getenv("PACKAGE_CACHE_SIZE", 400))
+# how often to look for invalidations written by other processes
+CHECK_INVALIDATIONS_SECONDS = 2
+INVALIDATION_OVERLAP_SECONDS = 60
+INVALIDATION_RETENTION_HOURS = 24
+
+_loaders = {}
+_cache_dict = OrderedDict()
+_lock = threading.RLock()
+_invalidations_state = {"last_updated": None, "applied": set(), "thread": None}
+
+
+def package_issn_cache(data_type):
+    # the decorated function must accept (package_id, issn_ls=None) and
+    # return a dict keyed by issn_l, restricted to issn_ls when it is given
+    def decorator(func):
+        _loaders[data_type] = func
+
+        @functools.wraps(func)
+        def wrapper(package_id, issn_ls=None):
+            if issn_ls is not None:
+                return func(package_id, issn_ls)
+            return get_package_issn_values(package_id, data_type)
+
+        wrapper.uncached = func
+        return wrapper
+
+    return decorator
+
+
+def get_package_issn_values(package_id, data_type):
+    if _invalidations_state["thread"] is None:
+        start_invalidation_checks()
+
+    cache_key = (package_id, data_type)
+    with _lock:
+        cached = _cache_dict.get(cache_key, None)
+        if cached is not None:
+            _cache_dict.move_to_end(cache_key)
+    if cached is None:
+        cached = _loaders[data_type](package_id, None)
+        with _lock:
+            _cache_dict[cache_key] = cached
+            while len(_cache_dict) > PACKAGE_CACHE_SIZE:
+                _cache_dict.popitem(last=False)
+
+    # copy so callers can't change what is cached. copy.copy keeps defaultdicts working
+    return copy.copy(cached)
+
+
+def _reload_issns(package_id, data_type, issn_ls):
+    cache_key = (package_id, data_type)
+    with _lock:
+        cached = _cache_dict.get(cache_key, None)
+    if cached is None:
+        # nothing cached for this package, it'll be loaded fresh when needed
+        return
+
+    if issn_ls is None:
+        with _lock:
+            _cache_dict.pop(cache_key, None)
+        return
+
+    issn_ls = [issn_l for issn_l in issn_ls if issn_l]
+    if not issn_ls:
+        return
+
+    fresh = _loaders[data_type](package_id, issn_ls)
+    with _lock:
+        cached = copy.copy(cached)
+        for issn_l in issn_ls:
+            cached.pop(issn_l, None)
+        cached.update(fresh)
+        _cache_dict[cache_key] = cached
+
+
+def invalidate_package_cache(package_id, data_type, issn_ls=None):
+    # reload here right away, and tell the other processes
+    _reload_issns(package_id, data_type, issn_ls)
+
+    if issn_ls is None:
+        values = [(package_id, data_type, None)]
+    else:
+        values = [(package_id, data_type, issn_l) for issn_l in sorted(set(issn_ls)) if issn_l]
+    if not values:
+        return
+
+    from psycopg2.extras import execute_values
+    with get_db_cursor() as cursor:
+        qry = "insert into jump_cache_invalidation (package_id, data_type, issn_l, updated) values %s"
+        execute_values(cursor, qry, values, template="(%s, %s, %s, sysdate)", page_size=1000)
+
+
+def _check_invalidations_forever():
+    while True:
+        sleep(CHECK_INVALIDATIONS_SECONDS)
+        try:
+            _apply_remote_invalidations()
+        except Exception as e:
+            print("Error: exception {} checking package cache invalidations".format(e))
+
+
+def start_invalidation_checks():
+    with _lock:
+        if _invalidations_state["thread"] is not None:
+            return
+        _invalidations_state["thread"] = threading.Thread(target=_check_invalidations_forever)
+        _invalidations_state["thread"].daemon = True
+    # if the first check fails the thread still starts, and tries again
+    try:
+        _apply_remote_invalidations()
+    except Exception as e:
+        print("Error: exception {} checking package cache invalidations".format(e))
+    finally:
+        _invalidations_state["thread"].start()
+
+
+def apply_remote_invalidations():
+    # right now rather than at the next background check, for work queued just after an
+    # invalidation (consortium recomputes hash the member's cached package data)
+    _apply_remote_invalidations()
+
+
+def _apply_remote_invalidations():
+    with _lock:
+        last_updated = _invalidations_state["last_updated"]
+
+    with get_db_cursor() as cursor:
+        if last_updated is None:
+            # only invalidations that happen after this process started matter
+            cursor.execute("select max(updated) as updated from jump_cache_invalidation")
+            rows = cursor.fetchall()
+            with _lock:
+                _invalidations_state["last_updated"] = rows[0]["updated"] or datetime.datetime(1970, 1, 1)
+            return
+
+        command = """select package_id, data_type, issn_l, updated from jump_cache_invalidation
+            where updated > dateadd(second, -%s, %s)"""
+        cursor.execute(command, (INVALIDATION_OVERLAP_SECONDS, last_updated))
+        rows = cursor.fetchall()
+
+    with _lock:
+        applied = _invalidations_state["applied"]
+        new_rows = [row for row in rows if tuple(row) not in applied]
+    if not new_rows:
+        return
+
+    issn_ls_by_key = {}
+    for row in new_rows:
+        cache_key = (row["package_id"], row["data_type"])
+        if row["issn_l"] is None or issn_ls_by_key.get(cache_key, set()) is None:
+            issn_ls_by_key[cache_key] = None
+        else:
+            issn_ls_by_key.setdefault(cache_key, set()).add(row["issn_l"])
+
+    for (package_id, data_type), issn_ls in issn_ls_by_key.items():
+        if data_type in _loaders:
+            _reload_issns(package_id, data_type, issn_ls)
+
+    with _lock:
+        last_updated = max([last_updated] + [row["updated"] for row in new_rows])
+        # only rows inside the overlap window can be read again
+        oldest = last_updated - datetime.timedelta(seconds=INVALIDATION_OVERLAP_SECONDS)
+        applied = set([key for key in _invalidations_state["applied"] if key[3] > oldest])
+        applied.update([tuple(row) for row in new_rows])
+        _invalidations_state["applied"] = applied
+        _invalidations_state["last_updated"] = last_updated
+
+
+def prune_cache_invalidations(hours=INVALIDATION_RETENTION_HOURS):
+    # every process has applied these long ago
+    with get_db_cursor() as cursor:
+        cursor.execute("delete from jump_cache_invalidation where updated < dateadd(hour, -%s, sysdate)", (hours,))
+
+
+def issn_ls_for_issns(issns):
+    # uploaded files can use any issn of a journal
+    from openalex import get_all_journal_metadata_flat
+    all_journal_metadata_flat = get_all_journal_metadata_flat()
+    issn_ls = set()
+    for issn in issns:
+        if not issn:
+            continue
+        journal_metadata = all_journal_metadata_flat.get(issn, None)
+        issn_ls.add(journal_metadata.issn_l if journal_metadata else issn)
+    return issn_ls
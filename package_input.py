@@ -1,5 +1,6 @@
 # coding: utf-8
 
+import collections
 import json
 import os
 import re
@@ -23,12 +24,16 @@ from app import reset_cache
 from consortium import Consortium
 from app import s3_client
 from excel import convert_spreadsheet_to_csv
+from package_cache import invalidate_package_cache
+from package_cache import issn_ls_for_issns
+from package_summary import queue_package_summary_update
+from response_cache import bump_content_versions
+from response_cache import package_key
 from package_file_error_rows import PackageFileErrorRow
 from raw_file_upload_object import RawFileUploadObject
 from util import safe_commit
 
 
-
 class PackageInput:
     @staticmethod
     def normalize_date(date_str, warn_if_blank=False, default=None):
@@ -84,14 +89,14 @@ class PackageInput:
 
     @staticmethod
     def normalize_issn(issn, warn_if_blank=False):
-        from openalex import oa_issns
+        from openalex import get_oa_issns
         if issn:
             issn = issn.replace("issn:", "")
             issn = sub(r"\s", "", issn).upper()
             if re.match(r"^\d{4}-?\d{3}(?:X|\d)$", issn):
                 issn = issn.replace("-", "")
                 issn = issn[0:4] + "-" + issn[4:8]
-                if issn not in oa_issns:
+                if issn not in get_oa_issns():
                     print(f"Missing journal in normalize_issn {issn} from OpenAlex: https://api.openalex.org/venues/issn:{issn}")
                     return ParseWarning.unknown_issn
                 return issn
@@ -122,6 +127,9 @@ class PackageInput:
     def file_type_label(self):
         raise NotImplementedError()
 
+    def cache_data_type(self):
+        raise NotImplementedError()
+
     def translate_row(self, row):
         return row
 
@@ -206,6 +214,8 @@ class PackageInput:
 
         db.session.add(new_object)
         safe_commit(db)
+        # upload status shows on the package page
+        bump_content_versions([package_key(package_id)])
 
         return "s3://{}/{}".format(bucket_name, object_name)
 
@@ -237,6 +247,7 @@ class PackageInput:
         with get_db_cursor() as cursor:
             command = "update jump_raw_file_upload_object set to_delete_date=sysdate where package_id=%s and file=%s"
             cursor.execute(command, (package_id, self.file_type_label(),))
+        bump_content_versions([package_key(package_id)])
         return "Queued to delete"
 
 
@@ -262,22 +273,37 @@ class PackageInput:
         return message
 
 
-    def clear_caches(self, my_package):
-        # print "clearing cache"
+    def clear_caches(self, my_package, issn_ls=None):
+        # issn_ls is None when everything for the package may have changed
+        print("clearing {} cache for {}, {} journals".format(
+            self.cache_data_type(), my_package, "all" if issn_ls is None else len(issn_ls)))
+        invalidate_package_cache(my_package.package_id, self.cache_data_type(), issn_ls)
+        queue_package_summary_update(my_package.package_id)
+
+        if issn_ls is not None and not issn_ls:
+            return
+
         if my_package.is_owned_by_consortium:
             print("clearing consortium cache for my_package.is_owned_by_consortium: {}".format(my_package))
             for consortium_scenario_id in my_package.consortia_scenario_ids_who_own_this_package:
-
-                # this will actually recalculate all member institutions instead of just this one
-                # which will take longer, but don't worry about it for now
-
                 my_consortium = Consortium(consortium_scenario_id)
+
+                # the consortium_calculate worker does it, so it doesn't race another recompute
+                # of the same scenario.  only members whose inputs changed are recomputed
                 email = "scott+{}@ourresearch.org".format(my_package.package_id)
                 my_consortium.queue_for_recompute(email)
                 reset_cache("consortium", "consortium_get_computed_data", consortium_scenario_id)
 
         # my_package.clear_package_counter_breakdown_cache() # not used anymore
 
+    def affected_issn_ls(self, package_id):
+        with get_db_cursor() as cursor:
+            qry = sql.SQL("select distinct issn_l from {} where package_id=%s").format(
+                sql.Identifier(self.destination_table()))
+            cursor.execute(qry, (package_id,))
+            rows = cursor.fetchall()
+        return set([row["issn_l"] for row in rows if row["issn_l"]])
+
     def update_dest_table(self, package_id):
         with get_db_cursor() as cursor:
             qry1 = sql.SQL("delete from {} where package_id=%s").format(sql.Identifier(self.destination_table()))
@@ -287,6 +313,82 @@ class PackageInput:
                 sql.Identifier(self.destination_table()), sql.Identifier(self.import_view_name()))
             cursor.execute(qry2, (package_id,))
 
+    def update_dest_table_for_issns(self, package_id, issns):
+        issn_ls = issn_ls_for_issns(issns) | set(issns)
+
+        with get_db_cursor() as cursor:
+            qry1 = sql.SQL("delete from {} where package_id=%s and issn_l in %s").format(
+                sql.Identifier(self.destination_table()))
+            cursor.execute(qry1, (package_id, tuple(issn_ls),))
+
+            qry2 = sql.SQL("insert into {} (select * from {} where package_id=%s and issn_l in %s)").format(
+                sql.Identifier(self.destination_table()), sql.Identifier(self.import_view_name()))
+            cursor.execute(qry2, (package_id, tuple(issn_ls),))
+
+    def delete_issns(self, package_id, issns, report_name=None):
+        if not issns:
+            return
+
+        with get_db_cursor() as cursor:
+            if report_name:
+                qry = sql.SQL("delete from {} where package_id=%s and report_name=%s and issn in %s").format(
+                    sql.Identifier(self.__tablename__))
+                cursor.execute(qry, (package_id, report_name, tuple(issns),))
+            else:
+                qry = sql.SQL("delete from {} where package_id=%s and issn in %s").format(
+                    sql.Identifier(self.__tablename__))
+                cursor.execute(qry, (package_id, tuple(issns),))
+
+    @staticmethod
+    def diff_rows_by_issn(existing_rows, new_rows, fields):
+        # compare rows as multisets per issn, so duplicate keys in a file are handled too
+        def comparable(value):
+            # dates come back from the db as datetimes but are normalized to iso strings
+            return value.isoformat() if hasattr(value, "isoformat") else value
+
+        def rows_by_issn(rows):
+            grouped = {}
+            for row in rows:
+                values = tuple(comparable(row.get(field, None)) for field in fields)
+                grouped.setdefault(row.get("issn", None), collections.Counter())[values] += 1
+            return grouped
+
+        existing_by_issn = rows_by_issn(existing_rows)
+        new_by_issn = rows_by_issn(new_rows)
+
+        inserted = set(new_by_issn.keys()) - set(existing_by_issn.keys())
+        deleted = set(existing_by_issn.keys()) - set(new_by_issn.keys())
+        updated = set([issn for issn in set(new_by_issn.keys()) & set(existing_by_issn.keys())
+                       if new_by_issn[issn] != existing_by_issn[issn]])
+
+        return {
+            "inserted": inserted,
+            "updated": updated,
+            "deleted": deleted,
+            "changed_issns": inserted | updated | deleted,
+        }
+
+    def diff_against_existing(self, package_id, normalized_rows, fields, report_name=None):
+        # returns None when there is nothing to diff against, so the caller does a full load
+        with get_db_cursor(use_realdictcursor=True) as cursor:
+            if report_name:
+                qry = sql.SQL("select {} from {} where package_id=%s and report_name=%s").format(
+                    sql.SQL(", ").join(map(sql.Identifier, fields)), sql.Identifier(self.__tablename__))
+                cursor.execute(qry, (package_id, report_name,))
+            else:
+                qry = sql.SQL("select {} from {} where package_id=%s").format(
+                    sql.SQL(", ").join(map(sql.Identifier, fields)), sql.Identifier(self.__tablename__))
+                cursor.execute(qry, (package_id,))
+            existing_rows = cursor.fetchall()
+
+        if not existing_rows:
+            return None
+
+        changes = self.diff_rows_by_issn(existing_rows, normalized_rows, fields)
+        print("delta load for {} {}: {} ISSNs added, {} changed, {} removed".format(
+            package_id, self.__class__.__name__, len(changes["inserted"]), len(changes["updated"]), len(changes["deleted"])))
+        return changes
+
     def make_package_file_warning(self, parse_warning, additional_msg=None):
         return {
             "label": parse_warning.value["label"],
@@ -516,7 +618,7 @@ class PackageInput:
 
 
 
-    def load(self, package_id, file_name, file_type, commit=False):
+    def load(self, package_id, file_name, file_type, commit=False, delta=False):
         my_package = db.session.query(package.Package).filter(package.Package.package_id == package_id).scalar()
 
         if "counter" in file_type:
@@ -543,16 +645,35 @@ class PackageInput:
             aws_secret=os.getenv("AWS_SECRET_ACCESS_KEY")
         )
 
+        changes = None
+        affected_issn_ls = None
         if normalized_rows:
             for row in normalized_rows:
                 row.update({"package_id": package_id})
                 # logger.info(u"normalized row: {}".format(json.dumps(row)))
 
-            # delete what we've got
             from counter import CounterInput
+            report_name = normalized_rows[1]["report_name"] if isinstance(self, CounterInput) else None
+            sorted_fields = sorted(normalized_rows[0].keys())
+
+            if delta:
+                changes = self.diff_against_existing(package_id, normalized_rows, sorted_fields, report_name)
 
-            if isinstance(self, CounterInput):
-                report_name = normalized_rows[1]["report_name"]
+            if changes is None:
+                # everything goes, so the journals affected are everything before plus everything after
+                affected_issn_ls = self.affected_issn_ls(package_id) | issn_ls_for_issns([row.get("issn") for row in normalized_rows])
+            else:
+                affected_issn_ls = issn_ls_for_issns(changes["changed_issns"])
+
+            if changes is not None:
+                # only touch the issns whose rows actually changed
+                if report_name:
+                    self.set_file_type_label(report_name)
+                self.delete_issns(package_id, changes["changed_issns"], report_name)
+                rows_to_copy = [row for row in normalized_rows if row.get("issn") in changes["changed_issns"]]
+
+            # delete what we've got
+            elif isinstance(self, CounterInput):
                 report_version = normalized_rows[1]["report_version"]
                 # make sure to delete counter 4 if loading counter 5, or vice versa
                 if report_version == "4":
@@ -567,35 +688,40 @@ class PackageInput:
 
                 # then set this for use further in the function
                 self.set_file_type_label(report_name)
+                rows_to_copy = normalized_rows
             else:
                 self.delete(package_id)
-
-            sorted_fields = sorted(normalized_rows[0].keys())
-            normalized_csv_filename = tempfile.mkstemp()[1]
-            num_rows = 0
-            with open(normalized_csv_filename, "w", encoding="utf-8") as normalized_csv_file:
-                writer = csv.DictWriter(normalized_csv_file, delimiter=",", fieldnames=sorted_fields)
-                for row in normalized_rows:
-                    num_rows += 1
-                    writer.writerow(row)
-
-            s3_object = self._copy_staging_csv_to_s3(normalized_csv_filename, package_id)
-
-            copy_cmd = text("""
-                copy {table} ({fields}) from '{s3_object}'
-                credentials :creds format as csv
-                timeformat 'auto';
-            """.format(
-                table=self.__tablename__,
-                fields=", ".join(sorted_fields),
-                s3_object=s3_object,
-            ))
-
-            print((copy_cmd.bindparams(creds=aws_creds)))
-            safe_commit(db)
-            db.session.execute(copy_cmd.bindparams(creds=aws_creds))
-            safe_commit(db)
-            self.update_dest_table(package_id)
+                rows_to_copy = normalized_rows
+
+            num_rows = len(normalized_rows)
+            if rows_to_copy:
+                normalized_csv_filename = tempfile.mkstemp()[1]
+                with open(normalized_csv_filename, "w", encoding="utf-8") as normalized_csv_file:
+                    writer = csv.DictWriter(normalized_csv_file, delimiter=",", fieldnames=sorted_fields)
+                    for row in rows_to_copy:
+                        writer.writerow(row)
+
+                s3_object = self._copy_staging_csv_to_s3(normalized_csv_filename, package_id)
+
+                copy_cmd = text("""
+                    copy {table} ({fields}) from '{s3_object}'
+                    credentials :creds format as csv
+                    timeformat 'auto';
+                """.format(
+                    table=self.__tablename__,
+                    fields=", ".join(sorted_fields),
+                    s3_object=s3_object,
+                ))
+
+                print((copy_cmd.bindparams(creds=aws_creds)))
+                safe_commit(db)
+                db.session.execute(copy_cmd.bindparams(creds=aws_creds))
+                safe_commit(db)
+
+            if changes is None:
+                self.update_dest_table(package_id)
+            elif changes["changed_issns"]:
+                self.update_dest_table_for_issns(package_id, changes["changed_issns"])
             self._copy_raw_to_s3(file_name, package_id, num_rows, error=None)
             from filter_titles import FilterTitlesInput
             if isinstance(self, FilterTitlesInput):
@@ -624,13 +750,26 @@ class PackageInput:
             db.session.flush()  # see if this fixes Serializable isolation violation
             db.session.commit()
             if my_package:
-                self.clear_caches(my_package)
+                self.clear_caches(my_package, issn_ls=affected_issn_ls)
 
-        if normalized_rows:
+        if normalized_rows and changes is not None:
+            return {
+                "success": True,
+                "message": "Updated {} {} rows for package {}: {} ISSNs added, {} changed, {} removed.".format(
+                    len(normalized_rows), self.__class__.__name__, package_id,
+                    len(changes["inserted"]), len(changes["updated"]), len(changes["deleted"])),
+                "warnings": error_rows,
+                "changed_issns": sorted(changes["changed_issns"]),
+                "affected_issn_ls": sorted(affected_issn_ls),
+                "data_type": self.cache_data_type()
+            }
+        elif normalized_rows:
             return {
                 "success": True,
                 "message": "Inserted {} {} rows for package {}.".format(len(normalized_rows), self.__class__.__name__, package_id),
-                "warnings": error_rows
+                "warnings": error_rows,
+                "affected_issn_ls": sorted(affected_issn_ls),
+                "data_type": self.cache_data_type()
             }
         else:
             return {
@@ -0,0 +1,165 @@
+# coding: utf-8
+
+import argparse
+import datetime
+import random
+import simplejson as json
+from time import time
+from time import sleep
+
+from app import get_db_cursor
+from lazy_data import preload_datasets
+from response_cache import bump_content_versions
+from response_cache import package_key
+from util import elapsed
+from util import myconverter
+
+# Package.to_package_dict is slow (missing price warnings load counter, prices and all
+# journal metadata; every scenario gets loaded for its description), so it's stored here
+# and served from the table.  Anything that changes it queues the package and
+# `python package_summary.py` (the package_summary process) recomputes it.  A package
+# whose summary fails stays queued, with the error, and is tried again after
+# RETRY_FAILED_SECONDS.  Completed queue rows are deleted after QUEUE_RETENTION_DAYS.
+#
+# create table jump_package_summary (package_id text, summary_json text, updated timestamp);
+# create table jump_package_summary_update_queue (package_id text, created timestamp, completed timestamp,
+#     error varchar(65535));
+
+RETRY_FAILED_SECONDS = 600
+QUEUE_RETENTION_DAYS = 7
+PRUNE_QUEUE_SECONDS = 3600
+
+
+def queue_package_summary_update(package_id):
+    if not package_id:
+        return
+    command = "insert into jump_package_summary_update_queue (package_id, created) values (%s, sysdate)"
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (package_id,))
+    bump_content_versions([package_key(package_id)])
+
+
+def save_package_summary(package_id, package_dict):
+    summary_json = json.dumps(package_dict, default=myconverter)
+    with get_db_cursor() as cursor:
+        cursor.execute("delete from jump_package_summary where package_id=%s", (package_id,))
+        cursor.execute("insert into jump_package_summary (package_id, summary_json, updated) values (%s, %s, sysdate)",
+                       (package_id, summary_json))
+    bump_content_versions([package_key(package_id)])
+
+
+def get_package_summary(package_id):
+    command = """
+        select summary_json, updated,
+            (select count(*) from jump_package_summary_update_queue q
+                where q.package_id=s.package_id and q.completed is null) as num_pending
+            from jump_package_summary s
+            where package_id=%s
+        """
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (package_id,))
+        rows = cursor.fetchall()
+    if not rows:
+        return None
+    return {
+        "summary": json.loads(rows[0]["summary_json"]),
+        "updated": rows[0]["updated"],
+        "is_pending_update": rows[0]["num_pending"] > 0,
+    }
+
+
+def _with_freshness(package_dict, updated, is_pending_update):
+    package_dict["summary_updated"] = updated.isoformat() if hasattr(updated, "isoformat") else updated
+    package_dict["summary_is_pending_update"] = is_pending_update
+    return package_dict
+
+
+def package_summary_dict(my_package):
+    # to_package_dict from the stored snapshot, or computed and stored if there isn't one yet
+    stored = get_package_summary(my_package.package_id)
+    if not stored:
+        package_dict = my_package.to_package_dict()
+        save_package_summary(my_package.package_id, package_dict)
+        return _with_freshness(package_dict, datetime.datetime.utcnow(), False)
+
+    package_dict = stored["summary"]
+    # upload status moves on without anything being queued (the file is still being parsed),
+    # and it's only one query, so data_files is always live
+    package_dict["data_files"] = my_package.data_files_list
+    return _with_freshness(package_dict, stored["updated"], stored["is_pending_update"])
+
+
+def refresh_package_summary(my_package):
+    package_dict = my_package.to_package_dict()
+    save_package_summary(my_package.package_id, package_dict)
+    return package_dict
+
+
+def prune_package_summary_queue(days=QUEUE_RETENTION_DAYS):
+    command = "delete from jump_package_summary_update_queue where completed < dateadd(day, -%s, sysdate)"
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (days,))
+
+
+def update_package_summaries():
+    from app import db
+    from package import Package
+
+    # {package_id: when it last failed}, so a broken package isn't retried every loop
+    failed_at = {}
+    last_pruned = 0
+
+    while True:
+        if time() - last_pruned > PRUNE_QUEUE_SECONDS:
+            prune_package_summary_queue()
+            last_pruned = time()
+
+        command = """select package_id, max(created) as max_created
+            from jump_package_summary_update_queue
+            where completed is null
+            group by package_id
+            order by random()"""
+        with get_db_cursor() as cursor:
+            cursor.execute(command)
+            rows = cursor.fetchall()
+
+        for row in rows:
+            if time() - failed_at.get(row["package_id"], 0) < RETRY_FAILED_SECONDS:
+                continue
+            start_time = time()
+            try:
+                my_package = Package.query.filter(Package.package_id == row["package_id"]).scalar()
+                if my_package:
+                    refresh_package_summary(my_package)
+                print("in update_package_summaries, refreshed {} took {}s".format(row["package_id"], elapsed(start_time)))
+                failed_at.pop(row["package_id"], None)
+                # anything queued while we were computing stays in the queue for next time
+                command = """update jump_package_summary_update_queue set completed=sysdate, error=null
+                    where package_id=%s and completed is null and created <= %s"""
+                with get_db_cursor() as cursor:
+                    cursor.execute(command, (row["package_id"], row["max_created"]))
+            except Exception as e:
+                print("Error: exception {} refreshing package summary for {}".format(e, row["package_id"]))
+                failed_at[row["package_id"]] = time()
+                command = """update jump_package_summary_update_queue set error=%s
+                    where package_id=%s and completed is null and created <= %s"""
+                with get_db_cursor() as cursor:
+                    cursor.execute(command, (str(e), row["package_id"], row["max_created"]))
+            finally:
+                try:
+                    db.session.remove()
+                except:
+                    pass
+
+        sleep(2 * random.random())
+
+
+# python package_summary.py
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run stuff :)")
+
+    parsed_args = parser.parse_args()
+    parsed_vars = vars(parsed_args)
+
+    preload_datasets()
+    update_package_summaries()
@@ -10,15 +10,28 @@ import boto3
 from app import s3_client
 from app import get_db_cursor
 from app import db
+import pending_uploads
+from package_cache import prune_cache_invalidations
+from response_cache import prune_content_versions
+from lazy_data import preload_datasets
 from counter import CounterInput
 from perpetual_access import PerpetualAccessInput
 from journal_price import JournalPriceInput
 from filter_titles import FilterTitlesInput
 
 
+PRUNE_INVALIDATIONS_SECONDS = 3600
+
+
 def parse_uploads():
+    last_pruned = datetime.datetime.min
 
     while True:
+        if (datetime.datetime.utcnow() - last_pruned).total_seconds() > PRUNE_INVALIDATIONS_SECONDS:
+            prune_cache_invalidations()
+            prune_content_versions()
+            last_pruned = datetime.datetime.utcnow()
+
         try:
             command = """select * from jump_raw_file_upload_object where to_delete_date is not null"""
             with get_db_cursor() as cursor:
@@ -48,17 +61,16 @@ def parse_uploads():
                 pass
 
         try:
-            upload_preprocess_bucket = "unsub-file-uploads-preprocess-testing" if os.getenv("TESTING_DB") else "unsub-file-uploads-preprocess"
+            upload_preprocess_bucket = pending_uploads.upload_preprocess_bucket()
             upload_finished_bucket = "unsub-file-uploads-testing" if os.getenv("TESTING_DB") else "unsub-file-uploads"
             preprocess_file_list = s3_client.list_objects(Bucket=upload_preprocess_bucket)
             for preprocess_file in preprocess_file_list.get("Contents", []):
                 filename = preprocess_file["Key"]
-                filename_base = filename.split(".")[0]
-                try:
-                    package_id, filetype = filename_base.split("_")
-                except ValueError:
+                parsed_filename = pending_uploads.parse_preprocess_key(filename)
+                if not parsed_filename:
                     # not a valid file, skip it
                     continue
+                package_id, filetype = parsed_filename
 
                 print(("loading {} {}".format(package_id, filetype)))
                 size = preprocess_file["Size"]
@@ -80,7 +92,8 @@ def parse_uploads():
                     loader = FilterTitlesInput()
 
                 if loader:
-                    load_result = loader.load(package_id, filename, filetype, commit=True)
+                    # counter re-uploads are usually small corrections, so only apply what changed
+                    load_result = loader.load(package_id, filename, filetype, commit=True, delta=isinstance(loader, CounterInput))
 
                     print(("moving file {}".format(filename)))
                     s3_resource = boto3.resource("s3")
@@ -119,6 +132,7 @@ if __name__ == "__main__":
     parsed_args = parser.parse_args()
     parsed_vars = vars(parsed_args)
 
+    preload_datasets()
     parse_uploads()
 
     # package_id = "package-nALodSzDfzqv"
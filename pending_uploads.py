@@ -0,0 +1,98 @@
+# coding: utf-8
+
+import datetime
+import os
+import threading
+from time import time
+from time import sleep
+
+from app import s3_client
+
+# How long a listing of the preprocess bucket is trusted before it is refreshed.
+PENDING_UPLOADS_REFRESH_SECONDS = 30
+
+
+def upload_preprocess_bucket():
+    return "unsub-file-uploads-preprocess-testing" if os.getenv("TESTING_DB") else "unsub-file-uploads-preprocess"
+
+
+def parse_preprocess_key(filename):
+    filename_base = filename.split(".")[0]
+    try:
+        package_id, filetype = filename_base.split("_")
+    except ValueError:
+        # not a valid file
+        return None
+    return package_id, filetype
+
+
+class PendingUploadsIndex(object):
+    # Files uploaded to the preprocess bucket that parse_uploads hasn't loaded yet,
+    # as {package_id: {filetype: uploaded datetime}}.  Built from one listing of the
+    # bucket that is refreshed in the background, and kept current in between by the
+    # upload path, so package pages don't need to list the bucket themselves.
+
+    def __init__(self, refresh_seconds=PENDING_UPLOADS_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_refreshed = None
+        self.refresh_thread = None
+
+    def refresh(self, preprocess_file_list=None):
+        if preprocess_file_list is None:
+            preprocess_file_list = s3_client.list_objects(Bucket=upload_preprocess_bucket())
+
+        pending = {}
+        for preprocess_file in preprocess_file_list.get("Contents", []):
+            parsed = parse_preprocess_key(preprocess_file["Key"])
+            if not parsed:
+                continue
+            package_id, filetype = parsed
+            pending.setdefault(package_id, {})[filetype] = preprocess_file["LastModified"].replace(tzinfo=None)
+
+        with self.lock:
+            self.pending = pending
+            self.last_refreshed = time()
+
+    def _refresh_forever(self):
+        while True:
+            sleep(self.refresh_seconds)
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Error: exception {} refreshing pending uploads index".format(e))
+
+    def start_background_refresh(self):
+        with self.lock:
+            if self.refresh_thread is not None:
+                return
+            self.refresh_thread = threading.Thread(target=self._refresh_forever)
+            self.refresh_thread.daemon = True
+        # if the first listing fails the thread still starts, and tries again
+        try:
+            self.refresh()
+        except Exception as e:
+            print("Error: exception {} listing pending uploads".format(e))
+        finally:
+            self.refresh_thread.start()
+
+    def add(self, package_id, filetype, uploaded=None):
+        with self.lock:
+            self.pending.setdefault(package_id, {})[filetype] = uploaded or datetime.datetime.utcnow()
+
+    def remove(self, package_id, filetype, uploaded=None):
+        # with uploaded, only if that's still the pending upload (not a newer one)
+        with self.lock:
+            package_pending = self.pending.get(package_id, {})
+            if uploaded is None or package_pending.get(filetype, None) == uploaded:
+                package_pending.pop(filetype, None)
+
+    def get(self, package_id):
+        if self.last_refreshed is None:
+            self.start_background_refresh()
+        with self.lock:
+            return dict(self.pending.get(package_id, {}))
+
+
+pending_uploads_index = PendingUploadsIndex()
@@ -1,7 +1,17 @@
+from collections import namedtuple
+
+from flask import g
+from flask import has_request_context
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import relationship
 
 from app import db
+from app import get_db_cursor
+
+# jump_permission doesn't change while we're running, so it's read once per process.
+# plain tuples rather than models so they can outlive the session that loaded them
+PermissionRow = namedtuple("PermissionRow", ["id", "name"])
+_permission_rows = {}
 
 
 class Permission(db.Model):
@@ -11,7 +21,10 @@ class Permission(db.Model):
 
     @staticmethod
     def get(name):
-        return Permission.query.filter(Permission.name == name).first()
+        if name not in _permission_rows:
+            for my_permission in Permission.query.all():
+                _permission_rows[my_permission.name] = PermissionRow(my_permission.id, my_permission.name)
+        return _permission_rows.get(name, None)
 
     @staticmethod
     def view():
@@ -41,3 +54,35 @@ class UserInstitutionPermission(db.Model):
 
     def __repr__(self):
         return '<{} ({}, {}) {}>'.format(self.__class__.__name__, self.user, self.institution, self.permission)
+
+
+def user_permission_names(user_id):
+    # {institution_id: set of permission names}, loaded once per request
+    if has_request_context():
+        if "user_permission_names" not in g:
+            g.user_permission_names = {}
+        cache = g.user_permission_names
+    else:
+        cache = {}
+
+    if user_id not in cache:
+        command = """
+            select uip.institution_id, p.name
+                from jump_user_institution_permission uip
+                join jump_permission p on p.id=uip.permission_id
+                where uip.user_id=%s
+            """
+        with get_db_cursor() as cursor:
+            cursor.execute(command, (user_id,))
+            rows = cursor.fetchall()
+        names = {}
+        for row in rows:
+            names.setdefault(row["institution_id"], set()).add(row["name"])
+        cache[user_id] = names
+    return cache[user_id]
+
+
+def forget_user_permission_names(user_id):
+    # call after changing a user's permissions during a request
+    if has_request_context() and "user_permission_names" in g:
+        g.user_permission_names.pop(user_id, None)
@@ -6,6 +6,7 @@ from collections import OrderedDict
 
 from app import db
 from package_input import PackageInput
+from package_cache import PERPETUAL_ACCESS
 
 
 class PerpetualAccess(db.Model):
@@ -18,8 +19,8 @@ class PerpetualAccess(db.Model):
 
     @cached_property
     def journal_metadata(self):
-        from openalex import MissingJournalMetadata, all_journal_metadata
-        meta = all_journal_metadata.get(self.issn_l)
+        from openalex import MissingJournalMetadata, get_all_journal_metadata
+        meta = get_all_journal_metadata().get(self.issn_l)
         if not meta:
             meta = MissingJournalMetadata(issn_l=self.issn_l)
         return meta
@@ -84,6 +85,9 @@ class PerpetualAccessInput(db.Model, PackageInput):
     def file_type_label(self):
         return "perpetual-access"
 
+    def cache_data_type(self):
+        return PERPETUAL_ACCESS
+
     def issn_columns(self):
         return ["issn"]
 
@@ -108,5 +112,5 @@ class PerpetualAccessInput(db.Model, PackageInput):
             }
         }
 
-    def clear_caches(self, my_package):
-        super(PerpetualAccessInput, self).clear_caches(my_package)
+    def clear_caches(self, my_package, issn_ls=None):
+        super(PerpetualAccessInput, self).clear_caches(my_package, issn_ls)
@@ -0,0 +1,192 @@
+# coding: utf-8
+
+import csv
+import datetime
+import gzip
+import os
+import tempfile
+
+import shortuuid
+
+from app import get_db_cursor
+from app import s3_client
+
+# Bulk loading for the big recompute jobs.  Rows go into a gzipped csv as they are made,
+# the file goes to the redshift staging bucket, and one COPY loads it into a shadow table.
+# replace_table_contents then swaps the shadow table's rows into the live table in a
+# single transaction, so readers see either all the old rows or all the new ones, never
+# an empty table.
+#
+# merge_into_table is the same idea for tables shared by many jobs: the staged rows
+# replace just the rows matching a where clause (eg one scenario_id).
+#
+# The live table keeps its identity (delete + insert rather than a rename), so
+# materialized views built on it, like openalex_computed_flat, keep working.
+
+STAGING_BUCKET = "jump-redshift-staging"
+
+
+def aws_copy_credentials():
+    return "aws_access_key_id={aws_key};aws_secret_access_key={aws_secret}".format(
+        aws_key=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret=os.getenv("AWS_SECRET_ACCESS_KEY")
+    )
+
+
+def copy_value(value):
+    # empty strings load as null too (emptyasnull)
+    if value is None:
+        return ""
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+class CopyStagingFile(object):
+    # gzipped csv for one COPY, written a row at a time so the rows never all sit in memory
+
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = columns
+        self.num_rows = 0
+        handle, self.filename = tempfile.mkstemp(suffix=".csv.gz")
+        os.close(handle)
+        self.file = gzip.open(self.filename, "wt", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+
+    def writerow(self, row):
+        self.writer.writerow([copy_value(value) for value in row])
+        self.num_rows += 1
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def upload(self):
+        self.close()
+        object_name = "{}_{}.csv.gz".format(self.name, shortuuid.uuid())
+        try:
+            s3_client.upload_file(self.filename, STAGING_BUCKET, object_name)
+        finally:
+            os.remove(self.filename)
+        return "s3://{}/{}".format(STAGING_BUCKET, object_name)
+
+    def copy_into(self, table, cursor=None):
+        s3_object = self.upload()
+        command = """copy {table} ({fields}) from '{s3_object}'
+            credentials %s
+            format as csv gzip
+            emptyasnull
+            timeformat 'auto'""".format(
+            table=table,
+            fields=", ".join(self.columns),
+            s3_object=s3_object,
+        )
+        if cursor:
+            cursor.execute(command, (aws_copy_credentials(),))
+        else:
+            with get_db_cursor() as cursor:
+                cursor.execute(command, (aws_copy_credentials(),))
+        return self.num_rows
+
+    def __repr__(self):
+        return "<{} ({}) {} rows>".format(self.__class__.__name__, self.name, self.num_rows)
+
+
+def shadow_table_name(table):
+    return "{}_shadow".format(table)
+
+
+def count_rows(table):
+    with get_db_cursor() as cursor:
+        cursor.execute("select count(*) as num_rows from {}".format(table))
+        return cursor.fetchone()["num_rows"]
+
+
+def load_shadow_table(table, staging_file):
+    shadow_table = shadow_table_name(table)
+    with get_db_cursor() as cursor:
+        cursor.execute("drop table if exists {}".format(shadow_table))
+        cursor.execute("create table {} (like {})".format(shadow_table, table))
+    staging_file.copy_into(shadow_table)
+
+    # get_db_cursor prints and swallows errors, so check the COPY really worked
+    num_rows = count_rows(shadow_table)
+    if num_rows != staging_file.num_rows:
+        raise Exception("COPY into {} loaded {} rows, expected {}".format(shadow_table, num_rows, staging_file.num_rows))
+    return shadow_table
+
+
+def replace_table_contents(table, staging_file, backup_table=None):
+    # load into the shadow table first, so a failed COPY leaves the live table alone
+    shadow_table = load_shadow_table(table, staging_file)
+
+    statements = ["begin"]
+    if backup_table:
+        statements += ["delete from {}".format(backup_table),
+                       "insert into {} (select * from {})".format(backup_table, table)]
+    statements += ["delete from {}".format(table),
+                   "insert into {} (select * from {})".format(table, shadow_table),
+                   "commit"]
+    with get_db_cursor() as cursor:
+        try:
+            cursor.execute(";\n".join(statements) + ";")
+        except Exception:
+            # the connection is in autocommit mode, so end the failed transaction ourselves
+            cursor.execute("rollback")
+            raise
+
+    num_rows = count_rows(table)
+    if num_rows != staging_file.num_rows:
+        # leave the shadow table there to look at
+        raise Exception("swap into {} left {} rows, expected {}".format(table, num_rows, staging_file.num_rows))
+
+    with get_db_cursor() as cursor:
+        cursor.execute("drop table if exists {}".format(shadow_table))
+        cursor.execute("analyze {}".format(table))
+    return staging_file.num_rows
+
+
+def merge_into_table(table, staging_file, where, values, finish_statements=None):
+    # replaces the rows of table matching where (with %s placeholders for values) by the
+    # staged rows.  all on one connection, so the staging table can be a temp table and
+    # merges running at the same time on other dynos don't see each other's rows.
+    # finish_statements, a list of (command, values), run in the same transaction
+    staging_table = "{}_staging".format(table)
+    merged = {"num_rows": None}
+    with get_db_cursor() as cursor:
+        cursor.execute("drop table if exists {}".format(staging_table))
+        cursor.execute("create temp table {} (like {})".format(staging_table, table))
+        staging_file.copy_into(staging_table, cursor=cursor)
+        cursor.execute("select count(*) as num_rows from {}".format(staging_table))
+        num_rows = cursor.fetchone()["num_rows"]
+        if num_rows != staging_file.num_rows:
+            raise Exception("COPY into {} loaded {} rows, expected {}".format(staging_table, num_rows, staging_file.num_rows))
+
+        statements = ["delete from {} where {}".format(table, where),
+                      "insert into {} (select * from {})".format(table, staging_table)]
+        statement_values = list(values)
+        for (finish_command, finish_values) in (finish_statements or []):
+            statements.append(finish_command)
+            statement_values += list(finish_values)
+        command = "begin;\n{};\ncommit;".format(";\n".join(statements))
+        try:
+            cursor.execute(command, statement_values)
+        except Exception:
+            cursor.execute("rollback")
+            raise
+        cursor.execute("drop table {}".format(staging_table))
+        merged["num_rows"] = num_rows
+
+    # get_db_cursor prints and swallows errors, so make sure they're noticed
+    if merged["num_rows"] is None:
+        raise Exception("merge into {} failed, see the error above".format(table))
+    return merged["num_rows"]
@@ -0,0 +1,169 @@
+# coding: utf-8
+
+import datetime
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from app import get_db_cursor
+
+# ETags and a response cache for the dashboard GETs (/scenario/<id>/journals, /summary,
+# /package/<id>, /institution/<id>).
+#
+# Anything that changes what those return bumps a content version: scenario saves and
+# recomputes bump "scenario:<id>", uploads and package changes "package:<id>", and so on
+# (bump_content_versions, plus the after_request hook in views.py for POSTs and DELETEs).
+# A response's ETag is a hash of the versions of everything it depends on, the deploy and
+# the journal metadata version, so working it out is one small query and never needs the
+# model.  A matching If-None-Match gets a 304, otherwise the bytes come from this
+# process's cache if it has them.
+#
+# Bumping only inserts, because concurrent deletes on one table fail redshift's
+# serializable isolation check and get_db_cursor would swallow the error.  A version is
+# (last bump time, number of bumps in the CONTENT_VERSION_WINDOW_SECONDS before it), so it
+# only ever moves forward and doesn't change until the next bump.  prune_content_versions
+# (run by the parse_uploads worker) deletes old rows but keeps each key's last one, so it
+# never changes a version.
+#
+# create table jump_content_version (content_key text, updated timestamp) sortkey (content_key);
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 100))
+# other processes' in-memory caches (package_cache, the consortium computed rows) take a
+# few seconds to notice a change, so for this long after a bump responses don't get an
+# ETag or go in the cache, in case they were built from the old data
+CONTENT_SETTLE_SECONDS = int(os.getenv("CONTENT_SETTLE_SECONDS", 15))
+# bumps in the same transaction time are told apart by counting the bumps this long
+# before the last one
+CONTENT_VERSION_WINDOW_SECONDS = 3600
+# has to be longer than the window
+CONTENT_VERSION_RETENTION_DAYS = int(os.getenv("CONTENT_VERSION_RETENTION_DAYS", 7))
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+
+def scenario_key(scenario_id):
+    return "scenario:{}".format(scenario_id)
+
+
+def package_key(package_id):
+    return "package:{}".format(package_id)
+
+
+def institution_key(institution_id):
+    return "institution:{}".format(institution_id)
+
+
+# user names and permissions show up on institution pages
+USERS_KEY = "users"
+
+
+def bump_content_versions(content_keys):
+    content_keys = sorted(set([key for key in content_keys if key]))
+    if not content_keys:
+        return
+    command = "insert into jump_content_version (content_key, updated) values {}".format(
+        ", ".join(["(%s, sysdate)"] * len(content_keys)))
+    with get_db_cursor() as cursor:
+        cursor.execute(command, content_keys)
+
+
+def scenario_keys(scenario_ids):
+    # consortium dashboards show what members add in their feedback scenarios, so a
+    # change to one of those changes the consortium scenario too
+    scenario_ids = [scenario_id for scenario_id in scenario_ids if scenario_id]
+    feedback_scenario_ids = tuple([scenario_id for scenario_id in scenario_ids if scenario_id.startswith("scenario-feedback")])
+    consortium_scenario_ids = []
+    if feedback_scenario_ids:
+        command = "select distinct consortium_scenario_id from jump_consortium_feedback_requests where member_scenario_id in %s"
+        with get_db_cursor() as cursor:
+            cursor.execute(command, (feedback_scenario_ids,))
+            consortium_scenario_ids = [row["consortium_scenario_id"] for row in cursor.fetchall()]
+    return [scenario_key(scenario_id) for scenario_id in scenario_ids + consortium_scenario_ids]
+
+
+def bump_scenario_versions(scenario_ids):
+    bump_content_versions(scenario_keys(scenario_ids))
+
+
+def get_content_versions(content_keys):
+    # {content_key: (version, updated)}, keys never bumped are version "0"
+    content_keys = tuple(sorted(set(content_keys)))
+    versions = OrderedDict([(key, ("0", None)) for key in content_keys])
+    if not content_keys:
+        return versions
+    command = """select v.content_key, count(*) as num_bumps, max(v.updated) as updated
+        from jump_content_version v
+        join (select content_key, max(updated) as last_updated from jump_content_version
+            where content_key in %s group by content_key) latest on latest.content_key = v.content_key
+        where v.content_key in %s and v.updated > dateadd(second, -%s, latest.last_updated)
+        group by v.content_key"""
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (content_keys, content_keys, CONTENT_VERSION_WINDOW_SECONDS))
+        rows = cursor.fetchall()
+    for row in rows:
+        versions[row["content_key"]] = ("{}-{}".format(row["updated"].isoformat(), row["num_bumps"]), row["updated"])
+    return versions
+
+
+def prune_content_versions(days=CONTENT_VERSION_RETENTION_DAYS):
+    # each key's last bump stays, so versions are the same afterwards
+    command = """delete from jump_content_version
+        using (select content_key, max(updated) as last_updated from jump_content_version group by content_key) latest
+        where jump_content_version.content_key = latest.content_key
+        and jump_content_version.updated < latest.last_updated
+        and jump_content_version.updated < dateadd(day, -%s, sysdate)"""
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (days,))
+
+
+def deploy_version():
+    return os.getenv("HEROKU_SLUG_COMMIT", os.getenv("SOURCE_VERSION", ""))
+
+
+def dataset_versions():
+    from lazy_data import datasets_report
+    return ["{}={}".format(row["name"], row["version"]) for row in datasets_report() if row["version"] is not None]
+
+
+def make_etag(request_key, content_keys):
+    # (etag, is_settled).  not settled means something changed too recently to trust
+    versions = get_content_versions(content_keys)
+    parts = [request_key, deploy_version()] + dataset_versions()
+    parts += ["{}={}".format(key, version) for key, (version, updated) in versions.items()]
+    etag = hashlib.md5("\n".join(parts).encode("utf-8")).hexdigest()
+
+    last_updated = max([updated for (version, updated) in versions.values() if updated] or [None])
+    is_settled = last_updated is None or \
+        (datetime.datetime.utcnow() - last_updated).total_seconds() > CONTENT_SETTLE_SECONDS
+    return (etag, is_settled)
+
+
+def get_cached_response(etag):
+    with _response_cache_lock:
+        cached = _response_cache.get(etag, None)
+        if cached is not None:
+            _response_cache.move_to_end(etag)
+        return cached
+
+
+def set_cached_response(etag, body, mimetype):
+    with _response_cache_lock:
+        _response_cache[etag] = (body, mimetype)
+        _response_cache.move_to_end(etag)
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+
+def content_keys_for_path(view_args, json_args=None):
+    # what a successful POST or DELETE to a route with these view_args may have changed
+    view_args = view_args or {}
+    content_keys = scenario_keys([view_args.get("scenario_id")])
+    for name in ["package_id", "publisher_id"]:
+        if view_args.get(name):
+            content_keys.append(package_key(view_args[name]))
+    if view_args.get("institution_id"):
+        content_keys.append(institution_key(view_args["institution_id"]))
+    if json_args and isinstance(json_args, dict) and json_args.get("institution_id"):
+        content_keys.append(institution_key(json_args["institution_id"]))
+    return content_keys
@@ -4,7 +4,7 @@ import shortuuid
 from time import time
 
 from app import get_db_cursor
-from saved_scenario import get_latest_scenario_raw
+from saved_scenario import get_latest_scenarios_raw
 from util import elapsed
 
 #
@@ -106,8 +106,9 @@ package_ids_to_change = []
 for my_package in all_packages:
 
     data = []
+    latest_scenarios = get_latest_scenarios_raw([s.scenario_id for s in my_package.saved_scenarios])
     for my_scenario in my_package.saved_scenarios:
-        (updated, saved) = get_latest_scenario_raw(my_scenario.scenario_id)
+        (updated, saved) = latest_scenarios.get(my_scenario.scenario_id, (None, None))
         if saved:
             try:
                 cost = int(float(saved["configs"]["cost_bigdeal"]))
@@ -237,18 +237,23 @@ def jsonify_fast_no_sort_simple(*args, **kwargs):
 
 
 
-def refresh_data_for_consortium_scenario(scenario_id):
+def refresh_data_for_consortium_scenario(scenario_id, full=False):
     print("scenario_id", scenario_id)
 
     my_consortium = Consortium(scenario_id)
-    my_consortium.recompute_journal_dicts()
+    my_consortium.recompute_journal_dicts(only_changed_members=not full)
     # consortium_get_computed_data(scenario_id)
 
 
 
 # for consortium_name in ["colorado", "suny"]:  #crkn, purdue
 
+# python save_groups.py --full recomputes every member, not just the ones whose inputs changed
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", default=False, help="recompute every member, even unchanged ones")
+    parsed_args = parser.parse_args()
 
     if True:
         import consortium
@@ -270,6 +275,6 @@ if __name__ == "__main__":
             # scenario.get_common_package_data_for_all()
 
             start_time = time()
-            refresh_data_for_consortium_scenario(scenario_id)
+            refresh_data_for_consortium_scenario(scenario_id, parsed_args.full)
             print("done refresh_data_for_consortium_scenario for {} in {}s".format(scenario_id, elapsed(start_time)))
 
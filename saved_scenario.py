@@ -3,11 +3,14 @@
 from cached_property import cached_property
 import simplejson as json
 import datetime
+import os
+import threading
 from collections import OrderedDict
 from time import time
 from sqlalchemy import orm
 from psycopg2 import sql
 from psycopg2.extras import Json
+from psycopg2.extras import execute_values
 from psycopg2.extensions import register_adapter
 register_adapter(dict, Json)
 
@@ -15,23 +18,87 @@ from app import db
 from app import get_db_cursor
 from scenario import Scenario, openalex_export_concepts
 from app import DEMO_PACKAGE_ID
+from response_cache import bump_content_versions
+from response_cache import bump_scenario_versions
+from response_cache import package_key
+from response_cache import scenario_key
 from util import elapsed
 
+# jump_scenario_details_paid is append-only: every save adds a row with the whole scenario
+# json.  jump_scenario_details_latest holds just the newest row for each scenario_id, so
+# reading a scenario doesn't have to sort its whole history.  saves keep it up to date,
+# scenario_history.py --backfill rebuilds it, and scenario_history.py --compact archives
+# old history rows.
+#
+# create table jump_scenario_details_latest (like jump_scenario_details_paid);
+
+SCENARIO_DETAILS_LATEST_RETRIES = 3
+
+def scenario_details_tablename(scenario_id):
+    if scenario_id.startswith("demo"):
+        return "jump_scenario_details_demo"
+    return "jump_scenario_details_paid"
+
 def save_raw_scenario_to_db(scenario_id, raw_scenario_definition, ip):
     print("in save_raw_scenario_to_db")
-    if scenario_id.startswith("demo"):
-        tablename = "jump_scenario_details_demo"
-    else:
-        tablename = "jump_scenario_details_paid"
+    save_raw_scenarios_to_db({scenario_id: raw_scenario_definition}, ip)
+
+def save_raw_scenarios_to_db(raw_scenario_definitions, ip):
+    # {scenario_id: raw_scenario_definition}, one insert per table instead of one per scenario
+    updated = datetime.datetime.utcnow()
+    values_by_table = {}
+    for scenario_id, raw_scenario_definition in raw_scenario_definitions.items():
+        values = (scenario_id, updated, ip, Json(raw_scenario_definition), )
+        values_by_table.setdefault(scenario_details_tablename(scenario_id), []).append(values)
+
+    for tablename, values in values_by_table.items():
+        insert_scenario_details(tablename, values)
+
+def insert_scenario_details(tablename, values):
+    # values are (scenario_id, updated, ip, scenario_json) tuples
     cols = ['scenario_id', 'updated', 'ip', 'scenario_json']
-    values = (scenario_id, datetime.datetime.utcnow(), ip, Json(raw_scenario_definition), )
     with get_db_cursor() as cursor:
-        qry = sql.SQL("INSERT INTO {} ({}) values ({})").format( 
+        qry = sql.SQL("INSERT INTO {} ({}) values %s").format(
             sql.Identifier(tablename),
-            sql.SQL(', ').join(map(sql.Identifier, cols)),
-            sql.SQL(', ').join(sql.Placeholder() * len(cols)))
-        print(cursor.mogrify(qry, values))
-        cursor.execute(qry, values)
+            sql.SQL(', ').join(map(sql.Identifier, cols)))
+        execute_values(cursor, qry, values, page_size=500)
+
+    if tablename == "jump_scenario_details_paid":
+        refresh_latest_scenario_details([row[0] for row in values])
+    bump_scenario_versions([row[0] for row in values])
+
+def refresh_latest_scenario_details(scenario_ids):
+    # copies the newest history row of each scenario into jump_scenario_details_latest.
+    # it's read back from the history rather than written from the values just saved,
+    # so when two saves of a scenario race whichever refresh runs last is still right
+    scenario_ids = tuple(sorted(set(scenario_ids)))
+    if not scenario_ids:
+        return
+    command = """begin;
+        delete from jump_scenario_details_latest where scenario_id in %(scenario_ids)s;
+        insert into jump_scenario_details_latest (scenario_id, updated, ip, scenario_json, added_via_pushpull) (
+            select scenario_id, updated, ip, scenario_json, added_via_pushpull from (
+                select *, row_number() over (partition by scenario_id order by updated desc) as version_rank
+                from jump_scenario_details_paid where scenario_id in %(scenario_ids)s
+            ) s where version_rank=1
+        );
+        commit;"""
+
+    # concurrent deletes on the same table can fail redshift's serializable isolation
+    # check, so have another go.  get_db_cursor swallows errors, hence the flag
+    for attempt in range(SCENARIO_DETAILS_LATEST_RETRIES):
+        refreshed = {"done": False}
+        with get_db_cursor() as cursor:
+            try:
+                cursor.execute(command, {"scenario_ids": scenario_ids})
+            except Exception:
+                cursor.execute("rollback")
+                raise
+            refreshed["done"] = True
+        if refreshed["done"]:
+            return
+        print("Error: refresh of jump_scenario_details_latest failed for {}, attempt {}".format(scenario_ids, attempt + 1))
+    raise Exception("couldn't refresh jump_scenario_details_latest for {}".format(scenario_ids))
 
 def save_raw_member_institutions_included_to_db(scenario_id, member_institutions_list, ip):
     with get_db_cursor() as cursor:
@@ -41,6 +108,7 @@ def save_raw_member_institutions_included_to_db(scenario_id, member_institutions
             sql.SQL(', ').join(map(sql.Identifier, cols)),
             sql.SQL(', ').join(sql.Placeholder() * len(cols)))
         cursor.execute(qry, values)
+    bump_content_versions([scenario_key(scenario_id)])
 
 def get_feedback_member_institution_scenario_id(consortium_scenario_id, member_package_id):
     member_institution_scenario_id = "scenario-feedback{}".format(member_package_id)
@@ -51,42 +119,43 @@ def get_feedback_member_institution_scenario_id(consortium_scenario_id, member_p
 
 
 def save_feedback_on_member_institutions_included_to_db(consortium_scenario_id, member_institutions_list, ip):
-    from saved_scenario import save_raw_scenario_to_db
-
-    scenario_members = json.dumps(member_institutions_list)
     (updated, scenario_raw) = get_latest_scenario_raw(consortium_scenario_id)
     scenario_json = json.dumps(scenario_raw)
 
-    command = ""
+    member_scenario_ids = OrderedDict()
     for member_package_id in member_institutions_list:
         member_institution_scenario_id = get_feedback_member_institution_scenario_id(consortium_scenario_id, member_package_id)
+        member_scenario_ids[member_institution_scenario_id] = member_package_id
+    if not member_scenario_ids:
+        return
 
-        save_raw_scenario_to_db(member_institution_scenario_id, scenario_raw, ip)
-
-        command += """
-            UPDATE jump_scenario_details_paid set added_via_pushpull=True WHERE 
-            scenario_id=%(member_institution_scenario_id)s;
-
-            DELETE FROM jump_package_scenario WHERE 
-            scenario_id=%(member_institution_scenario_id)s;
-            
-            INSERT INTO jump_package_scenario 
-            (package_id, scenario_id, scenario_name, created, is_base_scenario)
-            values 
-            (%(member_package_id)s, %(member_institution_scenario_id)s, '', sysdate, False);
-
-            DELETE FROM jump_consortium_feedback_requests WHERE 
-            consortium_scenario_id=%(consortium_scenario_id)s and member_scenario_id=%(member_institution_scenario_id)s;
-            
-            INSERT INTO jump_consortium_feedback_requests 
-            (consortium_scenario_id, scenario_json, member_package_id, member_scenario_id, sent_date, return_date, ip) 
-            values 
-            (%(consortium_scenario_id)s, %(scenario_json)s, %(member_package_id)s, %(member_institution_scenario_id)s, sysdate, null, %(ip)s);            
-            """
+    save_raw_scenarios_to_db(OrderedDict([(scenario_id, scenario_raw) for scenario_id in member_scenario_ids]), ip)
 
+    # one statement per table for all the members, rather than five per member
+    member_scenario_id_tuple = tuple(member_scenario_ids.keys())
     with get_db_cursor() as cursor:
-        cursor.execute(command, {'consortium_scenario_id':consortium_scenario_id, 'scenario_json':scenario_json, 
-            'member_package_id':member_package_id, 'member_institution_scenario_id':member_institution_scenario_id, 'ip':ip})
+        cursor.execute("UPDATE jump_scenario_details_paid set added_via_pushpull=True WHERE scenario_id in %s",
+                       (member_scenario_id_tuple,))
+        cursor.execute("UPDATE jump_scenario_details_latest set added_via_pushpull=True WHERE scenario_id in %s",
+                       (member_scenario_id_tuple,))
+
+        cursor.execute("DELETE FROM jump_package_scenario WHERE scenario_id in %s", (member_scenario_id_tuple,))
+        execute_values(cursor,
+            """INSERT INTO jump_package_scenario (package_id, scenario_id, scenario_name, created, is_base_scenario) values %s""",
+            [(member_package_id, scenario_id) for scenario_id, member_package_id in member_scenario_ids.items()],
+            template="(%s, %s, '', sysdate, False)")
+
+        cursor.execute("DELETE FROM jump_consortium_feedback_requests WHERE consortium_scenario_id=%s and member_scenario_id in %s",
+                       (consortium_scenario_id, member_scenario_id_tuple))
+        execute_values(cursor,
+            """INSERT INTO jump_consortium_feedback_requests
+            (consortium_scenario_id, scenario_json, member_package_id, member_scenario_id, sent_date, return_date, ip) values %s""",
+            [(consortium_scenario_id, scenario_json, member_package_id, scenario_id, ip) for scenario_id, member_package_id in member_scenario_ids.items()],
+            template="(%s, %s, %s, %s, sysdate, null, %s)")
+
+    # the members' institution pages list the new proposal sets
+    bump_content_versions([scenario_key(consortium_scenario_id)] +
+                          [package_key(member_package_id) for member_package_id in member_scenario_ids.values()])
 
 def get_latest_scenario_raw(scenario_id, exclude_added_via_pushpull=False):
     updated = None
@@ -96,19 +165,102 @@ def get_latest_scenario_raw(scenario_id, exclude_added_via_pushpull=False):
             # is not True includes false and null, importantly
             command = "select updated,scenario_json from jump_scenario_details_paid where scenario_id=%s and added_via_pushpull is not True order by updated desc limit 1;"
         else:
-            command = "select updated,scenario_json from jump_scenario_details_paid where scenario_id=%s order by updated desc limit 1;"
+            command = "select updated,scenario_json from jump_scenario_details_latest where scenario_id=%s;"
         cursor.execute(command, (scenario_id,))
         rows = cursor.fetchall()
 
     if rows:
         updated = rows[0]["updated"]
-        scenario_data = json.loads(rows[0]["scenario_json"])
-        if not "member_added_subrs" in scenario_data:
-            scenario_data["member_added_subrs"] = []
+        scenario_data = parse_scenario(scenario_id, updated, rows[0]["scenario_json"]).to_dict()
 
     return (updated, scenario_data)
 
 
+def get_latest_scenarios_raw(scenario_ids, exclude_added_via_pushpull=False):
+    # get_latest_scenario_raw for many scenarios in one query.
+    # {scenario_id: (updated, scenario_data)}, missing ids are left out
+    scenario_ids = sorted(set([scenario_id for scenario_id in scenario_ids if scenario_id]))
+    if not scenario_ids:
+        return {}
+
+    if exclude_added_via_pushpull:
+        # the latest table only has the newest row, which may have come from pushpull
+        command = """select scenario_id, updated, scenario_json from (
+                select scenario_id, updated, scenario_json,
+                    row_number() over (partition by scenario_id order by updated desc) as version_rank
+                from jump_scenario_details_paid where scenario_id in %s and added_via_pushpull is not True
+            ) s where version_rank=1"""
+    else:
+        command = "select scenario_id, updated, scenario_json from jump_scenario_details_latest where scenario_id in %s"
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (tuple(scenario_ids),))
+        rows = cursor.fetchall()
+
+    response = {}
+    for row in rows:
+        parsed = parse_scenario(row["scenario_id"], row["updated"], row["scenario_json"])
+        response[row["scenario_id"]] = (row["updated"], parsed.to_dict())
+    return response
+
+
+def load_latest_scenarios(saved_scenarios):
+    # one query for the latest saved json of all of them, instead of one each
+    latest = get_latest_scenarios_raw([s.scenario_id for s in saved_scenarios])
+    for saved_scenario in saved_scenarios:
+        saved_scenario.primed_latest_scenario_raw = latest.get(saved_scenario.scenario_id, (None, None))
+    return saved_scenarios
+
+
+# parsed scenario json, so loading the same saved scenario again skips the json.loads.
+# keyed by (scenario_id, updated): every save gets a new updated, so entries never go stale
+PARSED_SCENARIO_CACHE_SIZE = int(os.getenv("PARSED_SCENARIO_CACHE_SIZE", 200))
+_parsed_scenario_cache = OrderedDict()
+_parsed_scenario_cache_lock = threading.Lock()
+
+
+class ParsedScenario(dict):
+    # a saved scenario definition, with the subscription lists also as sets.
+    # instances are shared through the cache, so don't change them: to_dict() makes a copy
+
+    def __init__(self, scenario_data):
+        super(ParsedScenario, self).__init__(scenario_data)
+        if not "member_added_subrs" in self:
+            self["member_added_subrs"] = []
+        self.subscription_set = frozenset(self.get("subrs") or [])
+        self.custom_subscription_set = frozenset(self.get("customSubrs") or [])
+        self.member_added_subscription_set = frozenset(self["member_added_subrs"] or [])
+
+    def to_dict(self):
+        return copy_scenario_value(self)
+
+
+def copy_scenario_value(value):
+    # much cheaper than parsing the json again.  the lists are lists of issns, so a
+    # shallow copy of them is enough
+    if isinstance(value, dict):
+        return dict([(key, copy_scenario_value(item)) for key, item in value.items()])
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+def parse_scenario(scenario_id, updated, scenario_json):
+    key = (scenario_id, updated)
+    with _parsed_scenario_cache_lock:
+        parsed = _parsed_scenario_cache.get(key, None)
+        if parsed is not None:
+            _parsed_scenario_cache.move_to_end(key)
+            return parsed
+
+    parsed = ParsedScenario(json.loads(scenario_json))
+    if updated is not None:
+        with _parsed_scenario_cache_lock:
+            _parsed_scenario_cache[key] = parsed
+            while len(_parsed_scenario_cache) > PARSED_SCENARIO_CACHE_SIZE:
+                _parsed_scenario_cache.popitem(last=False)
+    return parsed
+
+
 def get_latest_scenario(scenario_id, pkg_id=None, my_jwt=None):
     my_saved_scenario = SavedScenario.query.get(scenario_id)
     if my_saved_scenario:
@@ -118,23 +270,22 @@ def get_latest_scenario(scenario_id, pkg_id=None, my_jwt=None):
     else:
         package_id = DEMO_PACKAGE_ID
 
-    if scenario_id.startswith("demo"):
-        tablename = "jump_scenario_details_demo"
-    else:
-        tablename = "jump_scenario_details_paid"
+    tablename = scenario_details_tablename(scenario_id)
     rows = None
     with get_db_cursor() as cursor:
-        qry = sql.SQL("select scenario_json from {} where scenario_id=%s order by updated desc limit 1").format( 
-            sql.Identifier(tablename))
+        if tablename == "jump_scenario_details_paid":
+            qry = "select updated, scenario_json from jump_scenario_details_latest where scenario_id=%s"
+        else:
+            qry = sql.SQL("select updated, scenario_json from {} where scenario_id=%s order by updated desc limit 1").format(
+                sql.Identifier(tablename))
         cursor.execute(qry, (scenario_id,))
         rows = cursor.fetchall()
 
     scenario_data = None
 
     if rows:
-        scenario_data = json.loads(rows[0]["scenario_json"])
-        if not "member_added_subrs" in scenario_data:
-            scenario_data["member_added_subrs"] = []
+        # Scenario only reads it, so it can have the cached copy itself
+        scenario_data = parse_scenario(scenario_id, rows[0]["updated"], rows[0]["scenario_json"])
 
     my_scenario = Scenario(package_id, scenario_data, my_jwt=my_jwt)
     return my_scenario
@@ -162,9 +313,16 @@ class SavedScenario(db.Model):
         self.timing_messages = [];
         self.section_time = time()
 
+    def latest_scenario_raw(self):
+        # set in bulk by load_latest_scenarios when listing many scenarios
+        primed = getattr(self, "primed_latest_scenario_raw", None)
+        if primed is not None:
+            return primed
+        return get_latest_scenario_raw(self.scenario_id)
+
     @property
     def scenario_name(self):
-        (updated, response) = get_latest_scenario_raw(self.scenario_id)
+        (updated, response) = self.latest_scenario_raw()
         if not response:
             return "First Scenario"
         return response["name"]
@@ -178,14 +336,8 @@ class SavedScenario(db.Model):
             tablename = "jump_scenario_details_demo"
         else:
             tablename = "jump_scenario_details_paid"
-        with get_db_cursor() as cursor:
-            cols = ['scenario_id', 'updated', 'ip', 'scenario_json']
-            values = (self.scenario_id, datetime.datetime.utcnow(), ip, Json(self.to_dict_definition()), )
-            qry = sql.SQL("INSERT INTO {} ({}) values ({})").format(
-                sql.Identifier(tablename),
-                sql.SQL(', ').join(map(sql.Identifier, cols)),
-                sql.SQL(', ').join(sql.Placeholder() * len(cols)))
-            cursor.execute(qry, values)
+        values = (self.scenario_id, datetime.datetime.utcnow(), ip, Json(self.to_dict_definition()), )
+        insert_scenario_details(tablename, [values])
 
     def set_unique_id(self, unique_id):
         self.scenario_id = "demo-scenario-{}".format(unique_id)
@@ -272,7 +424,7 @@ class SavedScenario(db.Model):
 
 
     def to_dict_saved_from_db(self):
-        (updated, response) = get_latest_scenario_raw(self.scenario_id)
+        (updated, response) = self.latest_scenario_raw()
         if not response:
             self.set_live_scenario()  # in case not done
             response = {
@@ -19,7 +19,7 @@ from app import db
 from app import logger
 from app import memorycache
 from app import s3_client
-from app import common_data_dict
+from app import get_common_data_dict
 
 from time import time
 from util import elapsed
@@ -29,6 +29,8 @@ from util import get_sql_answer
 
 from journal import Journal
 from assumptions import Assumptions
+from package_cache import package_issn_cache
+from package_cache import COUNTER, PERPETUAL_ACCESS, FILTER
 
 def get_clean_package_id(http_request_args):
     if not http_request_args:
@@ -49,12 +51,8 @@ def get_fresh_journal_list(scenario, my_jwt):
     issn_ls = list(scenario.data["unpaywall_downloads_dict"].keys())
     issnls_to_build = [issn_l for issn_l in issn_ls if issn_l not in journals_to_exclude]
 
-    with get_db_cursor() as cursor:
-        qry = "select distinct(issn_l) from jump_journal_filter where package_id = %s"
-        cursor.execute(qry, (scenario.package_id,))
-        rows = cursor.fetchall()
-    if rows:
-        journals_to_include = [w[0] for w in rows]
+    journals_to_include = get_journal_filter_from_db(scenario.package_id)
+    if journals_to_include:
         issnls_to_build = [issn_l for issn_l in issnls_to_build if issn_l in journals_to_include]
 
     # only include things in the counter file
@@ -131,10 +129,17 @@ class Scenario(object):
         self.log_timing("set data in journals")
 
         if http_request_args:
+            # saved scenarios (saved_scenario.ParsedScenario) come with the sets already made
+            subscription_set = getattr(http_request_args, "subscription_set", None)
+            if subscription_set is None:
+                subscription_set = frozenset(http_request_args.get("subrs") or [])
+            custom_subscription_set = getattr(http_request_args, "custom_subscription_set", None)
+            if custom_subscription_set is None:
+                custom_subscription_set = frozenset(http_request_args.get("customSubrs") or [])
             for journal in self.journals:
-                if journal.issn_l in http_request_args.get("subrs", []):
+                if journal.issn_l in subscription_set:
                     journal.set_subscribe_bulk()
-                if journal.issn_l in http_request_args.get("customSubrs", []):
+                if journal.issn_l in custom_subscription_set:
                     journal.set_subscribe_custom()
         self.log_timing("subscribing to all journals")
 
@@ -616,8 +621,9 @@ def get_counter_journals_by_report_name_from_db(package_id):
         rows = cursor.fetchall()
     return rows
 
-# don't cache because called after loading to get fresh data
-def get_counter_totals_from_db(package_id):
+# cached per journal; uploads invalidate the journals they change through package_cache
+@package_issn_cache(COUNTER)
+def get_counter_totals_from_db(package_id, issn_ls=None):
     counter_dict = defaultdict(int)
     command = """select issn_l, total::float, report_version, report_name, metric_type 
         from jump_counter 
@@ -626,7 +632,10 @@ def get_counter_totals_from_db(package_id):
         """
     rows = None
     with get_db_cursor() as cursor:
-        cursor.execute(command, (package_id,))
+        if issn_ls is not None:
+            cursor.execute(command + " and issn_l in %s", (package_id, tuple(issn_ls),))
+        else:
+            cursor.execute(command, (package_id,))
         rows = cursor.fetchall()
     if rows:
         is_counter5 = (rows[0]["report_version"] == "5")
@@ -718,15 +727,31 @@ def get_apc_data_from_db(input_package_id):
 
 
 
-def get_perpetual_access_from_cache(package_id):
+@package_issn_cache(PERPETUAL_ACCESS)
+def get_perpetual_access_from_cache(package_id, issn_ls=None):
     command = "select * from jump_perpetual_access where package_id=%s"
     with get_db_cursor() as cursor:
-        cursor.execute(command, (package_id,))
+        if issn_ls is not None:
+            cursor.execute(command + " and issn_l in %s", (package_id, tuple(issn_ls),))
+        else:
+            cursor.execute(command, (package_id,))
         rows = cursor.fetchall()
     package_dict = dict([(a["issn_l"], a) for a in rows])
     return package_dict
 
 
+@package_issn_cache(FILTER)
+def get_journal_filter_from_db(package_id, issn_ls=None):
+    command = "select distinct(issn_l) from jump_journal_filter where package_id=%s"
+    with get_db_cursor() as cursor:
+        if issn_ls is not None:
+            cursor.execute(command + " and issn_l in %s", (package_id, tuple(issn_ls),))
+        else:
+            cursor.execute(command, (package_id,))
+        rows = cursor.fetchall()
+    return dict([(row["issn_l"], True) for row in rows])
+
+
 @cache
 def get_core_list_from_db(input_package_id):
     command = "select issn_l, baseline_access from jump_core_journals where package_id=%s"
@@ -787,27 +812,27 @@ def include_keys(dictionary, keys):
     return {key: dictionary[key] for key in key_set}
 
 def get_embargo_data_from_json(issns):
-    return include_keys(common_data_dict['embargo_dict'], issns)
+    return include_keys(get_common_data_dict()['embargo_dict'], issns)
 
 def get_unpaywall_downloads_from_json(issns):
-    return include_keys(common_data_dict['unpaywall_downloads_dict_raw'], issns)
+    return include_keys(get_common_data_dict()['unpaywall_downloads_dict_raw'], issns)
 
 def get_num_papers_from_json(issns):
-    return include_keys(common_data_dict['num_papers'], issns)
+    return include_keys(get_common_data_dict()['num_papers'], issns)
 
 def get_oa_data_from_json(issns):
     oa_dict = {}
     for submitted in ["with_submitted", "no_submitted"]:
         for bronze in ["with_bronze", "no_bronze"]:
             key = "{}_{}".format(submitted, bronze)
-            oa_dict[key] = include_keys(common_data_dict['oa'][key], issns)
+            oa_dict[key] = include_keys(get_common_data_dict()['oa'][key], issns)
     return oa_dict
 
 def get_society_data_from_json(issns):
-    return include_keys(common_data_dict['society'], issns)
+    return include_keys(get_common_data_dict()['society'], issns)
 
 def get_social_networks_data_from_json(issns):
-    return include_keys(common_data_dict['social_networks'], issns)
+    return include_keys(get_common_data_dict()['social_networks'], issns)
 
 # not cached on purpose, because components are cached to save space
 def get_common_package_data(package_id, issns):
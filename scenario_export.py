@@ -0,0 +1,50 @@
+# coding: utf-8
+
+import csv
+import io
+
+from consortium import Consortium
+from consortium import get_consortium_ids
+from saved_scenario import SavedScenario
+
+# csv exports of a scenario's journals.  the export routes in views.py use these, and so
+# does the scenario_export job (jobs.py) for exports too slow for a web request
+
+
+def scenario_export_table_dicts(scenario_id, gather_export_concepts=False):
+    # doesn't check permissions, the caller has to
+    consortium_ids = get_consortium_ids()
+    if scenario_id in [d["scenario_id"] for d in consortium_ids]:
+        my_consortium = Consortium(scenario_id)
+        return my_consortium.to_dict_journals()["journals"]
+    my_saved_scenario = SavedScenario.query.get(scenario_id)
+    return my_saved_scenario.to_dict_journals(gather_export_concepts=gather_export_concepts)["journals"]
+
+
+def export_get(table_dicts, is_main_export=True):
+    if not table_dicts:
+        return []
+
+    if is_main_export:
+        keys = ['issn_l_prefixed', 'issn_l', 'title', 'issns', 'publisher_journal', 'subject', 'subject_top_three', 'subjects_all', 'subscribed', 'is_society_journal', 'usage', 'subscription_cost', 'ill_cost', 'cpu', 'cpu_rank', 'cost', 'instant_usage_percent', 'free_instant_usage_percent', 'subscription_minus_ill_cost', 'use_oa_percent', 'use_backfile_percent', 'use_subscription_percent', 'use_ill_percent', 'use_other_delayed_percent', 'perpetual_access_years_text', 'baseline_access_text', 'bronze_oa_embargo_months', 'downloads', 'citations', 'authorships', 'cpu_fuzzed', 'subscription_cost_fuzzed', 'subscription_minus_ill_cost_fuzzed', 'usage_fuzzed', 'downloads_fuzzed', 'citations_fuzzed', 'authorships_fuzzed']
+    else:
+        keys = ['scenario_id', 'institution_code', 'package_id', 'institution_name', 'issn_l_prefixed', 'issn_l', 'subscribed_by_consortium', 'subscribed_by_member_institution', 'core_plus_for_member_institution', 'title', 'issns',  'subscription_cost', 'ill_cost', 'cpu', 'usage', 'downloads', 'citations', 'authorships', 'use_oa', 'use_backfile', 'use_subscription', 'use_ill', 'use_other_delayed', 'perpetual_access_years', 'bronze_oa_embargo_months',  'is_society_journal']
+
+    # in memory, so two exports at once don't share an export.csv
+    file = io.StringIO(newline="")
+    csv_writer = csv.writer(file)
+
+    headers = ['publisher' if w == 'publisher_journal' else w for w in keys]
+    csv_writer.writerow(headers)
+    for table_dict in table_dicts:
+        row = []
+        for my_key in keys:
+            if my_key == "issn_l_prefixed":
+                row.append("issn:{}".format(table_dict["issn_l"]))
+            else:
+                row.append(table_dict.get(my_key, None))
+        csv_writer.writerow(row)
+
+    # same lines as writing the file and reading it back
+    contents = io.StringIO(file.getvalue(), newline=None).readlines()
+    return contents
@@ -0,0 +1,116 @@
+# coding: utf-8
+
+import argparse
+from time import time
+
+from app import get_db_cursor
+from util import elapsed
+
+# Upkeep for the scenario save history (see the comments at the top of saved_scenario.py).
+#
+# --backfill rebuilds jump_scenario_details_latest from jump_scenario_details_paid.  run it
+# once when the latest table is created, or any time it's suspected of being out of date.
+#
+# --compact moves old history rows into jump_scenario_details_paid_archive.  for each
+# scenario it keeps the newest --keep rows, anything newer than --days days, and the
+# newest row not added via pushpull (feedback scenarios read that one).  nothing reads
+# the archive, it's just there so history is never thrown away.
+#
+# create table jump_scenario_details_paid_archive (like jump_scenario_details_paid);
+
+SCENARIO_DETAILS_COLUMNS = "scenario_id, updated, ip, scenario_json, added_via_pushpull"
+
+
+def backfill_latest():
+    command = """begin;
+        delete from jump_scenario_details_latest;
+        insert into jump_scenario_details_latest ({columns}) (
+            select {columns} from (
+                select *, row_number() over (partition by scenario_id order by updated desc) as version_rank
+                from jump_scenario_details_paid
+            ) s where version_rank=1
+        );
+        commit;""".format(columns=SCENARIO_DETAILS_COLUMNS)
+    with get_db_cursor() as cursor:
+        try:
+            cursor.execute(command)
+        except Exception:
+            cursor.execute("rollback")
+            raise
+        cursor.execute("analyze jump_scenario_details_latest")
+    return count_missing_latest()
+
+
+def count_missing_latest():
+    # scenarios whose newest history row isn't the one in the latest table
+    command = """select count(*) as num_missing from (
+            select scenario_id, max(updated) as updated from jump_scenario_details_paid group by scenario_id
+        ) h
+        left join jump_scenario_details_latest l on l.scenario_id=h.scenario_id and l.updated=h.updated
+        where l.scenario_id is null"""
+    with get_db_cursor() as cursor:
+        cursor.execute(command)
+        return cursor.fetchone()["num_missing"]
+
+
+def compact_history(keep, days):
+    # the rows to archive go in a temp table first, so the insert and the delete agree
+    # on exactly which rows they are
+    with get_db_cursor() as cursor:
+        cursor.execute("drop table if exists scenario_history_to_archive")
+        cursor.execute("""create temp table scenario_history_to_archive as (
+                select scenario_id, updated from (
+                    select scenario_id, updated,
+                        row_number() over (partition by scenario_id order by updated desc) as version_rank,
+                        row_number() over (partition by scenario_id, added_via_pushpull is not True order by updated desc) as member_version_rank,
+                        added_via_pushpull
+                    from jump_scenario_details_paid
+                ) s
+                where version_rank > %s
+                and updated < dateadd(day, -%s, sysdate)
+                and not (member_version_rank=1 and added_via_pushpull is not True)
+            )""", (keep, days))
+        cursor.execute("select count(*) as num_rows from scenario_history_to_archive")
+        num_rows = cursor.fetchone()["num_rows"]
+        if not num_rows:
+            return 0
+
+        command = """begin;
+            insert into jump_scenario_details_paid_archive ({columns}) (
+                select {paid_columns} from jump_scenario_details_paid p
+                join scenario_history_to_archive a on a.scenario_id=p.scenario_id and a.updated=p.updated
+            );
+            delete from jump_scenario_details_paid using scenario_history_to_archive a
+                where jump_scenario_details_paid.scenario_id=a.scenario_id
+                and jump_scenario_details_paid.updated=a.updated;
+            commit;""".format(
+            columns=SCENARIO_DETAILS_COLUMNS,
+            paid_columns=", ".join(["p.{}".format(column.strip()) for column in SCENARIO_DETAILS_COLUMNS.split(",")]),
+        )
+        try:
+            cursor.execute(command)
+        except Exception:
+            cursor.execute("rollback")
+            raise
+    return num_rows
+
+
+# python scenario_history.py --backfill
+# python scenario_history.py --compact --keep 50 --days 90
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backfill", help="rebuild jump_scenario_details_latest", action="store_true", default=False)
+    parser.add_argument("--compact", help="archive old scenario history rows", action="store_true", default=False)
+    parser.add_argument("--keep", help="history rows to keep per scenario", type=int, default=50)
+    parser.add_argument("--days", help="keep all history rows newer than this", type=int, default=90)
+    parsed_args = parser.parse_args()
+
+    if parsed_args.backfill:
+        start_time = time()
+        num_missing = backfill_latest()
+        print("backfilled jump_scenario_details_latest in {}s, {} scenarios out of date".format(elapsed(start_time), num_missing))
+
+    if parsed_args.compact:
+        start_time = time()
+        num_rows = compact_history(parsed_args.keep, parsed_args.days)
+        print("archived {} scenario history rows in {}s".format(num_rows, elapsed(start_time)))
@@ -0,0 +1,91 @@
+from consortium_aggregates import ConsortiumAggregates, SUM_COLUMNS, USAGE_WEIGHTED_COLUMNS
+
+columns = ["member_package_id", "issn_l", "institution_name", "perpetual_access_years"] + SUM_COLUMNS + USAGE_WEIGHTED_COLUMNS
+
+def make_row(member_package_id, issn_l, usage, green_percent, perpetual_access_years=None):
+    row = dict([(name, 0) for name in columns])
+    row.update({
+        "member_package_id": member_package_id,
+        "issn_l": issn_l,
+        "institution_name": "Institution {}".format(member_package_id),
+        "perpetual_access_years": perpetual_access_years,
+        "usage": usage,
+        "use_green_percent": green_percent,
+        "downloads": None,
+    })
+    return tuple(row[name] for name in columns)
+
+rows = [
+    make_row("package-a", "0000-0001", 10, 50),
+    make_row("package-b", "0000-0001", 30, 10, "2010-2015"),
+    make_row("package-c", "0000-0001", 100, 100),
+    make_row("package-a", "0000-0002", 5, 0),
+]
+
+def test_totals_sum_over_included_members():
+    aggregates = ConsortiumAggregates(columns, rows)
+    totals = aggregates.totals(["package-a", "package-b", "package-not-there"])
+
+    assert [totals.issn_l(i) for i in totals.journal_indexes()] == ["0000-0001", "0000-0002"]
+    assert totals.sum("usage", 0) == 40.0
+    assert totals.sum("downloads", 0) == 0.0
+    # usage weighted: 10*50 + 30*10
+    assert totals.sum("use_green_percent", 0) == 800.0
+    assert totals.list_attribute("institution_name", 0) == ["Institution package-a", "Institution package-b"]
+    assert totals.first_value("perpetual_access_years", 0) == "2010-2015"
+    assert totals.first_value("not_a_column", 0) is None
+    assert totals.row_dict(1)["member_package_id"] == "package-a"
+
+def test_totals_skip_journals_without_included_rows():
+    aggregates = ConsortiumAggregates(columns, rows)
+    totals = aggregates.totals(["package-c"])
+    assert [totals.issn_l(i) for i in totals.journal_indexes()] == ["0000-0001"]
+    assert totals.sum("usage", 0) == 100.0
+
+def test_empty():
+    aggregates = ConsortiumAggregates(columns, [])
+    assert aggregates.totals(["package-a"]).journal_indexes() == []
+
+def test_toggling_members_matches_summing_again():
+    aggregates = ConsortiumAggregates(columns, rows)
+    everyone = aggregates.totals(["package-a", "package-b", "package-c"])
+    assert everyone.sum("usage", 0) == 140.0
+
+    # drops package-c from the last totals instead of starting over
+    toggled = aggregates.totals(["package-a", "package-b"])
+    assert toggled.member_codes < everyone.member_codes
+    assert toggled.sum("usage", 0) == 40.0
+    assert toggled.sum("use_green_percent", 0) == 800.0
+    assert toggled.list_attribute("institution_name", 0) == ["Institution package-a", "Institution package-b"]
+
+    toggled = aggregates.totals(["package-b", "package-c"])
+    assert [toggled.issn_l(i) for i in toggled.journal_indexes()] == ["0000-0001"]
+    assert toggled.sum("usage", 0) == 130.0
+    assert aggregates.totals(["package-b", "package-c"]) is toggled
+
+
+def test_toggling_members_leaves_exact_zeros():
+    # 0.1 + 0.2 - 0.1 - 0.2 isn't 0 in floats
+    fraction_rows = [
+        make_row("package-a", "0000-0001", 0.1, 30),
+        make_row("package-b", "0000-0001", 0.2, 70),
+        make_row("package-c", "0000-0001", 0, 0),
+        make_row("package-d", "0000-0001", 0, 0),
+        make_row("package-e", "0000-0001", 0, 0),
+    ]
+    aggregates = ConsortiumAggregates(columns, fraction_rows)
+    everyone = aggregates.totals(["package-a", "package-b", "package-c", "package-d", "package-e"])
+    assert everyone.sum("usage", 0) > 0
+
+    # drops every member with usage from the last totals
+    only_zero_usage = aggregates.totals(["package-c", "package-d", "package-e"])
+    assert only_zero_usage.member_codes < everyone.member_codes
+    assert only_zero_usage.journal_indexes() == [0]
+    assert only_zero_usage.sum("usage", 0) == 0.0
+    assert only_zero_usage.sum("use_green_percent", 0) == 0.0
+
+def test_benchmark_members_matches_old_loop():
+    from consortium_aggregates import benchmark_members
+    # benchmark_members asserts the new loop gives the same rows as the old one
+    labels = [label for (label, seconds) in benchmark_members(num_members=20)]
+    assert labels == ["member loop, nested scans", "member loop, ConsortiumMembers"]
@@ -0,0 +1,85 @@
+import datetime
+import simplejson as json
+import consortium_progress
+from consortium_progress import RecomputeProgress, get_progress, progress_event_stream, sse_event
+
+scenario_id = "test-consortium-progress"
+
+def test_recompute_progress_is_stored():
+    recompute_progress = RecomputeProgress(scenario_id, num_members=4, num_members_skipped=1)
+    recompute_progress.start()
+    assert get_progress(scenario_id)["num_members_done"] == 1
+
+    recompute_progress.member_done(2, 500)
+    progress = get_progress(scenario_id)
+    assert progress["status"] == consortium_progress.PROGRESS_RUNNING
+    assert progress["num_rows_written"] == 500
+    assert progress["percent_complete"] == 50.0
+    assert progress["eta_seconds"] is not None
+
+    recompute_progress.done()
+    assert get_progress(scenario_id)["status"] == consortium_progress.PROGRESS_DONE
+
+def test_sse_event():
+    assert sse_event({"a": 1}) == 'event: progress\ndata: {"a": 1}\n\n'
+
+def test_progress_event_stream_sends_changes_then_ends(monkeypatch):
+    snapshots = [
+        {"status": "running", "num_members_done": 1},
+        {"status": "running", "num_members_done": 1},
+        {"status": "running", "num_members_done": 2},
+        {"status": "done", "num_members_done": 3},
+    ]
+    monkeypatch.setattr(consortium_progress, "get_progress", lambda scenario_id: snapshots.pop(0))
+    monkeypatch.setattr(consortium_progress, "get_pending_recompute_created", lambda scenario_id: None)
+    monkeypatch.setattr(consortium_progress, "PROGRESS_STREAM_POLL_SECONDS", 0)
+
+    events = list(progress_event_stream(scenario_id))
+    assert events[0].startswith("retry:")
+    progress_events = [json.loads(event.split("data: ")[1]) for event in events if event.startswith("event: progress")]
+    assert [event["num_members_done"] for event in progress_events] == [1, 2, 3]
+    assert events[-1].startswith("event: end")
+
+
+def test_queued_progress_is_not_finished():
+    recompute_progress = RecomputeProgress(scenario_id, num_members=4)
+    recompute_progress.queued()
+    progress = get_progress(scenario_id)
+    assert progress["status"] == consortium_progress.PROGRESS_QUEUED
+    assert progress["run_id"] == recompute_progress.run_id
+    assert not consortium_progress.is_finished(progress)
+
+def test_progress_event_stream_waits_for_queued_recompute(monkeypatch):
+    queued = datetime.datetime(2022, 1, 20, 12, 0)
+    snapshots = [
+        None,
+        {"status": "done", "num_members_done": 3, "updated": queued - datetime.timedelta(hours=1)},
+        {"status": "running", "num_members_done": 1, "updated": queued + datetime.timedelta(minutes=1)},
+        {"status": "done", "num_members_done": 3, "updated": queued + datetime.timedelta(minutes=2)},
+    ]
+    monkeypatch.setattr(consortium_progress, "get_progress", lambda scenario_id: snapshots.pop(0))
+    monkeypatch.setattr(consortium_progress, "get_pending_recompute_created", lambda scenario_id: queued)
+    monkeypatch.setattr(consortium_progress, "PROGRESS_STREAM_POLL_SECONDS", 0)
+
+    events = list(progress_event_stream(scenario_id))
+    assert len([event for event in events if event.startswith("event: end")]) == 1
+    assert json.loads(events[-1].split("data: ")[1])["updated"] == (queued + datetime.timedelta(minutes=2)).isoformat()
+
+def test_recompute_with_nothing_changed_ends_the_queued_run(monkeypatch):
+    import consortium
+    RecomputeProgress(scenario_id, num_members=2).queued()
+
+    my_consortium = consortium.Consortium.__new__(consortium.Consortium)
+    my_consortium.scenario_id = scenario_id
+    my_consortium.all_member_package_ids = ["package-a", "package-b"]
+    hashes = {"package-a": "hash-a", "package-b": "hash-b"}
+    monkeypatch.setattr(my_consortium, "member_input_hashes", lambda member_package_ids: hashes)
+    monkeypatch.setattr(consortium, "consortium_get_member_hashes", lambda scenario_id: hashes)
+    cleared = []
+    monkeypatch.setattr(my_consortium, "reset_computed_caches", lambda: cleared.append(True))
+
+    my_consortium.recompute_journal_dicts()
+    progress = get_progress(scenario_id)
+    assert progress["status"] == consortium_progress.PROGRESS_DONE
+    assert progress["num_members_done"] == 2
+    assert cleared
@@ -107,3 +107,23 @@ def test_delete():
 #     assert isinstance(res2, str)
 #     assert 'Deleted CounterInput' in res
 #     assert package_id in res
+
+def test_diff_rows_by_issn():
+    fields = ['issn', 'package_id', 'report_name', 'total']
+    existing = [
+        {'issn': '0379-4172', 'package_id': package_id, 'report_name': 'jr1', 'total': 0},
+        {'issn': '1877-3435', 'package_id': package_id, 'report_name': 'jr1', 'total': 326},
+        {'issn': '0944-2006', 'package_id': package_id, 'report_name': 'jr1', 'total': 231},
+    ]
+    new = [
+        {'issn': '0379-4172', 'package_id': package_id, 'report_name': 'jr1', 'total': 0},
+        {'issn': '1877-3435', 'package_id': package_id, 'report_name': 'jr1', 'total': 327},
+        {'issn': '2213-8463', 'package_id': package_id, 'report_name': 'jr1', 'total': 17},
+    ]
+    changes = CounterInput.diff_rows_by_issn(existing, new, fields)
+    assert changes['inserted'] == {'2213-8463'}
+    assert changes['updated'] == {'1877-3435'}
+    assert changes['deleted'] == {'0944-2006'}
+    assert changes['changed_issns'] == {'2213-8463', '1877-3435', '0944-2006'}
+
+    assert not CounterInput.diff_rows_by_issn(existing, existing, fields)['changed_issns']
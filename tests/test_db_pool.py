@@ -0,0 +1,35 @@
+import pytest
+import db_pool
+from db_pool import DbPoolStats, pool_setting
+
+def test_pool_setting_by_process_type(monkeypatch):
+    monkeypatch.delenv("DB_POOL_MAXCONN", raising=False)
+    monkeypatch.delenv("DB_POOL_MAXCONN_PARSE_UPLOADS", raising=False)
+    monkeypatch.setenv("DYNO", "parse_uploads.1")
+    assert pool_setting("DB_POOL_MAXCONN", 200) == 200
+
+    monkeypatch.setenv("DB_POOL_MAXCONN", "50")
+    assert pool_setting("DB_POOL_MAXCONN", 200) == 50
+
+    monkeypatch.setenv("DB_POOL_MAXCONN_PARSE_UPLOADS", "20")
+    assert pool_setting("DB_POOL_MAXCONN", 200) == 20
+
+def test_db_pool_stats(monkeypatch):
+    monkeypatch.setattr(db_pool, "LOG_STATS_SECONDS", 10 ** 6)
+    stats = DbPoolStats(maxconn=10)
+    stats.record_checkout(0.0001)
+    stats.record_checkout(2)
+    stats.record_checkin()
+    stats.record_timeout()
+    stats.record_query("package:get_custom_prices", 0.5)
+    stats.record_query("package:get_custom_prices", 1.5)
+
+    stats_dict = stats.to_dict()
+    assert stats_dict["checkouts"] == 2
+    assert stats_dict["timeouts"] == 1
+    assert stats_dict["in_use"] == 1
+    assert stats_dict["max_in_use"] == 2
+    assert stats_dict["wait_histogram"]["le_0.001"] == 1
+    assert stats_dict["wait_histogram"]["le_5"] == 1
+    assert stats_dict["queries"]["package:get_custom_prices"]["count"] == 2
+    assert stats_dict["queries"]["package:get_custom_prices"]["seconds_max"] == 1.5
@@ -23,3 +23,43 @@ def test_convert_spreadsheet_to_csv_parsed_with_formulas():
     with pytest.raises(RuntimeError) as err:
         convert_spreadsheet_to_csv('tests/test_files/journal_price/with-formulas.xlsx', parsed=False)
         assert "Uploaded files can not contain formulas" in str(err.value)
+
+def _write_workbook(path, rows):
+    import openpyxl
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+def test_convert_spreadsheet_to_csv_parsed_streams_rows(tmp_path):
+    path = str(tmp_path / 'parsed.xlsx')
+    _write_workbook(path, [['ISSN', ' Total '], ['0944-2006', 16], ['0091-3057', 122]])
+    x = convert_spreadsheet_to_csv(path, parsed=True)
+    assert len(x) == 1
+    with open(x[0]) as f:
+        assert f.read().splitlines() == ['issn,total', '0944-2006,16', '0091-3057,122']
+
+def test_convert_spreadsheet_to_csv_formula_removes_partial_csv(tmp_path, monkeypatch):
+    import tempfile
+    created = []
+    mkstemp = tempfile.mkstemp
+    def tracking_mkstemp(*args, **kwargs):
+        result = mkstemp(*args, **kwargs)
+        created.append(result[1])
+        return result
+    monkeypatch.setattr(tempfile, 'mkstemp', tracking_mkstemp)
+
+    path = str(tmp_path / 'formula.xlsx')
+    _write_workbook(path, [['issn', 'total'], ['0944-2006', 16], ['0091-3057', '=B2*2']])
+    with pytest.raises(RuntimeError) as err:
+        convert_spreadsheet_to_csv(path, parsed=True)
+    assert "Uploaded files can not contain formulas" in str(err.value)
+    assert "B3" in str(err.value)
+    assert created and not any(os.path.exists(f) for f in created)
+
+def test_benchmark_runs():
+    from excel import benchmark
+    results = benchmark(num_rows=100, num_columns=3)
+    assert len(results) == 3
+    assert all(peak_mb > 0 for (label, seconds, peak_mb) in results)
@@ -0,0 +1,66 @@
+import pytest
+import jobs
+from app import get_db_cursor
+from jobs import job_type, submit_job, get_job, claim_job, run_job, requeue_stale_jobs
+
+@job_type("test_add")
+def add_job(job, a, b):
+    job.set_progress(1, 2, "adding")
+    return {"total": a + b}
+
+@job_type("test_fail")
+def fail_job(job):
+    raise ValueError("this job always fails")
+
+def test_job_runs_and_keeps_result():
+    job = submit_job("test_add", {"a": 1, "b": 2})
+    assert job.status == jobs.JOB_QUEUED
+
+    assert claim_job(job.job_id)
+    # a second worker can't claim it too
+    assert not claim_job(job.job_id)
+
+    run_job(get_job(job.job_id))
+    job = get_job(job.job_id)
+    assert job.status == jobs.JOB_DONE
+    assert job.result == {"total": 3}
+    assert job.progress_message == "adding"
+    assert job.percent_complete == 100.0
+
+def test_failed_job_keeps_error():
+    job = submit_job("test_fail")
+    assert claim_job(job.job_id)
+    run_job(get_job(job.job_id))
+
+    job = get_job(job.job_id)
+    assert job.status == jobs.JOB_FAILED
+    assert "this job always fails" in job.error
+    assert job.result is None
+
+def test_unknown_job_type():
+    with pytest.raises(ValueError):
+        submit_job("not_a_job_type")
+
+
+def make_stale(job_id):
+    with get_db_cursor() as cursor:
+        cursor.execute("update jump_job set heartbeat=dateadd(hour, -1, sysdate) where job_id=%s", (job_id,))
+
+def test_stale_running_job_is_requeued_then_failed():
+    job = submit_job("test_add", {"a": 1, "b": 2})
+    for attempt in range(jobs.JOB_MAX_ATTEMPTS):
+        assert claim_job(job.job_id)
+        # the dyno running it was restarted
+        make_stale(job.job_id)
+        requeue_stale_jobs()
+
+    job = get_job(job.job_id)
+    assert job.status == jobs.JOB_FAILED
+    assert job.attempts == jobs.JOB_MAX_ATTEMPTS
+    assert "giving up" in job.error
+
+def test_running_job_with_heartbeat_is_left_alone():
+    job = submit_job("test_add", {"a": 1, "b": 2})
+    assert claim_job(job.job_id)
+    requeue_stale_jobs()
+    assert get_job(job.job_id).status == jobs.JOB_RUNNING
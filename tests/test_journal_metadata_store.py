@@ -0,0 +1,47 @@
+import pytest
+from journal_metadata_store import JournalMetadataStore
+
+rows = [
+    {"issn_l": "1877-3435", "issns_string": '["1877-3435", "1877-3443"]', "title": "Current Opinion in Environmental Sustainability",
+     "publisher": "Elsevier", "is_current_subscription_journal": True, "is_gold_journal_in_most_recent_year": False,
+     "is_currently_publishing": True, "subscription_price_usd": 2400.0, "subscription_price_gbp": None,
+     "apc_price_usd": None, "apc_price_gbp": None},
+    {"issn_l": "0379-4172", "issns_string": '["0379-4172"]', "title": "Acta Genética Sinica",
+     "publisher": "Elsevier", "is_current_subscription_journal": False, "is_gold_journal_in_most_recent_year": None,
+     "is_currently_publishing": False, "subscription_price_usd": None, "subscription_price_gbp": None,
+     "apc_price_usd": 1500.0, "apc_price_gbp": 1200.0},
+]
+
+def check_store(store):
+    assert len(store) == 2
+
+    my_journal = store.by_issn().get("1877-3443")
+    assert my_journal.issn_l == "1877-3435"
+    assert my_journal.issns == ["1877-3435", "1877-3443"]
+    assert my_journal.display_issns == "1877-3435,1877-3443"
+    assert my_journal.publisher_code == "Elsevier"
+    assert my_journal.is_current_subscription_journal is True
+    assert my_journal.is_hybrid is True
+    assert my_journal.get_subscription_price("USD") == 2400.0
+    assert my_journal.get_subscription_price("GBP", use_high_price_if_unknown=True) == 3775
+
+    my_journal = store.by_issn_l()["0379-4172"]
+    assert my_journal.title == "Acta Genética Sinica"
+    assert my_journal.is_gold_journal_in_most_recent_year is None
+    assert my_journal.get_apc_price("GBP") == 1200.0
+    assert my_journal.subscription_price_usd is None
+
+    assert store.by_issn_l().get("1877-3443") is None
+    assert store.by_issn().get("0000-0000") is None
+    assert "0379-4172" in store.by_issn()
+    assert sorted(store.by_issn_l().keys()) == ["0379-4172", "1877-3435"]
+
+def test_journal_metadata_store():
+    check_store(JournalMetadataStore.from_rows(rows, version="test"))
+
+def test_journal_metadata_store_save_and_map(tmp_path):
+    directory = str(tmp_path / "store")
+    JournalMetadataStore.from_rows(rows, version="test").save(directory)
+    store = JournalMetadataStore.load(directory)
+    assert store.version == "test"
+    check_store(store)
@@ -0,0 +1,59 @@
+import pytest
+import lazy_data
+from lazy_data import LazyDataset, preload_setting
+
+def test_lazy_dataset_loads_once():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return {"0379-4172": 10}
+
+    dataset = LazyDataset("test", loader)
+    assert not dataset.is_loaded
+    assert calls == []
+
+    assert dataset.get() == {"0379-4172": 10}
+    assert dataset.get() == {"0379-4172": 10}
+    assert dataset.is_loaded
+    assert len(calls) == 1
+
+    dataset.reset()
+    dataset.get()
+    assert len(calls) == 2
+
+def test_preload_setting_by_process_type(monkeypatch):
+    monkeypatch.delenv("PRELOAD_DATASETS", raising=False)
+    monkeypatch.delenv("PRELOAD_DATASETS_WEB", raising=False)
+    monkeypatch.setenv("DYNO", "web.1")
+    assert preload_setting() == "all"
+
+    monkeypatch.setenv("DYNO", "parse_uploads.1")
+    assert preload_setting() == "none"
+
+    monkeypatch.setenv("PRELOAD_DATASETS", "oa_issns")
+    assert preload_setting() == "oa_issns"
+
+    monkeypatch.setenv("DYNO", "web.1")
+    monkeypatch.setenv("PRELOAD_DATASETS_WEB", "None")
+    assert preload_setting() == "none"
+
+def test_lazy_dataset_reloads_when_version_is_stable(monkeypatch):
+    monkeypatch.setattr(lazy_data, "start_version_checks", lambda: None)
+    versions = ["v1"]
+    dataset = LazyDataset("test-versioned", lambda version: {"version": version}, version=lambda: versions[-1])
+
+    assert dataset.reload_if_changed() is False  # not loaded yet
+    assert dataset.get() == {"version": "v1"}
+    assert dataset.reload_if_changed() is False
+
+    versions.append("v2")
+    assert dataset.reload_if_changed() is False  # wait one check in case it's mid-write
+    assert dataset.get() == {"version": "v1"}
+    assert dataset.reload_if_changed() is True
+    assert dataset.get() == {"version": "v2"}
+    assert dataset.version == "v2"
+
+    versions.append(None)
+    assert dataset.reload_if_changed() is False
+    assert dataset.get() == {"version": "v2"}
@@ -0,0 +1,62 @@
+import datetime
+import pytest
+import package_cache
+from package_cache import package_issn_cache
+
+def test_package_issn_cache_reloads_only_changed_issns(monkeypatch):
+    # no background invalidation checks
+    monkeypatch.setitem(package_cache._invalidations_state, "thread", "test")
+    db_values = {"0379-4172": 10, "1877-3435": 20}
+    calls = []
+
+    @package_issn_cache("test-data-type")
+    def get_test_values(package_id, issn_ls=None):
+        calls.append(issn_ls)
+        return {k: v for k, v in db_values.items() if issn_ls is None or k in issn_ls}
+
+    assert get_test_values("package-test") == {"0379-4172": 10, "1877-3435": 20}
+    assert get_test_values("package-test") == {"0379-4172": 10, "1877-3435": 20}
+    assert calls == [None]
+
+    db_values["1877-3435"] = 21
+    del db_values["0379-4172"]
+    package_cache._reload_issns("package-test", "test-data-type", ["1877-3435", "0379-4172"])
+    assert get_test_values("package-test") == {"1877-3435": 21}
+    assert calls == [None, ["1877-3435", "0379-4172"]]
+
+    package_cache._reload_issns("package-test", "test-data-type", None)
+    get_test_values("package-test")
+    assert calls[-1] is None
+
+def test_late_invalidations_are_applied_once(monkeypatch):
+    from app import get_db_cursor
+    reloads = []
+    monkeypatch.setattr(package_cache, "_reload_issns", lambda package_id, data_type, issn_ls: reloads.append((package_id, issn_ls)))
+    monkeypatch.setitem(package_cache._loaders, "test-late", lambda package_id, issn_ls=None: {})
+    # this process has already seen everything up to now
+    monkeypatch.setattr(package_cache, "_invalidations_state",
+                        {"last_updated": datetime.datetime.utcnow(), "applied": set(), "thread": "test"})
+
+    # committed after the watermark moved past the time it was stamped with
+    with get_db_cursor() as cursor:
+        cursor.execute("""insert into jump_cache_invalidation (package_id, data_type, issn_l, updated)
+            values ('package-test-late', 'test-late', '0379-4172', dateadd(second, -10, sysdate))""")
+
+    package_cache._apply_remote_invalidations()
+    package_cache._apply_remote_invalidations()
+    assert reloads == [("package-test-late", set(["0379-4172"]))]
+
+def test_package_issn_cache_keeps_recently_used(monkeypatch):
+    monkeypatch.setitem(package_cache._invalidations_state, "thread", "test")
+    monkeypatch.setattr(package_cache, "_cache_dict", package_cache.OrderedDict())
+    monkeypatch.setattr(package_cache, "PACKAGE_CACHE_SIZE", 2)
+    calls = []
+
+    @package_issn_cache("test-lru")
+    def get_test_values(package_id, issn_ls=None):
+        calls.append(package_id)
+        return {}
+
+    for package_id in ["package-a", "package-b", "package-a", "package-c", "package-a", "package-b"]:
+        get_test_values(package_id)
+    assert calls == ["package-a", "package-b", "package-c", "package-b"]
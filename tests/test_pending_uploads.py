@@ -0,0 +1,39 @@
+import datetime
+import pending_uploads
+from pending_uploads import PendingUploadsIndex, parse_preprocess_key
+
+def test_parse_preprocess_key():
+    assert parse_preprocess_key("package-test_counter-trj2.xlsx") == ("package-test", "counter-trj2")
+    assert parse_preprocess_key("not-a-valid-file.csv") is None
+
+def test_pending_uploads_index_refresh_add_remove():
+    uploaded = datetime.datetime(2022, 1, 20, tzinfo=datetime.timezone.utc)
+    index = PendingUploadsIndex()
+    index.refresh({"Contents": [
+        {"Key": "package-test_counter.xlsx", "LastModified": uploaded},
+        {"Key": "junk.csv", "LastModified": uploaded},
+    ]})
+    assert index.get("package-test") == {"counter": datetime.datetime(2022, 1, 20)}
+
+    index.add("package-test", "price")
+    assert sorted(index.get("package-test").keys()) == ["counter", "price"]
+
+    index.remove("package-test", "counter")
+    index.remove("package-other", "counter")
+    assert list(index.get("package-test").keys()) == ["price"]
+    assert index.get("package-other") == {}
+
+    # a newer upload of the same file stays
+    index.add("package-test", "price", datetime.datetime(2022, 1, 21))
+    index.remove("package-test", "price", datetime.datetime(2022, 1, 20))
+    assert list(index.get("package-test").keys()) == ["price"]
+
+
+def test_failed_first_refresh_still_starts_thread(monkeypatch):
+    def list_objects(Bucket):
+        raise Exception("s3 is down")
+    monkeypatch.setattr(pending_uploads.s3_client, "list_objects", list_objects)
+
+    index = PendingUploadsIndex(refresh_seconds=3600)
+    assert index.get("package-test") == {}
+    assert index.refresh_thread.is_alive()
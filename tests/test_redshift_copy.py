@@ -0,0 +1,23 @@
+import csv
+import datetime
+import gzip
+from redshift_copy import CopyStagingFile, copy_value
+
+def test_copy_value():
+    assert copy_value(None) == ""
+    assert copy_value(True) == "true"
+    assert copy_value(False) == "false"
+    assert copy_value(datetime.datetime(2022, 1, 20, 3, 4, 5)) == "2022-01-20T03:04:05"
+    assert copy_value("O'Reilly") == "O'Reilly"
+    assert copy_value(12.5) == 12.5
+
+def test_copy_staging_file_writes_gzipped_csv():
+    staging_file = CopyStagingFile("test", ["issn_l", "title", "is_oa"])
+    staging_file.writerow(("0000-0001", 'A "quoted", title', True))
+    staging_file.writerows([("0000-0002", None, False)])
+    staging_file.close()
+    assert staging_file.num_rows == 2
+
+    with gzip.open(staging_file.filename, "rt", encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [["0000-0001", 'A "quoted", title', "true"], ["0000-0002", "", "false"]]
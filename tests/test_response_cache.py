@@ -0,0 +1,36 @@
+import response_cache
+from response_cache import bump_content_versions, content_keys_for_path, make_etag, package_key, scenario_key
+
+package_id = "test-response-cache-package"
+
+def test_content_keys_for_path():
+    content_keys = content_keys_for_path({"package_id": package_id}, {"institution_id": "institution-test"})
+    assert content_keys == [package_key(package_id), "institution:institution-test"]
+    assert content_keys_for_path(None) == []
+
+def test_bump_changes_etag(monkeypatch):
+    monkeypatch.setattr(response_cache, "CONTENT_SETTLE_SECONDS", 0)
+    (etag, is_settled) = make_etag("/package/{}".format(package_id), [package_key(package_id)])
+    bump_content_versions([package_key(package_id)])
+    (new_etag, is_settled) = make_etag("/package/{}".format(package_id), [package_key(package_id)])
+    assert new_etag != etag
+
+def test_recent_bump_is_not_settled(monkeypatch):
+    monkeypatch.setattr(response_cache, "CONTENT_SETTLE_SECONDS", 3600)
+    bump_content_versions([scenario_key("test-response-cache-scenario")])
+    (etag, is_settled) = make_etag("/scenario/test-response-cache-scenario/journals", [scenario_key("test-response-cache-scenario")])
+    assert not is_settled
+
+def test_cached_response_lru(monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_SIZE", 1)
+    response_cache.set_cached_response("etag-a", b"a", "application/json")
+    response_cache.set_cached_response("etag-b", b"b", "application/json")
+    assert response_cache.get_cached_response("etag-a") is None
+    assert response_cache.get_cached_response("etag-b") == (b"b", "application/json")
+
+def test_prune_keeps_versions():
+    content_key = package_key(package_id)
+    bump_content_versions([content_key])
+    versions = response_cache.get_content_versions([content_key])
+    response_cache.prune_content_versions(days=0)
+    assert response_cache.get_content_versions([content_key]) == versions
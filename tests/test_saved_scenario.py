@@ -1,5 +1,7 @@
 import pytest
+from app import get_db_cursor
 from saved_scenario import SavedScenario,save_raw_scenario_to_db,get_latest_scenario_raw,get_latest_scenario
+from saved_scenario import save_raw_scenarios_to_db,get_latest_scenarios_raw,parse_scenario
 
 scenario_id2 = '8kPSbFCN' # scott+anothertest@ourresearch.org, "Sage-HopeCollege"/"potatoes"
 
@@ -58,6 +60,50 @@ def test_get_latest_scenario():
     my_dict['configs']['description'] = ""
     save_raw_scenario_to_db(scenario_id2, my_dict, None)
 
+def test_get_latest_scenarios_raw():
+    one_at_a_time = get_latest_scenario_raw(scenario_id2)
+    batched = get_latest_scenarios_raw([scenario_id2, scenario_id2, "not-a-scenario-id"])
+
+    assert list(batched.keys()) == [scenario_id2]
+    assert batched[scenario_id2] == one_at_a_time
+
+def test_save_raw_scenarios_to_db():
+    (updated, my_dict) = get_latest_scenario_raw(scenario_id2)
+    save_raw_scenarios_to_db({scenario_id2: my_dict}, None)
+
+    (updated_after, dict_after) = get_latest_scenarios_raw([scenario_id2])[scenario_id2]
+    assert updated_after > updated
+    assert dict_after == my_dict
+
+def test_latest_scenario_details_follow_saves():
+    (updated, my_dict) = get_latest_scenario_raw(scenario_id2)
+    save_raw_scenario_to_db(scenario_id2, my_dict, None)
+
+    with get_db_cursor() as cursor:
+        cursor.execute("select max(updated) as updated from jump_scenario_details_paid where scenario_id=%s", (scenario_id2,))
+        history_updated = cursor.fetchone()["updated"]
+        cursor.execute("select count(*) as num_rows from jump_scenario_details_latest where scenario_id=%s", (scenario_id2,))
+        num_latest_rows = cursor.fetchone()["num_rows"]
+
+    assert num_latest_rows == 1
+    assert get_latest_scenario_raw(scenario_id2)[0] == history_updated
+
+def test_parse_scenario_cache():
+    scenario_json = '{"subrs": ["0000-0001", "0000-0002"], "customSubrs": [], "configs": {"weight_citation": 10}}'
+    parsed = parse_scenario("test-parse-scenario", "2022-01-01T00:00:00", scenario_json)
+
+    assert parse_scenario("test-parse-scenario", "2022-01-01T00:00:00", scenario_json) is parsed
+    assert parse_scenario("test-parse-scenario", "2022-01-02T00:00:00", scenario_json) is not parsed
+    assert parsed.subscription_set == frozenset(["0000-0001", "0000-0002"])
+    assert parsed["member_added_subrs"] == []
+
+    # copies can be changed without touching the cached one
+    my_dict = parsed.to_dict()
+    my_dict["subrs"].append("0000-0003")
+    my_dict["configs"]["weight_citation"] = 5
+    assert parsed["subrs"] == ["0000-0001", "0000-0002"]
+    assert parsed["configs"]["weight_citation"] == 10
+
 def test_saved_scenario():
     scenario_by_query = SavedScenario.query.get(scenario_id2)
     scenario_by_id = SavedScenario(False, scenario_id2, None)
@@ -68,7 +68,8 @@ class User(db.Model):
         return dicts
 
     def has_permission(self, institution_id, permission):
-        return permission.name in self.to_dict_permissions().get(institution_id, {}).get('permissions', [])
+        from permission import user_permission_names
+        return permission.name in user_permission_names(self.id).get(institution_id, set())
 
     def __repr__(self):
         return "<{} ({}) {}, {}>".format(self.__class__.__name__, self.id, self.email, self.display_name)
@@ -9,6 +9,7 @@ from flask import url_for
 from flask import Response
 from flask import send_file
 from flask import g
+from flask import stream_with_context
 from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity
 from pyinstrument import Profiler
 from sqlalchemy import func as sql_func
@@ -27,6 +28,7 @@ import csv
 import shortuuid
 import datetime
 import tempfile
+import threading
 import random
 from collections import OrderedDict
 
@@ -46,7 +48,11 @@ from institution import Institution
 from journal_price import JournalPrice, JournalPriceInput
 from filter_titles import FilterTitles, FilterTitlesInput
 from package import Package
+from package_summary import package_summary_dict
+from package_summary import queue_package_summary_update
+from package_summary import refresh_package_summary
 from permission import Permission, UserInstitutionPermission
+from permission import forget_user_permission_names
 from perpetual_access import PerpetualAccess, PerpetualAccessInput
 from ror_id import RorId, RorGridCrosswalk
 from saved_scenario import SavedScenario
@@ -59,6 +65,21 @@ from scenario import get_common_package_data
 from scenario import get_clean_package_id
 from consortium import get_consortium_ids
 from consortium import Consortium
+from consortium_progress import get_progress
+from consortium_progress import progress_event_stream
+from scenario_export import export_get
+from scenario_export import scenario_export_table_dicts
+from jobs import get_job
+from jobs import submit_job
+from response_cache import make_etag
+from response_cache import get_cached_response
+from response_cache import set_cached_response
+from response_cache import bump_content_versions
+from response_cache import content_keys_for_path
+from response_cache import scenario_key
+from response_cache import package_key
+from response_cache import institution_key
+from response_cache import USERS_KEY
 from user import User, default_password
 
 from util import jsonify_fast
@@ -75,6 +96,10 @@ from app import logger
 
 from app import DEMO_PACKAGE_ID
 from app import s3_client
+from lazy_data import preload_datasets
+from pending_uploads import pending_uploads_index
+from pending_uploads import parse_preprocess_key
+from pending_uploads import upload_preprocess_bucket
 
 
 def s3_cache_get(url):
@@ -122,6 +147,38 @@ def authenticate_for_package(publisher_id, required_permission):
     return package
 
 
+def etag_matches(etag):
+    # flask_compress adds :gzip to the etags of responses it compresses
+    return any([tag.split(":")[0] == etag for tag in request.if_none_match.as_set()])
+
+
+def versioned_response(content_keys, build_dict, is_cacheable=None, request_key_extra=""):
+    # the ETag comes from the content versions, so it's known before the dict is built.
+    # a matching If-None-Match gets a 304 and nothing is built at all.
+    # check permissions before calling this, the cached bytes don't know who can see them.
+    request_args = sorted([(k, v) for (k, v) in request.args.items(multi=True) if k not in ("jwt", "secret")])
+    request_key = "{} {} {}".format(request.path, request_args, request_key_extra)
+    (etag, is_settled) = make_etag(request_key, content_keys)
+    if is_settled and etag_matches(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    cached = get_cached_response(etag) if is_settled else None
+    if cached:
+        (body, mimetype) = cached
+        response = Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        return response
+
+    response_dict = build_dict()
+    response = jsonify_fast_no_sort(response_dict)
+    if is_settled and (is_cacheable is None or is_cacheable(response_dict)):
+        set_cached_response(etag, response.get_data(), response.mimetype)
+        response.set_etag(etag)
+    return response
+
+
 def authenticated_user():
     jwt_identity = get_jwt_identity()
     user_id = jwt_identity.get("user_id", None) if jwt_identity else None
@@ -153,13 +210,21 @@ def after_request_stuff(resp):
     resp.headers["Access-Control-Allow-Origin"] = "*"
     resp.headers["Access-Control-Allow-Methods"] = "POST, GET, OPTIONS, PUT, DELETE, PATCH"
     resp.headers["Access-Control-Allow-Headers"] = "Origin, X-Requested-With, Content-Type, Accept, Authorization, Cache-Control"
-    resp.headers["Access-Control-Expose-Headers"] = "Authorization, Cache-Control"
+    resp.headers["Access-Control-Expose-Headers"] = "Authorization, Cache-Control, ETag"
     resp.headers["Access-Control-Allow-Credentials"] = "true"
 
     # make not cacheable because the GETs change after parameter change posts!
+    # (no_cache still lets the browser keep it and check back with If-None-Match)
     resp.cache_control.max_age = 0
     resp.cache_control.no_cache = True
 
+    # anything a POST or DELETE changed gets a new content version, see response_cache.py
+    if request.method not in ("GET", "HEAD", "OPTIONS") and 200 <= resp.status_code < 300:
+        content_keys = content_keys_for_path(request.view_args, request.get_json(silent=True))
+        if request.path.startswith("/user") and request.path != "/user/login":
+            content_keys.append(USERS_KEY)
+        bump_content_versions(content_keys)
+
     if app.config["PROFILE_REQUESTS"]:
         g.profiler.stop()
         print((g.profiler.output_text(str=True, color=True, show_all=True)))
@@ -460,6 +525,7 @@ def register_new_user():
     safe_commit(db)
 
     db.session.refresh(req_user)
+    forget_user_permission_names(req_user.id)
     new_permissions = req_user.to_dict_permissions()
 
     if new_user_created:
@@ -612,6 +678,7 @@ def user_permissions():
         safe_commit(db)
 
         db.session.refresh(query_user)
+        forget_user_permission_names(query_user.id)
         new_permissions = query_user.to_dict_permissions()
 
         notify_changed_permissions(query_user, auth_user, old_permissions, new_permissions)
@@ -662,7 +729,12 @@ def institution(institution_id):
     if not authorize_institution(inst, Permission.view()):
         return abort_json(403, "Must have read permission to get institution properties.")
 
-    return jsonify_fast_no_sort(inst.to_dict())
+    if request.method == "POST":
+        return jsonify_fast_no_sort(inst.to_dict())
+
+    content_keys = [institution_key(inst.id), USERS_KEY] + [package_key(p.package_id) for p in inst.packages]
+    # user_permissions marks which user is asking, so each user gets their own copy
+    return versioned_response(content_keys, inst.to_dict, request_key_extra=authenticated_user_id())
 
 
 @app.route("/institution/<institution_id>/ror/<ror_id>", methods=["POST", "DELETE"])
@@ -801,11 +873,11 @@ def get_package(package_id):
     if package_id.startswith("feedback"):
         return get_feedback(package_id)
 
-    authenticate_for_package(package_id, Permission.view())
-    package = Package.query.filter(Package.package_id == package_id).scalar()
-    package_dict = package.to_package_dict()
-    response = jsonify_fast_no_sort(package_dict)
-    return response
+    package = authenticate_for_package(package_id, Permission.view())
+    # data_files comes from this process's pending uploads too
+    pending_uploads = sorted(pending_uploads_index.get(package_id).items())
+    return versioned_response([package_key(package_id)], lambda: package_summary_dict(package),
+                              request_key_extra=pending_uploads)
 
 
 @app.route("/publisher/<publisher_id>", methods=["POST"])
@@ -859,7 +931,7 @@ def update_publisher(publisher_id):
     db.session.merge(publisher)
     safe_commit(db)
 
-    package_dict = publisher.to_package_dict()
+    package_dict = refresh_package_summary(publisher)
     return jsonify_fast_no_sort(package_dict)
 
 
@@ -897,7 +969,7 @@ def new_publisher():
     db.session.add(new_package)
     safe_commit(db)
 
-    package_dict = new_package.to_package_dict()
+    package_dict = refresh_package_summary(new_package)
     return jsonify_fast_no_sort(package_dict)
 
 
@@ -935,9 +1007,7 @@ def _load_package_file(package_id, req, file_type, table_class):
 def jump_data_file_status(package_id, data_file_name):
     authenticate_for_package(package_id, Permission.view())
     package = Package.query.filter(Package.package_id == package_id).scalar()
-    package_dict = package.to_package_dict()
-    data_files_list = package_dict["data_files"]
-    for data_file_dict in data_files_list:
+    for data_file_dict in package.data_files_list:
         if data_file_dict["name"] == data_file_name:
             return jsonify_fast_no_sort(data_file_dict)
     return abort_json(400, "Unknown data file type {}".format(data_file_name))
@@ -1109,6 +1179,19 @@ def post_subscription_guts(scenario_id, scenario_name=None):
 def post_member_institutions_included_guts(scenario_id):
     print("request.get_json()", request.get_json())
     save_raw_member_institutions_included_to_db(scenario_id, request.get_json()["member_institutions"], get_ip(request))
+    # the stored per journal sums are for the old set of members.  rebuilding them takes
+    # a few seconds, and until then the dashboard adjusts its in-memory totals, so don't wait
+    refresh_thread = threading.Thread(target=refresh_consortium_aggregate, args=(scenario_id,))
+    refresh_thread.daemon = True
+    refresh_thread.start()
+
+
+def refresh_consortium_aggregate(scenario_id):
+    try:
+        with app.app_context():
+            Consortium(scenario_id).refresh_computed_aggregate()
+    except Exception as e:
+        print("Error: exception {} refreshing consortium aggregate for {}".format(e, scenario_id))
 
 def post_feedback_on_member_institutions_included_guts(scenario_id):
     print("request.get_json()", request.get_json())
@@ -1125,7 +1208,7 @@ def scenario_id_post(scenario_id):
     if not request.is_json:
         return abort_json(400, "This post requires data.")
 
-    get_saved_scenario(scenario_id, required_permission=Permission.modify())
+    my_saved_scenario = get_saved_scenario(scenario_id, required_permission=Permission.modify())
 
     scenario_name = request.json.get("name", None)
     if scenario_name:
@@ -1138,6 +1221,7 @@ def scenario_id_post(scenario_id):
     my_timing = TimingMessages()
     post_subscription_guts(scenario_id, scenario_name)
     my_timing.log_timing("after post_subscription_guts()")
+    queue_package_summary_update(my_saved_scenario.package_id)
 
     consortium_ids = get_consortium_ids()
     if scenario_id in [d["scenario_id"] for d in consortium_ids]:
@@ -1181,11 +1265,12 @@ def subscriptions_notifications_done_editing_post(scenario_id):
 @app.route("/scenario/<scenario_id>/subscriptions", methods=["POST"])
 @jwt_required()
 def subscriptions_scenario_id_post(scenario_id):
-    get_saved_scenario(scenario_id, required_permission=Permission.modify())
+    my_saved_scenario = get_saved_scenario(scenario_id, required_permission=Permission.modify())
 
     my_timing = TimingMessages()
     post_subscription_guts(scenario_id)
     my_timing.log_timing("post_subscription_guts()")
+    queue_package_summary_update(my_saved_scenario.package_id)
 
     response = {"status": "success"}
     response["_timing"] = my_timing.to_dict()
@@ -1249,25 +1334,42 @@ def member_institutions_consortial_scenarios_scenario_id_post(scenario_id):
 @app.route("/scenario/<scenario_id>/summary", methods=["GET"])
 @jwt_required()
 def scenario_id_summary_get(scenario_id):
-    my_timing = TimingMessages()
-    my_saved_scenario = get_saved_scenario(scenario_id)
-    my_timing.log_timing("after setting live scenario")
-    my_timing.log_timing("after to_dict()")
-    return jsonify_fast_no_sort(my_saved_scenario.live_scenario.to_dict_summary())
+    my_saved_scenario = SavedScenario.query.get(scenario_id)
+    if not my_saved_scenario:
+        abort_json(404, "Scenario {} not found.".format(scenario_id))
+
+    def build_summary():
+        my_saved_scenario.set_live_scenario(None)
+        return my_saved_scenario.live_scenario.to_dict_summary()
+
+    content_keys = [scenario_key(scenario_id), package_key(my_saved_scenario.package_id)]
+    return versioned_response(content_keys, build_summary)
 
 @app.route("/scenario/<scenario_id>/journals", methods=["GET"])
 @jwt_required()
 def scenario_id_journals_get(scenario_id):
+    # the dashboard is rebuilt until a recompute finishes, so locked ones aren't cached
+    def is_cacheable(response_dict):
+        return not response_dict.get("is_locked_pending_update", False)
+
     consortium_ids = get_consortium_ids()
-    if scenario_id in [d["scenario_id"] for d in consortium_ids]:
-        my_consortium = Consortium(scenario_id)
-        my_saved_scenario_dict = my_consortium.to_dict_journals()
+    for row in consortium_ids:
+        if scenario_id == row["scenario_id"]:
+            content_keys = [scenario_key(scenario_id), package_key(row["package_id"])]
+            return versioned_response(content_keys, lambda: Consortium(scenario_id).to_dict_journals(), is_cacheable)
+
+    my_saved_scenario = SavedScenario.query.get(scenario_id)
+    if not my_saved_scenario:
+        abort_json(404, "Scenario {} not found.".format(scenario_id))
+    # get_saved_scenario would build the whole scenario just to check permissions
+    if my_saved_scenario.package.institution_id:
+        authenticate_for_package(my_saved_scenario.package.package_id, Permission.view())
     else:
-        my_saved_scenario = get_saved_scenario(scenario_id, required_permission=Permission.view())
-        my_saved_scenario_dict = my_saved_scenario.to_dict_journals()
+        abort_json(400, "Scenario package {} has no institution_id. Can't decide how to authenticate.".format(
+            my_saved_scenario.package.package_id))
 
-    response = jsonify_fast_no_sort(my_saved_scenario_dict)
-    return response
+    content_keys = [scenario_key(scenario_id), package_key(my_saved_scenario.package_id)]
+    return versioned_response(content_keys, my_saved_scenario.to_dict_journals, is_cacheable)
 
 
 @app.route("/scenario/<scenario_id>/member-institutions", methods=["GET"])
@@ -1281,6 +1383,32 @@ def scenario_member_institutions_get(scenario_id):
     return abort_json(404, "not a consortium scenario_id")
 
 
+def get_consortium_row_for_progress(scenario_id):
+    for row in get_consortium_ids():
+        if scenario_id == row["scenario_id"]:
+            authenticate_for_package(row["package_id"], Permission.view())
+            return row
+    return abort_json(404, "not a consortium scenario_id")
+
+
+@app.route("/scenario/<scenario_id>/progress", methods=["GET"])
+@jwt_required()
+def scenario_progress_get(scenario_id):
+    get_consortium_row_for_progress(scenario_id)
+    return jsonify_fast_no_sort({"progress": get_progress(scenario_id)})
+
+
+@app.route("/scenario/<scenario_id>/progress/stream", methods=["GET"])
+@jwt_required()
+def scenario_progress_stream_get(scenario_id):
+    # server-sent events.  EventSource can't send headers, so pass the jwt as ?jwt=
+    get_consortium_row_for_progress(scenario_id)
+    response = Response(stream_with_context(progress_event_stream(scenario_id)), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
 @app.route("/package/<package_id>/member-institutions", methods=["GET"])
 @jwt_required()
 def package_member_institutions_get(package_id):
@@ -1338,36 +1466,6 @@ def live_institution_id_apc_get(institution_id):
     else:
         return jsonify_fast_no_sort(results)
 
-def export_get(table_dicts, is_main_export=True):
-    if not table_dicts:
-        return []
-
-    if is_main_export:
-        keys = ['issn_l_prefixed', 'issn_l', 'title', 'issns', 'publisher_journal', 'subject', 'subject_top_three', 'subjects_all', 'subscribed', 'is_society_journal', 'usage', 'subscription_cost', 'ill_cost', 'cpu', 'cpu_rank', 'cost', 'instant_usage_percent', 'free_instant_usage_percent', 'subscription_minus_ill_cost', 'use_oa_percent', 'use_backfile_percent', 'use_subscription_percent', 'use_ill_percent', 'use_other_delayed_percent', 'perpetual_access_years_text', 'baseline_access_text', 'bronze_oa_embargo_months', 'downloads', 'citations', 'authorships', 'cpu_fuzzed', 'subscription_cost_fuzzed', 'subscription_minus_ill_cost_fuzzed', 'usage_fuzzed', 'downloads_fuzzed', 'citations_fuzzed', 'authorships_fuzzed']
-    else:
-        keys = ['scenario_id', 'institution_code', 'package_id', 'institution_name', 'issn_l_prefixed', 'issn_l', 'subscribed_by_consortium', 'subscribed_by_member_institution', 'core_plus_for_member_institution', 'title', 'issns',  'subscription_cost', 'ill_cost', 'cpu', 'usage', 'downloads', 'citations', 'authorships', 'use_oa', 'use_backfile', 'use_subscription', 'use_ill', 'use_other_delayed', 'perpetual_access_years', 'bronze_oa_embargo_months',  'is_society_journal']
-
-    filename = "export.csv"
-    with open(filename, "w", encoding="utf-8") as file:
-        csv_writer = csv.writer(file)
-
-        headers = ['publisher' if w == 'publisher_journal' else w for w in keys]
-        csv_writer.writerow(headers)
-        for table_dict in table_dicts:
-            row = []
-            for my_key in keys:
-                if my_key == "issn_l_prefixed":
-                    row.append("issn:{}".format(table_dict["issn_l"]))
-                else:
-                    row.append(table_dict.get(my_key, None))
-            csv_writer.writerow(row)
-
-    with open(filename, "r") as file:
-        contents = file.readlines()
-
-    return contents
-
-
 @app.route("/scenario/<scenario_id>/export_subscriptions.txt", methods=["GET"])
 @jwt_required()
 def scenario_id_export_subscriptions_txt_get(scenario_id):
@@ -1413,13 +1511,17 @@ def scenario_id_member_institutions_export_text_get(scenario_id):
 def scenario_id_export_csv_get(scenario_id):
 
     consortium_ids = get_consortium_ids()
-    if scenario_id in [d["scenario_id"] for d in consortium_ids]:
-        my_consortium = Consortium(scenario_id)
-        table_dicts = my_consortium.to_dict_journals()["journals"]
-    else:
-        my_saved_scenario = get_saved_scenario(scenario_id, required_permission=Permission.view())
-        table_dicts = my_saved_scenario.to_dict_journals(gather_export_concepts = True)["journals"]
+    is_consortium = scenario_id in [d["scenario_id"] for d in consortium_ids]
+    if not is_consortium:
+        get_saved_scenario(scenario_id, required_permission=Permission.view())
 
+    if is_async_request():
+        # big scenarios can take longer than heroku allows, the csv comes from /job/<job_id>/result
+        job = submit_job("scenario_export", {"scenario_id": scenario_id, "gather_export_concepts": not is_consortium},
+                         created_by=authenticated_user_id())
+        return job_accepted_response(job)
+
+    table_dicts = scenario_export_table_dicts(scenario_id, gather_export_concepts=not is_consortium)
     contents = export_get(table_dicts)
     return Response(contents, mimetype="text/csv")
 
@@ -1473,12 +1575,17 @@ def scenario_post(package_id):
     print("new_saved_scenario", new_saved_scenario)
     safe_commit(db)
 
+    job = None
     consortium_ids = get_consortium_ids()
     if package_id in [d["package_id"] for d in consortium_ids]:
         if copy_scenario_id:
             consortia_to_copy_from = Consortium(copy_scenario_id)
             save_raw_member_institutions_included_to_db(new_scenario_id, consortia_to_copy_from.member_institution_included_list, get_ip(request))
-            consortia_to_copy_from.copy_computed_journal_dicts(new_scenario_id)
+            if is_async_request():
+                job = submit_job("copy_consortium_scenario", {"from_scenario_id": copy_scenario_id, "new_scenario_id": new_scenario_id},
+                                 created_by=authenticated_user_id())
+            else:
+                consortia_to_copy_from.copy_computed_journal_dicts(new_scenario_id)
         else:
             new_consortia = Consortium(new_scenario_id)
             save_raw_member_institutions_included_to_db(new_scenario_id, new_consortia.member_institution_included_list, get_ip(request))
@@ -1486,7 +1593,11 @@ def scenario_post(package_id):
             new_consortia.queue_for_recompute(login_user.email)
 
     my_new_scenario = get_saved_scenario(new_scenario_id, required_permission=Permission.view())
+    queue_package_summary_update(package_id)
 
+    if is_async_request():
+        # the journals come from GET /scenario/<id>/journals once any job is done
+        return job_accepted_response(job, {"scenario": my_new_scenario.to_dict_meta()})
     return jsonify_fast_no_sort(my_new_scenario.to_dict_journals())
 
 
@@ -1521,33 +1632,90 @@ def publisher_scenario_post(publisher_id):
 
     save_raw_scenario_to_db(new_scenario_id, dict_to_save, get_ip(request))
 
+    job = None
     consortium_ids = get_consortium_ids()
     if publisher_id in [d["package_id"] for d in consortium_ids]:
         if copy_scenario_id:
             consortia_to_copy_from = Consortium(copy_scenario_id)
             save_raw_member_institutions_included_to_db(new_scenario_id, consortia_to_copy_from.member_institution_included_list, get_ip(request))
-            consortia_to_copy_from.copy_computed_journal_dicts(new_scenario_id)
+            if is_async_request():
+                job = submit_job("copy_consortium_scenario", {"from_scenario_id": copy_scenario_id, "new_scenario_id": new_scenario_id},
+                                 created_by=authenticated_user_id())
+            else:
+                consortia_to_copy_from.copy_computed_journal_dicts(new_scenario_id)
         else:
             new_consortia = Consortium(new_scenario_id)
             save_raw_member_institutions_included_to_db(new_scenario_id, new_consortia.member_institution_included_list, get_ip(request))
-            new_consortia.recompute_journal_dicts()
+            if is_async_request():
+                job = submit_job("consortium_recompute", {"scenario_id": new_scenario_id}, created_by=authenticated_user_id())
+            else:
+                new_consortia.recompute_journal_dicts()
 
     my_new_scenario = get_saved_scenario(new_scenario_id, required_permission=Permission.view())
+    queue_package_summary_update(publisher_id)
 
+    if is_async_request():
+        return job_accepted_response(job, {"scenario": my_new_scenario.to_dict_meta()})
     return jsonify_fast_no_sort(my_new_scenario.to_dict_meta())
 
 
+def is_async_request():
+    # ?async=true: hand the slow part to the jobs process and answer straight away
+    return str2bool(request.args.get("async", "false"))
+
+
+def authenticated_user_id():
+    jwt_identity = get_jwt_identity()
+    return jwt_identity.get("user_id", None) if jwt_identity else None
+
+
+def job_accepted_response(job, response=None):
+    response = response or {}
+    response["job"] = job.to_dict() if job else None
+    my_response = jsonify_fast_no_sort(response)
+    if job:
+        my_response.status_code = 202
+    return my_response
+
+
+@app.route("/job/<job_id>", methods=["GET"])
+@jwt_required()
+def job_get(job_id):
+    job = get_job(job_id)
+    if not job:
+        return abort_json(404, "Job {} not found.".format(job_id))
+    if job.created_by and job.created_by != authenticated_user_id():
+        return abort_json(403, "Job {} belongs to another user.".format(job_id))
+    return jsonify_fast_no_sort(job.to_dict())
+
+
+@app.route("/job/<job_id>/result", methods=["GET"])
+@jwt_required()
+def job_result_get(job_id):
+    job = get_job(job_id)
+    if not job:
+        return abort_json(404, "Job {} not found.".format(job_id))
+    if job.created_by and job.created_by != authenticated_user_id():
+        return abort_json(403, "Job {} belongs to another user.".format(job_id))
+    if not job.is_finished:
+        return abort_json(409, "Job {} is {}.".format(job_id, job.status))
+    if job.result_s3_object:
+        return Response(job.get_result_file(), mimetype=job.result_content_type)
+    return jsonify_fast_no_sort({"result": job.result, "error": job.error})
+
+
 @app.route("/scenario/<scenario_id>", methods=["DELETE"])
 @jwt_required()
 def scenario_delete(scenario_id):
     # just delete it out of the table, leave the saves
     # doing it this way makes sure we have permission to acces and therefore delete the scenario
-    get_saved_scenario(scenario_id, required_permission=Permission.modify())
+    my_saved_scenario = get_saved_scenario(scenario_id, required_permission=Permission.modify())
 
     command = "delete from jump_package_scenario where scenario_id=%s"
     print(command)
     with get_db_cursor() as cursor:
         cursor.execute(command, (scenario_id,))
+    queue_package_summary_update(my_saved_scenario.package_id)
 
     return jsonify_fast_no_sort({"response": "success"})
 
@@ -1664,12 +1832,22 @@ def admin_accounts_get():
     return Response(contents, mimetype="text/text")
 
 
+@app.route("/admin/db-pool-stats", methods=["GET"])
+def admin_db_pool_stats():
+    key = request.args.get("key", "This is not the key you are looking for")
+    if key != os.getenv("OURRESEARCH_ADMIN_VIEW_KEY"):
+        return abort_json(401, "Must provide admin view key")
+
+    # stats are per process, so this is only the dyno that answered
+    return jsonify_fast_no_sort(app.config["postgreSQL_pool"].stats.to_dict())
+
+
 @app.route("/publisher/<package_id>/sign-s3")
 @jwt_required()
 def sign_s3(package_id):
     authenticate_for_package(package_id, Permission.modify())
 
-    upload_bucket = "unsub-file-uploads-preprocess-testing" if os.getenv("TESTING_DB") else "unsub-file-uploads-preprocess"
+    upload_bucket = upload_preprocess_bucket()
     file_name = request.args.get("filename")
 
     presigned_post = s3_client.generate_presigned_post(
@@ -1677,6 +1855,11 @@ def sign_s3(package_id):
         Key = file_name,
         ExpiresIn = 60*60 # one hour
     )
+
+    # show the file as pending right away, before the next listing of the bucket
+    parsed_file_name = parse_preprocess_key(file_name or "")
+    if parsed_file_name and parsed_file_name[0] == package_id:
+        pending_uploads_index.add(package_id, parsed_file_name[1])
     return json.dumps({
     "data": presigned_post,
     "url": "https://{}.s3.amazonaws.com/{}".format(upload_bucket, file_name)
@@ -1796,6 +1979,10 @@ def sign_s3(package_id):
 #     return jsonify_fast_no_sort({"response": response})
 
 
+# load the big datasets now rather than on the first requests (see lazy_data.py)
+preload_datasets()
+
+
 #  flask run -h 0.0.0.0 -p 5004 --with-threads --reload
 if __name__ == "__main__":
 